@@ -0,0 +1,1173 @@
+# Copyright (C) 2005  Robert Collins <robertc@robertcollins.net>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+"""The subunit v1 protocol, and the unittest integration built on it.
+
+Everything here is part of the pysubunit API, and is loaded from the pysubunit
+package on first use so that tools which only handle v2 streams do not pay
+for testtools and the v1 machinery.
+"""
+
+import datetime
+import os
+import re
+import subprocess
+import sys
+import unittest
+
+from dateutil import parser as date_parser
+import iso8601
+import testtools
+from testtools import compat
+from testtools.testresult.real import _StringException
+
+from pysubunit import chunked
+from pysubunit import details
+from pysubunit import DiscardStream
+from pysubunit import join_dir
+from pysubunit import make_stream_binary
+from pysubunit import PROGRESS_CUR
+from pysubunit import PROGRESS_POP
+from pysubunit import PROGRESS_PUSH
+from pysubunit import PROGRESS_SET
+from pysubunit import tags_to_new_gone
+from pysubunit import v2
+
+# The format TestProtocolClient.time writes; anything else is handed to
+# dateutil.
+_time_format = re.compile(
+    compat._b(r'(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?Z\Z'))
+
+
+class _ParserState(object):
+    """State for the subunit parser."""
+
+    def __init__(self, parser):
+        self.parser = parser
+        self._colon_sym = compat._b(':')
+        # Directive (without its colon) -> handler. Built per instance so
+        # that handlers overridden by each state are picked up.
+        self._dispatch = {}
+        for names, handler in (
+                (('test', 'testing'), self.startTest),
+                (('error',), self.addError),
+                (('failure',), self.addFailure),
+                (('progress',), self._progress),
+                (('skip',), self.addSkip),
+                (('success', 'successful'), self.addSuccess),
+                (('tags',), self._tags),
+                (('time',), self._time),
+                (('xfail',), self.addExpectedFail),
+                (('uxsuccess',), self.addUnexpectedSuccess)):
+            for name in names:
+                self._dispatch[compat._b(name)] = handler
+        # Most lines in a noisy stream are not directives; these are the
+        # only first bytes that a directive can start with.
+        self._directive_starts = frozenset(
+            cmd[:1] for cmd in self._dispatch)
+        self._start_simple = compat._u(" [")
+        self._start_multipart = compat. _u(" [ multipart")
+
+    def addError(self, offset, line):
+        """An 'error:' directive has been read."""
+        self.parser.stdOutLineReceived(line)
+
+    def addExpectedFail(self, offset, line):
+        """An 'xfail:' directive has been read."""
+        self.parser.stdOutLineReceived(line)
+
+    def addFailure(self, offset, line):
+        """A 'failure:' directive has been read."""
+        self.parser.stdOutLineReceived(line)
+
+    def addSkip(self, offset, line):
+        """A 'skip:' directive has been read."""
+        self.parser.stdOutLineReceived(line)
+
+    def addSuccess(self, offset, line):
+        """A 'success:' directive has been read."""
+        self.parser.stdOutLineReceived(line)
+
+    def addUnexpectedSuccess(self, offset, line):
+        """A 'uxsuccess:' directive has been read."""
+        self.parser.stdOutLineReceived(line)
+
+    def _progress(self, offset, line):
+        self.parser._handleProgress(offset, line)
+
+    def _tags(self, offset, line):
+        self.parser._handleTags(offset, line)
+        self.parser.subunitLineReceived(line)
+
+    def _time(self, offset, line):
+        self.parser._handleTime(offset, line)
+        self.parser.subunitLineReceived(line)
+
+    def lineReceived(self, line):
+        """a line has been received."""
+        if line[:1] in self._directive_starts:
+            parts = line.split(None, 1)
+            if len(parts) == 2 and line.startswith(parts[0]):
+                cmd = parts[0]
+                handler = self._dispatch.get(cmd.rstrip(self._colon_sym))
+                if handler is not None:
+                    handler(len(cmd) + 1, line)
+                    return
+        self.parser.stdOutLineReceived(line)
+
+    def lostConnection(self):
+        """Connection lost."""
+        self.parser._lostConnectionInTest(compat._u('unknown state of '))
+
+    def startTest(self, offset, line):
+        """A test start command received."""
+        self.parser.stdOutLineReceived(line)
+
+
+class _InTest(_ParserState):
+    """State for the subunit parser after reading a test: directive."""
+
+    def _outcome(self, offset, line, no_details, details_state):
+        """An outcome directive has been read.
+
+        :param no_details: Callable to call when no details are presented.
+        :param details_state: The state to switch to for details
+            processing of this outcome.
+        """
+        test_name = line[offset:-1].decode('utf8')
+        if self.parser.current_test_description == test_name:
+            self.parser._state = self.parser._outside_test
+            self.parser.current_test_description = None
+            no_details()
+            self.parser.client.stopTest(self.parser._current_test)
+            self.parser._current_test = None
+            self.parser.subunitLineReceived(line)
+        elif self.parser.current_test_description + self._start_simple == \
+            test_name:
+            self.parser._state = details_state
+            details_state.set_simple()
+            self.parser.subunitLineReceived(line)
+        elif self.parser.current_test_description + self._start_multipart == \
+            test_name:
+            self.parser._state = details_state
+            details_state.set_multipart()
+            self.parser.subunitLineReceived(line)
+        else:
+            self.parser.stdOutLineReceived(line)
+
+    def _error(self):
+        self.parser.client.addError(self.parser._current_test,
+                                    details={})
+
+    def addError(self, offset, line):
+        """An 'error:' directive has been read."""
+        self._outcome(offset, line, self._error,
+                      self.parser._reading_error_details)
+
+    def _xfail(self):
+        self.parser.client.addExpectedFailure(self.parser._current_test,
+                                              details={})
+
+    def addExpectedFail(self, offset, line):
+        """An 'xfail:' directive has been read."""
+        self._outcome(offset, line, self._xfail,
+                      self.parser._reading_xfail_details)
+
+    def _uxsuccess(self):
+        self.parser.client.addUnexpectedSuccess(self.parser._current_test)
+
+    def addUnexpectedSuccess(self, offset, line):
+        """A 'uxsuccess:' directive has been read."""
+        self._outcome(offset, line, self._uxsuccess,
+                      self.parser._reading_uxsuccess_details)
+
+    def _failure(self):
+        self.parser.client.addFailure(self.parser._current_test, details={})
+
+    def addFailure(self, offset, line):
+        """A 'failure:' directive has been read."""
+        self._outcome(offset, line, self._failure,
+                      self.parser._reading_failure_details)
+
+    def _skip(self):
+        self.parser.client.addSkip(self.parser._current_test, details={})
+
+    def addSkip(self, offset, line):
+        """A 'skip:' directive has been read."""
+        self._outcome(offset, line, self._skip,
+                      self.parser._reading_skip_details)
+
+    def _succeed(self):
+        self.parser.client.addSuccess(self.parser._current_test, details={})
+
+    def addSuccess(self, offset, line):
+        """A 'success:' directive has been read."""
+        self._outcome(offset, line, self._succeed,
+                      self.parser._reading_success_details)
+
+    def lostConnection(self):
+        """Connection lost."""
+        self.parser._lostConnectionInTest(compat._u(''))
+
+
+class _OutSideTest(_ParserState):
+    """State for the subunit parser outside of a test context."""
+
+    def lostConnection(self):
+        """Connection lost."""
+
+    def startTest(self, offset, line):
+        """A test start command received."""
+        self.parser._state = self.parser._in_test
+        test_name = line[offset:-1].decode('utf8')
+        self.parser._current_test = RemotedTestCase(test_name)
+        self.parser.current_test_description = test_name
+        self.parser.client.startTest(self.parser._current_test)
+        self.parser.subunitLineReceived(line)
+
+
+class _ReadingDetails(_ParserState):
+    """Common logic for readin state details."""
+
+    def endDetails(self):
+        """The end of a details section has been reached."""
+        self.parser._state = self.parser._outside_test
+        self.parser.current_test_description = None
+        self._report_outcome()
+        self.parser.client.stopTest(self.parser._current_test)
+
+    def lineReceived(self, line):
+        """a line has been received."""
+        self.details_parser.lineReceived(line)
+        self.parser.subunitLineReceived(line)
+
+    def lostConnection(self):
+        """Connection lost."""
+        self.parser._lostConnectionInTest(compat._u('%s report of ') %
+                                          self._outcome_label())
+
+    def _outcome_label(self):
+        """The label to describe this outcome."""
+        raise NotImplementedError(self._outcome_label)
+
+    def set_simple(self):
+        """Start a simple details parser."""
+        self.details_parser = details.SimpleDetailsParser(self)
+
+    def set_multipart(self):
+        """Start a multipart details parser."""
+        self.details_parser = details.MultipartDetailsParser(self)
+
+
+class _ReadingFailureDetails(_ReadingDetails):
+    """State for the subunit parser when reading failure details."""
+
+    def _report_outcome(self):
+        self.parser.client.addFailure(
+            self.parser._current_test,
+            details=self.details_parser.get_details())
+
+    def _outcome_label(self):
+        return "failure"
+
+
+class _ReadingErrorDetails(_ReadingDetails):
+    """State for the subunit parser when reading error details."""
+
+    def _report_outcome(self):
+        self.parser.client.addError(self.parser._current_test,
+                                    details=self.details_parser.get_details())
+
+    def _outcome_label(self):
+        return "error"
+
+
+class _ReadingExpectedFailureDetails(_ReadingDetails):
+    """State for the subunit parser when reading xfail details."""
+
+    def _report_outcome(self):
+        self.parser.client.addExpectedFailure(
+            self.parser._current_test,
+            details=self.details_parser.get_details())
+
+    def _outcome_label(self):
+        return "xfail"
+
+
+class _ReadingUnexpectedSuccessDetails(_ReadingDetails):
+    """State for the subunit parser when reading uxsuccess details."""
+
+    def _report_outcome(self):
+        self.parser.client.addUnexpectedSuccess(
+            self.parser._current_test,
+            details=self.details_parser.get_details())
+
+    def _outcome_label(self):
+        return "uxsuccess"
+
+
+class _ReadingSkipDetails(_ReadingDetails):
+    """State for the subunit parser when reading skip details."""
+
+    def _report_outcome(self):
+        self.parser.client.addSkip(
+            self.parser._current_test,
+            details=self.details_parser.get_details("skip"))
+
+    def _outcome_label(self):
+        return "skip"
+
+
+class _ReadingSuccessDetails(_ReadingDetails):
+    """State for the subunit parser when reading success details."""
+
+    def _report_outcome(self):
+        self.parser.client.addSuccess(
+            self.parser._current_test,
+            details=self.details_parser.get_details("success"))
+
+    def _outcome_label(self):
+        return "success"
+
+
+class TestProtocolServer(object):
+    """A parser for subunit.
+
+    :ivar tags: The current tags associated with the protocol stream.
+    """
+
+    def __init__(self, client, stream=None, forward_stream=None):
+        """Create a TestProtocolServer instance.
+
+        :param client: An object meeting the unittest.TestResult protocol.
+        :param stream: The stream that lines received which are not part of the
+            subunit protocol should be written to. This allows custom handling
+            of mixed protocols. By default, sys.stdout will be used for
+            convenience. It should accept bytes to its write() method.
+        :param forward_stream: A stream to forward subunit lines to. This
+            allows a filter to forward the entire stream while still parsing
+            and acting on it. By default forward_stream is set to
+            DiscardStream() and no forwarding happens.
+        """
+        self.client = testtools.ExtendedToOriginalDecorator(client)
+        if stream is None:
+            stream = sys.stdout
+            if sys.version_info > (3, 0):
+                stream = stream.buffer
+        self._stream = stream
+        self._forward_stream = forward_stream or DiscardStream()
+        # state objects we can switch too
+        self._in_test = _InTest(self)
+        self._outside_test = _OutSideTest(self)
+        self._reading_error_details = _ReadingErrorDetails(self)
+        self._reading_failure_details = _ReadingFailureDetails(self)
+        self._reading_skip_details = _ReadingSkipDetails(self)
+        self._reading_success_details = _ReadingSuccessDetails(self)
+        self._reading_xfail_details = _ReadingExpectedFailureDetails(self)
+        self._reading_uxsuccess_details = _ReadingUnexpectedSuccessDetails(
+            self)
+        # start with outside test.
+        self._state = self._outside_test
+        # Avoid casts on every call
+        self._plusminus = compat._b('+-')
+        self._push_sym = compat._b('push')
+        self._pop_sym = compat._b('pop')
+        # The last time: value parsed and its result; consecutive time
+        # lines are often identical.
+        self._last_time_stamp = None
+        self._last_time = None
+
+    def _handleProgress(self, offset, line):
+        """Process a progress directive."""
+        line = line[offset:].strip()
+        if line[0] in self._plusminus:
+            whence = PROGRESS_CUR
+            delta = int(line)
+        elif line == self._push_sym:
+            whence = PROGRESS_PUSH
+            delta = None
+        elif line == self._pop_sym:
+            whence = PROGRESS_POP
+            delta = None
+        else:
+            whence = PROGRESS_SET
+            delta = int(line)
+        self.client.progress(delta, whence)
+
+    def _handleTags(self, offset, line):
+        """Process a tags command."""
+        tags = line[offset:].decode('utf8').split()
+        new_tags, gone_tags = tags_to_new_gone(tags)
+        self.client.tags(new_tags, gone_tags)
+
+    def _handleTime(self, offset, line):
+        # Accept it, but do not do anything with it yet.
+        stamp = line[offset:-1]
+        if stamp != self._last_time_stamp:
+            try:
+                self._last_time = _parse_time(stamp)
+            except (TypeError, ValueError) as e:
+                raise TypeError(
+                    compat._u("Failed to parse %r, got %r") % (line, e))
+            self._last_time_stamp = stamp
+        self.client.time(self._last_time)
+
+    def lineReceived(self, line):
+        """Call the appropriate local method for the received line."""
+        self._state.lineReceived(line)
+
+    def _lostConnectionInTest(self, state_string):
+        error_string = compat._u("lost connection during %stest '%s'") % (
+            state_string, self.current_test_description)
+        self.client.addError(self._current_test, RemoteError(error_string))
+        self.client.stopTest(self._current_test)
+
+    def lostConnection(self):
+        """The input connection has finished."""
+        self._state.lostConnection()
+
+    def readFrom(self, pipe):
+        """Blocking convenience API to parse an entire stream.
+
+        The stream is read incrementally, so memory use does not grow with
+        the size of the stream.
+
+        :param pipe: A file-like object supporting read1() or readline().
+        :return: None.
+        """
+        for line in _iter_lines(pipe):
+            self.lineReceived(line)
+        self.lostConnection()
+
+    def _startTest(self, offset, line):
+        """Internal call to change state machine. Override startTest()."""
+        self._state.startTest(offset, line)
+
+    def subunitLineReceived(self, line):
+        self._forward_stream.write(line)
+
+    def stdOutLineReceived(self, line):
+        self._stream.write(line)
+
+
+def _parse_time(stamp):
+    """Parse the bytes of a v1 time: directive into a datetime."""
+    match = _time_format.match(stamp)
+    if match is None:
+        return date_parser.parse(stamp)
+    year, month, day, hour, minute, second, microsecond = match.groups()
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second),
+        int(microsecond or 0), iso8601.UTC)
+
+
+class TestProtocolClient(testtools.testresult.TestResult):
+    """A TestResult which generates a subunit stream for a test run.
+
+    # Get a TestSuite or TestCase to run
+    suite = make_suite()
+    # Create a stream (any object with a 'write' method). This should accept
+    # bytes not strings: subunit is a byte orientated protocol.
+    stream = file('tests.log', 'wb')
+    # Create a subunit result object which will output to the stream
+    result = subunit.TestProtocolClient(stream)
+    # Optionally, to get timing data for performance analysis, wrap the
+    # serialiser with a timing decorator
+    result = subunit.test_results.AutoTimingTestResultDecorator(result)
+    # Run the test suite reporting to the subunit result object
+    suite.run(result)
+    # Close the stream.
+    stream.close()
+
+    By default every directive is written to the stream as it is built,
+    which can be dozens of writes per test. Passing a flush_policy makes
+    the client assemble output in memory and write it out in one go:
+
+    * 'event' - once per event (start, outcome, time, ...), flushing the
+      stream when a test starts or stops, as the unbuffered client does.
+    * 'test' - once per test, at stopTest.
+    * 'run' - at stopTestRun.
+
+    With 'test' and 'run', output is also written whenever buffer_size
+    bytes have built up. Note that output buffered when the process dies
+    is lost, so a consumer of a crashed 'test' or 'run' client cannot tell
+    which test was running.
+    """
+
+    _flush_levels = {'event': 0, 'test': 1, 'run': 2}
+
+    def __init__(self, stream, flush_policy=None, buffer_size=65536):
+        """Create a TestProtocolClient writing to stream.
+
+        :param stream: The stream to write to. It must accept bytes.
+        :param flush_policy: None to write directives as they are made, or
+            one of 'event', 'test' or 'run' to buffer output.
+        :param buffer_size: With the 'test' and 'run' policies, write out
+            buffered output once it reaches this many bytes.
+        """
+        testtools.testresult.TestResult.__init__(self)
+        stream = make_stream_binary(stream)
+        if flush_policy is None:
+            self._output = None
+            self._stream = stream
+        elif flush_policy in self._flush_levels:
+            self._output = stream
+            self._stream = _EventBuffer()
+            self._flush_level = self._flush_levels[flush_policy]
+            self._buffer_size = buffer_size
+        else:
+            raise ValueError("Unknown flush_policy %r" % (flush_policy,))
+        self._progress_fmt = compat._b("progress: ")
+        self._bytes_eol = compat._b("\n")
+        self._progress_plus = compat._b("+")
+        self._progress_push = compat._b("push")
+        self._progress_pop = compat._b("pop")
+        self._empty_bytes = compat._b("")
+        self._start_simple = compat._b(" [\n")
+        self._end_simple = compat._b("]\n")
+
+    def addError(self, test, error=None, details=None):
+        """Report an error in test test.
+
+        Only one of error and details should be provided: conceptually there
+        are two separate methods:
+            addError(self, test, error)
+            addError(self, test, details)
+
+        :param error: Standard unittest positional argument form - an
+            exc_info tuple.
+        :param details: New Testing-in-python drafted API; a dict from string
+            to subunit.Content objects.
+        """
+        self._addOutcome("error", test, error=error, details=details)
+        if self.failfast:
+            self.stop()
+
+    def addExpectedFailure(self, test, error=None, details=None):
+        """Report an expected failure in test test.
+
+        Only one of error and details should be provided: conceptually there
+        are two separate methods:
+            addError(self, test, error)
+            addError(self, test, details)
+
+        :param error: Standard unittest positional argument form - an
+            exc_info tuple.
+        :param details: New Testing-in-python drafted API; a dict from string
+            to subunit.Content objects.
+        """
+        self._addOutcome("xfail", test, error=error, details=details)
+
+    def addFailure(self, test, error=None, details=None):
+        """Report a failure in test test.
+
+        Only one of error and details should be provided: conceptually there
+        are two separate methods:
+            addFailure(self, test, error)
+            addFailure(self, test, details)
+
+        :param error: Standard unittest positional argument form - an
+            exc_info tuple.
+        :param details: New Testing-in-python drafted API; a dict from string
+            to subunit.Content objects.
+        """
+        self._addOutcome("failure", test, error=error, details=details)
+        if self.failfast:
+            self.stop()
+
+    def _addOutcome(self, outcome, test, error=None, details=None,
+                    error_permitted=True):
+        """Report a failure in test test.
+
+        Only one of error and details should be provided: conceptually there
+        are two separate methods:
+            addOutcome(self, test, error)
+            addOutcome(self, test, details)
+
+        :param outcome: A string describing the outcome - used as the
+            event name in the subunit stream.
+        :param error: Standard unittest positional argument form - an
+            exc_info tuple.
+        :param details: New Testing-in-python drafted API; a dict from string
+            to subunit.Content objects.
+        :param error_permitted: If True then one and only one of error or
+            details must be supplied. If False then error must not be supplied
+            and details is still optional.
+        """
+        self._stream.write(
+            compat._b("%s: " % outcome) + self._test_id(test))
+        if error_permitted:
+            if error is None and details is None:
+                raise ValueError
+        else:
+            if error is not None:
+                raise ValueError
+        if error is not None:
+            self._stream.write(self._start_simple)
+            tb_content = testtools.content.TracebackContent(error, test)
+            for bytes in tb_content.iter_bytes():
+                self._stream.write(bytes)
+        elif details is not None:
+            self._write_details(details)
+        else:
+            self._stream.write(compat._b("\n"))
+        if details is not None or error is not None:
+            self._stream.write(self._end_simple)
+        self._end_event()
+
+    def addSkip(self, test, reason=None, details=None):
+        """Report a skipped test."""
+        if reason is None:
+            self._addOutcome("skip", test, error=None, details=details)
+        else:
+            self._stream.write(compat._b("skip: %s [\n" % test.id()))
+            self._stream.write(compat._b("%s\n" % reason))
+            self._stream.write(self._end_simple)
+            self._end_event()
+
+    def addSuccess(self, test, details=None):
+        """Report a success in a test."""
+        self._addOutcome("successful", test, details=details,
+                         error_permitted=False)
+
+    def addUnexpectedSuccess(self, test, details=None):
+        """Report an unexpected success in test test.
+
+        Details can optionally be provided: conceptually there
+        are two separate methods:
+            addError(self, test)
+            addError(self, test, details)
+
+        :param details: New Testing-in-python drafted API; a dict from string
+            to subunit.Content objects.
+        """
+        self._addOutcome("uxsuccess", test, details=details,
+                         error_permitted=False)
+        if self.failfast:
+            self.stop()
+
+    def _test_id(self, test):
+        result = test.id()
+        if type(result) is not bytes:
+            result = result.encode('utf8')
+        return result
+
+    def startTest(self, test):
+        """Mark a test as starting its test run."""
+        super(TestProtocolClient, self).startTest(test)
+        self._stream.write(
+            compat._b(
+                "test: ") + self._test_id(test) + compat._b("\n"))
+        self._end_event(flush=True)
+
+    def stopTest(self, test):
+        super(TestProtocolClient, self).stopTest(test)
+        self._end_event(flush=True, level=1)
+
+    def stopTestRun(self):
+        super(TestProtocolClient, self).stopTestRun()
+        self._end_event(flush=True, level=2)
+
+    def _end_event(self, flush=False, level=0):
+        """Called after writing an event.
+
+        :param flush: If True, flush the stream as well as writing any
+            buffered output to it.
+        :param level: 0 after an event, 1 at the end of a test and 2 at the
+            end of the run.
+        """
+        if self._output is None:
+            if flush:
+                self._stream.flush()
+            return
+        buffered = self._stream
+        if buffered and (level >= self._flush_level or
+                         len(buffered) >= self._buffer_size):
+            self._output.write(buffered)
+            del buffered[:]
+        if flush and level >= self._flush_level:
+            self._output.flush()
+
+    def progress(self, offset, whence):
+        """Provide indication about the progress/length of the test run.
+
+        :param offset: Information about the number of tests remaining. If
+            whence is PROGRESS_CUR, then offset increases/decreases the
+            remaining test count. If whence is PROGRESS_SET, then offset
+            specifies exactly the remaining test count.
+        :param whence: One of PROGRESS_CUR, PROGRESS_SET, PROGRESS_PUSH,
+            PROGRESS_POP.
+        """
+        if whence == PROGRESS_CUR and offset > -1:
+            prefix = self._progress_plus
+            offset = compat._b(str(offset))
+        elif whence == PROGRESS_PUSH:
+            prefix = self._empty_bytes
+            offset = self._progress_push
+        elif whence == PROGRESS_POP:
+            prefix = self._empty_bytes
+            offset = self._progress_pop
+        else:
+            prefix = self._empty_bytes
+            offset = compat._b(str(offset))
+        self._stream.write(self._progress_fmt + prefix + offset +
+                           self._bytes_eol)
+        self._end_event()
+
+    def tags(self, new_tags, gone_tags):
+        """Inform the client about tags added/removed from the stream."""
+        if not new_tags and not gone_tags:
+            return
+        tags = set([tag.encode('utf8') for tag in new_tags])
+        tags.update(
+            [compat._b("-") + tag.encode('utf8') for tag in gone_tags])
+        tag_line = compat._b(
+            "tags: ") + compat._b(" ").join(tags) + compat._b("\n")
+        self._stream.write(tag_line)
+        self._end_event()
+
+    def time(self, a_datetime):
+        """Inform the client of the time.
+
+        ":param datetime: A datetime.datetime object.
+        """
+        time = a_datetime.astimezone(iso8601.UTC)
+        self._stream.write(
+            compat._b("time: %04d-%02d-%02d %02d:%02d:%02d.%06dZ\n" % (
+                time.year, time.month, time.day, time.hour, time.minute,
+                time.second, time.microsecond)))
+        self._end_event()
+
+    def _write_details(self, details):
+        """Output details to the stream.
+
+        :param details: An extended details dict for a test outcome.
+        """
+        self._stream.write(compat._b(" [ multipart\n"))
+        for name, content in sorted(details.items()):
+            self._stream.write(compat._b("Content-Type: %s/%s" % (
+                content.content_type.type, content.content_type.subtype)))
+            parameters = content.content_type.parameters
+            if parameters:
+                self._stream.write(compat._b(";"))
+                param_strs = []
+                for param, value in parameters.items():
+                    param_strs.append("%s=%s" % (param, value))
+                self._stream.write(compat._b(",".join(param_strs)))
+            self._stream.write(compat._b("\n%s\n" % name))
+            encoder = chunked.Encoder(self._stream)
+            for content_bytes in content.iter_bytes():
+                encoder.write(content_bytes)
+            encoder.close()
+
+    def done(self):
+        """Obey the testtools result.done() interface."""
+
+
+class _EventBuffer(bytearray):
+    """A bytearray that TestProtocolClient can write to like a stream."""
+
+    write = bytearray.extend
+
+    def flush(self):
+        pass
+
+
+def RemoteError(description=compat._u("")):
+    return (_StringException, _StringException(description), None)
+
+
+class RemotedTestCase(unittest.TestCase):
+    """A class to represent test cases run in child processes.
+
+    Instances of this class are used to provide the Python test API a TestCase
+    that can be printed to the screen, introspected for metadata and so on.
+    However, as they are a simply a memoisation of a test that was actually
+    run in the past by a separate process, they cannot perform any interactive
+    actions.
+    """
+
+    def __eq__(self, other):
+        try:
+            return self.__description == other.__description
+        except AttributeError:
+            return False
+
+    def __init__(self, description):
+        """Create a psuedo test case with description description."""
+        self.__description = description
+
+    def error(self, label):
+        raise NotImplementedError(
+            "%s on RemotedTestCases is not permitted." % label)
+
+    def setUp(self):
+        self.error("setUp")
+
+    def tearDown(self):
+        self.error("tearDown")
+
+    def shortDescription(self):
+        return self.__description
+
+    def id(self):
+        return "%s" % (self.__description,)
+
+    def __str__(self):
+        return "%s (%s)" % (self.__description, self._strclass())
+
+    def __repr__(self):
+        return "<%s description='%s'>" % \
+               (self._strclass(), self.__description)
+
+    def run(self, result=None):
+        if result is None:
+            result = self.defaultTestResult()
+        result.startTest(self)
+        result.addError(
+            self, RemoteError(compat._u("Cannot run RemotedTestCases.\n")))
+        result.stopTest(self)
+
+    def _strclass(self):
+        cls = self.__class__
+        return "%s.%s" % (cls.__module__, cls.__name__)
+
+
+class ExecTestCase(unittest.TestCase):
+    """A test case which runs external scripts for test fixtures."""
+
+    def __init__(self, methodName='runTest'):
+        """Create an instance of the class that will use the test method
+
+        Raises a ValueError if the instance does not have a method with the
+        specified name.
+        """
+        unittest.TestCase.__init__(self, methodName)
+        testMethod = getattr(self, methodName)
+        self.script = join_dir(sys.modules[self.__class__.__module__].__file__,
+                               testMethod.__doc__)
+
+    def countTestCases(self):
+        return 1
+
+    def run(self, result=None):
+        if result is None:
+            result = self.defaultTestResult()
+        self._run(result)
+
+    def debug(self):
+        """Run the test without collecting errors in a TestResult"""
+        self._run(testtools.testresult.TestResult())
+
+    def _run(self, result):
+        protocol = TestProtocolServer(result)
+        process = subprocess.Popen(self.script, shell=True,
+                                   stdout=subprocess.PIPE)
+        stdout = make_stream_binary(process.stdout)
+        try:
+            protocol.readFrom(stdout)
+        finally:
+            stdout.close()
+            process.wait()
+
+
+class IsolatedTestCase(unittest.TestCase):
+    """A TestCase which executes in a forked process.
+
+    Each test gets its own process, which has a performance overhead but will
+    provide excellent isolation from global state (such as django configs,
+    zope utilities and so on).
+
+    Set protocol_version to 2 to have the child report its results with the
+    subunit v2 protocol.
+    """
+
+    protocol_version = 1
+
+    def run(self, result=None):
+        if result is None:
+            result = self.defaultTestResult()
+        run_isolated(unittest.TestCase, self, result,
+                     protocol_version=self.protocol_version)
+
+
+class IsolatedTestSuite(unittest.TestSuite):
+    """A TestSuite which runs its tests in a forked process.
+
+    This decorator that will fork() before running the tests and report the
+    results from the child process using a Subunit stream.  This is useful for
+    handling tests that mutate global state, or are testing C extensions that
+    could crash the VM.
+
+    As with IsolatedTestCase, protocol_version selects the subunit protocol
+    the child process reports with.
+    """
+
+    protocol_version = 1
+
+    def run(self, result=None):
+        if result is None:
+            result = testtools.testresult.TestResult()
+        run_isolated(unittest.TestSuite, self, result,
+                     protocol_version=self.protocol_version)
+
+
+def run_isolated(klass, self, result, protocol_version=1):
+    """Run a test suite or case in a subprocess,
+
+    Uses the run method on klass.
+
+    :param protocol_version: The subunit protocol the child reports with,
+        1 (the default) or 2. Version 2 carries timestamps and attachments
+        natively rather than through v1 time: lines and chunked details.
+    """
+    if protocol_version not in (1, 2):
+        raise ValueError(
+            'unknown protocol_version %r' % (protocol_version,))
+    c2pread, c2pwrite = os.pipe()
+    # fixme - error -> result
+    # now fork
+    pid = os.fork()
+    if pid == 0:
+        # Child
+        # Close parent's pipe ends
+        os.close(c2pread)
+        # Dup fds for child
+        os.dup2(c2pwrite, 1)
+        # Close pipe fds.
+        os.close(c2pwrite)
+
+        # at this point, sys.stdin is redirected, now we want
+        # to filter it to escape ]'s.
+        # XXX: test and write that bit.
+        stream = os.fdopen(1, 'wb')
+        if protocol_version == 2:
+            result = testtools.ExtendedToStreamDecorator(
+                v2.StreamResultToBytes(stream))
+            result.startTestRun()
+            try:
+                klass.run(self, result)
+            finally:
+                result.stopTestRun()
+        else:
+            result = TestProtocolClient(stream, flush_policy='event')
+            klass.run(self, result)
+        stream.flush()
+        sys.stderr.flush()
+        # exit HARD, exit NOW.
+        os._exit(0)
+    else:
+        # Parent
+        # Close child pipe ends
+        os.close(c2pwrite)
+        fileobj = os.fdopen(c2pread, 'rb')
+        if protocol_version == 2:
+            _read_isolated_v2(fileobj, result)
+        else:
+            # hookup a protocol engine
+            protocol = TestProtocolServer(result)
+            protocol.readFrom(fileobj)
+        fileobj.close()
+        os.waitpid(pid, 0)
+        # TODO(lifeless) return code evaluation.
+    return result
+
+
+def _read_isolated_v2(fileobj, result):
+    """Replay a v2 stream from an isolated child onto result.
+
+    Output the child wrote that is not part of the stream is copied to
+    stdout, as TestProtocolServer does for v1.
+    """
+    from pysubunit import test_results
+    lost = test_results._LostTests(result)
+    decorator = testtools.StreamToExtendedDecorator(lost)
+    in_flight = test_results._InFlight()
+    router = testtools.StreamResultRouter(
+        testtools.CopyStreamResult([decorator, in_flight]))
+    router.add_rule(
+        test_results.CatFiles(sys.stdout), 'test_id', test_id=None)
+    # result is already inside a run; only the decorator's own bookkeeping
+    # needs starting and stopping, not the run on the decorated result.
+    decorator.hook.startTestRun()
+    v2.ByteStreamToStreamResult(
+        fileobj, non_subunit_name='stdout').run(router)
+    # A test still running when the stream ends was lost with the child;
+    # report it as TestProtocolServer does for v1.
+    for test_id in in_flight.tests.values():
+        lost.lose(
+            test_id, compat._u("lost connection during test '%s'") % test_id)
+    decorator.hook.stopTestRun()
+
+
+class ProtocolTestCase(object):
+    """Subunit wire protocol to unittest.TestCase adapter.
+
+    ProtocolTestCase honours the core of ``unittest.TestCase`` protocol -
+    calling a ProtocolTestCase or invoking the run() method will make a 'test
+    run' happen. The 'test run' will simply be a replay of the test activity
+    that has been encoded into the stream. The ``unittest.TestCase`` ``debug``
+    and ``countTestCases`` methods are not supported because there isn't a
+    sensible mapping for those methods.
+
+    # Get a stream (any object with a readline() method), in this case the
+    # stream output by the example from ``subunit.TestProtocolClient``.
+    stream = file('tests.log', 'rb')
+    # Create a parser which will read from the stream and emit
+    # activity to a unittest.TestResult when run() is called.
+    suite = subunit.ProtocolTestCase(stream)
+    # Create a result object to accept the contents of that stream.
+    result = unittest._TextTestResult(sys.stdout)
+    # 'run' the tests - process the stream and feed its contents to result.
+    suite.run(result)
+    stream.close()
+
+    :seealso: TestProtocolServer (the subunit wire protocol parser).
+    """
+
+    def __init__(self, stream, passthrough=None, forward=None):
+        """Create a ProtocolTestCase reading from stream.
+
+        :param stream: A filelike object which a subunit stream can be read
+            from.
+        :param passthrough: A stream pass non subunit input on to. If not
+            supplied, the TestProtocolServer default is used.
+        :param forward: A stream to pass subunit input on to. If not supplied
+            subunit input is not forwarded.
+        """
+        stream = make_stream_binary(stream)
+        self._stream = stream
+        self._passthrough = passthrough
+        if forward is not None:
+            forward = make_stream_binary(forward)
+        self._forward = forward
+
+    def __call__(self, result=None):
+        return self.run(result)
+
+    def run(self, result=None):
+        if result is None:
+            result = self.defaultTestResult()
+        protocol = TestProtocolServer(result, self._passthrough, self._forward)
+        protocol.readFrom(self._stream)
+
+
+class TestResultStats(testtools.testresult.TestResult):
+    """A pyunit TestResult interface implementation for making statistics.
+
+    :ivar total_tests: The total tests seen.
+    :ivar passed_tests: The tests that passed.
+    :ivar failed_tests: The tests that failed.
+    :ivar seen_tags: The tags seen across all tests.
+    """
+
+    def __init__(self, stream):
+        """Create a TestResultStats which outputs to stream."""
+        testtools.testresult.TestResult.__init__(self)
+        self._stream = stream
+        self.failed_tests = 0
+        self.skipped_tests = 0
+        self.seen_tags = set()
+
+    @property
+    def total_tests(self):
+        return self.testsRun
+
+    def addError(self, test, err, details=None):
+        self.failed_tests += 1
+
+    def addFailure(self, test, err, details=None):
+        self.failed_tests += 1
+
+    def addSkip(self, test, reason, details=None):
+        self.skipped_tests += 1
+
+    def formatStats(self):
+        self._stream.write("Total tests:   %5d\n" % self.total_tests)
+        self._stream.write("Passed tests:  %5d\n" % self.passed_tests)
+        self._stream.write("Failed tests:  %5d\n" % self.failed_tests)
+        self._stream.write("Skipped tests: %5d\n" % self.skipped_tests)
+        tags = sorted(self.seen_tags)
+        self._stream.write("Seen tags: %s\n" % (", ".join(tags)))
+
+    @property
+    def passed_tests(self):
+        return self.total_tests - self.failed_tests - self.skipped_tests
+
+    def tags(self, new_tags, gone_tags):
+        """Accumulate the seen tags."""
+        self.seen_tags.update(new_tags)
+
+    def wasSuccessful(self):
+        """Tells whether or not this result was a success"""
+        return self.failed_tests == 0
+
+
+def _iter_lines(stream, block_size=65536):
+    """Yield the lines of a binary stream, reading it a block at a time.
+
+    read1() is used so that whatever a pipe has available is parsed straight
+    away rather than waiting for a full block. Streams without read1() are
+    read with readline().
+
+    :param stream: The stream to read.
+    :param block_size: The most bytes to request from the stream at once.
+    :return: An iterator of lines, each ending in a newline except possibly
+        the last.
+    """
+    read1 = getattr(stream, 'read1', None)
+    if read1 is None:
+        line = stream.readline()
+        while line:
+            yield line
+            line = stream.readline()
+        return
+    # The start of a line that did not end in the blocks read so far.
+    partial = []
+    while True:
+        block = read1(block_size)
+        if not block:
+            break
+        end = block.find(b'\n')
+        if end == -1:
+            partial.append(block)
+            continue
+        end += 1
+        if partial:
+            partial.append(block[:end])
+            yield b''.join(partial)
+            partial = []
+        else:
+            yield block[:end]
+        start = end
+        end = block.find(b'\n', start)
+        while end != -1:
+            end += 1
+            yield block[start:end]
+            start = end
+            end = block.find(b'\n', start)
+        if start < len(block):
+            partial.append(block[start:])
+    if partial:
+        yield b''.join(partial)
+
+
+# The public classes are documented (and pickled) as pysubunit.<name>, and
+# RemotedTestCase ids are built from the module name.
+for _value in list(globals().values()):
+    if (isinstance(_value, type) and _value.__module__ == __name__ and
+            not _value.__name__.startswith('_')):
+        _value.__module__ = 'pysubunit'
+del _value
@@ -16,9 +16,33 @@
 
 """Encoder/decoder for http style chunked encoding."""
 
+import io
+import os
+import sys
+
+from extras import safe_hasattr
 from testtools.compat import _b
 
 empty = _b('')
+_end = _b('0\r\n')
+try:
+    _iov_max = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _iov_max = -1
+if _iov_max < 16:
+    # Unknown; POSIX guarantees at least 16.
+    _iov_max = 16
+_bytes = type(empty)
+# Returned by a Decoder state that has handed over to the next state.
+_more = object()
+
+if sys.version_info >= (3,):
+    def _slice(data, start, end):
+        return memoryview(data)[start:end]
+else:
+    def _slice(data, start, end):
+        # Python 2 file objects do not accept memoryviews.
+        return bytes(data[start:end])
 
 
 class Decoder(object):
@@ -33,7 +57,9 @@ class Decoder(object):
             buffered (whichever is larger). The close method should be called
             when no more data is available, to detect short streams; the
             write method will return none-None when the end of a stream is
-            detected. The output object must accept bytes objects.
+            detected. The output object must accept bytes-like objects:
+            body data is written as memoryview slices of the input where
+            possible, and is only valid until write() returns.
 
         :param strict: If True (the default), the decoder will not knowingly
             accept input that is not conformant to the HTTP specification.
@@ -42,7 +68,12 @@ class Decoder(object):
             unambiguous.
         """
         self.output = output
-        self.buffered_bytes = []
+        # Unconsumed input: _data from _offset on. Between writes _offset is
+        # 0 and _data is either bytes (which cannot change under us) or,
+        # once a write has been appended to leftover input, our own
+        # bytearray.
+        self._data = empty
+        self._offset = 0
         self.state = self._read_length
         self.body_length = 0
         self.strict = strict
@@ -62,69 +93,75 @@ class Decoder(object):
 
     def _finished(self):
         """Finished reading, return any remaining bytes."""
-        if self.buffered_bytes:
-            buffered_bytes = self.buffered_bytes
-            self.buffered_bytes = []
-            return empty.join(buffered_bytes)
+        data = self._data
+        if self._offset < len(data):
+            excess = data[self._offset:]
+            self._data = empty
+            self._offset = 0
+            return bytes(excess)
         else:
             raise ValueError("stream is finished")
 
     def _read_body(self):
         """Pass body bytes to the output."""
-        while self.body_length and self.buffered_bytes:
-            if self.body_length >= len(self.buffered_bytes[0]):
-                self.output.write(self.buffered_bytes[0])
-                self.body_length -= len(self.buffered_bytes[0])
-                del self.buffered_bytes[0]
-                # No more data available.
-                if not self.body_length:
-                    self.state = self._read_length
-            else:
-                self.output.write(self.buffered_bytes[0][:self.body_length])
-                self.buffered_bytes[0] = \
-                    self.buffered_bytes[0][self.body_length:]
-                self.body_length = 0
-                self.state = self._read_length
-                return self.state()
+        data = self._data
+        start = self._offset
+        end = len(data)
+        body_length = self.body_length
+        if end - start > body_length:
+            end = start + body_length
+        elif start == end:
+            return None
+        elif start == 0 and type(data) is _bytes:
+            # All of the last write is body: the common case.
+            self.output.write(data)
+            self._data = empty
+            self.body_length = body_length - end
+            if self.body_length:
+                return None
+            self.state = self._read_length
+            return _more
+        if type(data) is not _bytes:
+            # Our own buffer: it will be reused, so the output gets a copy.
+            self.output.write(memoryview(data)[start:end].tobytes())
+        else:
+            self.output.write(_slice(data, start, end))
+        self._offset = end
+        self.body_length = body_length - (end - start)
+        if self.body_length:
+            return None
+        self.state = self._read_length
+        return _more
 
     def _read_length(self):
         """Try to decode a length from the bytes."""
-        count_chars = []
-        for bytes in self.buffered_bytes:
-            for pos in range(len(bytes)):
-                byte = bytes[pos:pos + 1]
-                if byte not in self._match_chars:
-                    break
-                count_chars.append(byte)
-                if byte == self._slash_n:
-                    break
-        if not count_chars:
-            return
-        if count_chars[-1] != self._slash_n:
-            return
-        count_str = empty.join(count_chars)
+        data = self._data
+        start = self._offset
+        end = data.find(self._slash_n, start)
+        if end == -1:
+            return None
+        end += 1
+        count_str = bytes(data[start:end])
+        if count_str.translate(None, self._match_chars):
+            if self.strict:
+                raise ValueError("chunk header invalid: %r" % count_str)
+            # Not a chunk header; like a short one, wait for more input.
+            return None
         if self.strict:
             if count_str[-2:] != self._slash_rn:
                 raise ValueError("chunk header invalid: %r" % count_str)
             if self._slash_r in count_str[:-2]:
                 raise ValueError("too many CRs in chunk header %r" % count_str)
         self.body_length = int(count_str.rstrip(self._slash_nr), 16)
-        excess_bytes = len(count_str)
-        while excess_bytes:
-            if excess_bytes >= len(self.buffered_bytes[0]):
-                excess_bytes -= len(self.buffered_bytes[0])
-                del self.buffered_bytes[0]
-            else:
-                self.buffered_bytes[0] = self.buffered_bytes[0][excess_bytes:]
-                excess_bytes = 0
+        self._offset = end
         if not self.body_length:
             self.state = self._finished
-            if not self.buffered_bytes:
+            if end == len(data):
                 # May not call into self._finished with no buffered data.
                 return empty
         else:
             self.state = self._read_body
-        return self.state()
+        return _more
 
     def write(self, bytes):
         """Decode bytes to the output stream.
@@ -134,52 +171,137 @@ class Decoder(object):
         :returns: None, or the excess bytes beyond the end of file marker.
         """
         if bytes:
-            self.buffered_bytes.append(bytes)
-        return self.state()
+            if self._data:
+                # Leftover input: append to it in a buffer of our own.
+                if type(self._data) is not bytearray:
+                    self._data = bytearray(self._data)
+                self._data += bytes
+            elif type(bytes) is _bytes:
+                self._data = bytes
+            else:
+                # Callers may reuse a mutable buffer once we return.
+                self._data = bytearray(bytes)
+        result = self.state()
+        while result is _more:
+            result = self.state()
+        if self._offset:
+            # Drop what has been consumed.
+            if self._offset == len(self._data):
+                self._data = empty
+            else:
+                self._data = self._data[self._offset:]
+            self._offset = 0
+        return result
 
 
 class Encoder(object):
     """Encode content to a stream using HTTP Chunked coding."""
 
-    def __init__(self, output):
+    def __init__(self, output, buffer_size=65536):
         """Create an encoder encoding to output.
 
         :param output: A file-like object. Bytes written to the Encoder
             will be encoded using HTTP chunking. Small writes may be buffered
             and the ``close`` method must be called to finish the stream.
+            Each chunk is handed to the output in a single write, as a
+            bytes-like object that is only valid until write() returns,
+            except that the bytes of a write that fills a chunk follow in a
+            second write rather than being copied. If output is an
+            unbuffered io.FileIO, chunks are written straight to its file
+            descriptor with os.writev where available, always in one call.
+        :param buffer_size: Writes are combined into chunks of up to this
+            many bytes; a write that would take a chunk to this size or
+            beyond is sent as a chunk of its own.
         """
         self.output = output
-        self.buffered_bytes = []
         self.buffer_size = 0
+        self._limit = buffer_size
+        self._fd = None
+        if isinstance(output, io.FileIO) and safe_hasattr(os, 'writev'):
+            self._fd = output.fileno()
+        if self._fd is None:
+            # Chunks are assembled after room for the largest header, so
+            # that the header can be put in front without copying the body.
+            # A single write can make a chunk of any length.
+            self._header_room = len(self._header(sys.maxsize))
+            self._buffer = bytearray(
+                self._header_room + buffer_size + len(_end))
+        else:
+            self._buffered_bytes = []
 
-    def flush(self, extra_len=0):
+    def _header(self, length):
+        return _b("%X\r\n" % length)
+
+    def flush(self, extra_len=0, extra=None, trailer=None):
         """Flush the encoder to the output stream.
 
         :param extra_len: Increase the size of the chunk by this many bytes
             to allow for a subsequent write.
+        :param extra: The extra_len bytes themselves, if they should be
+            written as part of this flush.
+        :param trailer: Bytes to write after the chunk, with it.
+        :return: True if anything was written.
         """
         if not self.buffer_size and not extra_len:
             return
-        buffered_bytes = self.buffered_bytes
         buffer_size = self.buffer_size
-        self.buffered_bytes = []
         self.buffer_size = 0
-        self.output.write(_b("%X\r\n" % (buffer_size + extra_len)))
-        if buffer_size:
-            self.output.write(empty.join(buffered_bytes))
+        header = self._header(buffer_size + extra_len)
+        if self._fd is not None:
+            buffered_bytes = self._buffered_bytes
+            self._buffered_bytes = []
+            buffered_bytes.insert(0, header)
+            if extra is not None:
+                buffered_bytes.append(extra)
+            if trailer is not None:
+                buffered_bytes.append(trailer)
+            _writev(self._fd, buffered_bytes)
+            return True
+        start = self._header_room - len(header)
+        end = self._header_room + buffer_size
+        self._buffer[start:self._header_room] = header
+        if trailer is not None:
+            # Only close() passes a trailer, and it never passes extra.
+            self._buffer[end:end + len(trailer)] = trailer
+            end += len(trailer)
+        self.output.write(_slice(self._buffer, start, end))
+        if extra is not None:
+            self.output.write(extra)
         return True
 
     def write(self, bytes):
         """Encode bytes to the output stream."""
         bytes_len = len(bytes)
-        if self.buffer_size + bytes_len >= 65536:
-            self.flush(bytes_len)
-            self.output.write(bytes)
-        else:
-            self.buffered_bytes.append(bytes)
+        if self.buffer_size + bytes_len >= self._limit:
+            self.flush(bytes_len, extra=bytes)
+            return
+        if bytes_len:
+            if self._fd is not None:
+                if type(bytes) is not _bytes:
+                    # Callers may reuse a mutable buffer once we return.
+                    bytes = memoryview(bytes).tobytes()
+                self._buffered_bytes.append(bytes)
+            else:
+                start = self._header_room + self.buffer_size
+                self._buffer[start:start + bytes_len] = bytes
             self.buffer_size += bytes_len
 
     def close(self):
         """Finish the stream. This does not close the output stream."""
-        self.flush()
-        self.output.write(_b("0\r\n"))
+        if not self.flush(trailer=_end):
+            self.output.write(_end)
+
+
+def _writev(fd, buffers):
+    """Write all of buffers to fd with as few system calls as possible."""
+    if len(buffers) > _iov_max:
+        buffers = [buffers[0], empty.join(buffers[1:])]
+    total = sum(len(buffer) for buffer in buffers)
+    written = os.writev(fd, buffers)
+    while written < total:
+        # A short write: carry on from where it stopped.
+        total -= written
+        while written >= len(buffers[0]):
+            written -= len(buffers.pop(0))
+        buffers[0] = memoryview(buffers[0])[written:]
+        written = os.writev(fd, buffers)
@@ -22,16 +22,25 @@ which match both the test name and the error text (if any).  The result
 contains tests which match any of the --with expressions and none of the
 --without expressions.  For case-insensitive matching prepend '(?i)'.
 Remember to quote shell metacharacters.
+
+--with-id and --without-id work in the same way but match only the test id,
+which is much cheaper: tests are dropped as soon as they start, without
+looking at their attachments.
+
+--include-list and --exclude-list take files listing test ids, one per line.
+A line ending in '*' matches the ids starting with the rest of it, and a line
+starting and ending in '*' the ids containing what is between. The result
+contains the tests which match any include list and no exclude list. Long
+lists cost no more per test than short ones.
 """
 
 import optparse
 import re
 import sys
 
-import testtools
-
 import pysubunit
 from pysubunit import filters
+from pysubunit import idlist
 from pysubunit import test_results
 from pysubunit import v2
 
@@ -73,6 +82,12 @@ def make_options(description):
     parser.add_option("-m", "--with", type=str,
                       help="regexp to include (case-sensitive by default)",
                       action="append", dest="with_regexps")
+    parser.add_option("--include-list", type=str, metavar="FILE",
+                      help="include tests matching the id list in FILE",
+                      action="append", dest="include_lists")
+    parser.add_option("--exclude-list", type=str, metavar="FILE",
+                      help="exclude tests matching the id list in FILE",
+                      action="append", dest="exclude_lists")
     parser.add_option("--fixup-expected-failures", type=str,
                       help="File with list of test ids that are expected to "
                            "fail; on failure their result will be changed "
@@ -82,9 +97,25 @@ def make_options(description):
     parser.add_option("--without", type=str,
                       help="regexp to exclude (case-sensitive by default)",
                       action="append", dest="without_regexps")
+    parser.add_option("--with-id", type=str,
+                      help="regexp to include, matched against the test id "
+                           "only", action="append", dest="with_id_regexps")
+    parser.add_option("--without-id", type=str,
+                      help="regexp to exclude, matched against the test id "
+                           "only", action="append",
+                      dest="without_id_regexps")
     parser.add_option("-F", "--only-genuine-failures", action="callback",
                       callback=only_genuine_failures_callback,
                       help="Only pass through failures and exceptions.")
+    parser.add_option("--spill-threshold", type=int, metavar="BYTES",
+                      default=64 * 1024 * 1024,
+                      help="Write the attachments of unfinished tests to a "
+                           "temporary file once they take more than BYTES "
+                           "in memory (default: %default).")
+    parser.add_option("--profile", action="store_true", default=False,
+                      help="Report the time spent in each layer of the "
+                           "result chain on stderr when the run finishes.")
+    filters.add_stats_option(parser)
     return parser
 
 
@@ -119,41 +150,126 @@ def _make_regexp_filter(with_regexps, without_regexps):
     return check_regexps
 
 
-def _make_result(output, options, predicate):
-    """Make the result that we'll send the test outcomes to."""
+def _read_id_lists(paths):
+    if not paths:
+        return None
+    id_list = idlist.IdList()
+    for path in paths:
+        id_list.read(path)
+    return id_list
+
+
+def _make_id_predicate(options):
+    """Make the predicate for the id regexp and id list options.
+
+    :return: A callable taking a test id, or None if none of those options
+        were given.
+    :raises ValueError: If an id list has an unsupported pattern.
+    """
+    if not (options.with_id_regexps or options.without_id_regexps or
+            options.include_lists or options.exclude_lists):
+        return None
+    with_re = (options.with_id_regexps and
+               _compile_re_from_list(options.with_id_regexps))
+    without_re = (options.without_id_regexps and
+                  _compile_re_from_list(options.without_id_regexps))
+    include = _read_id_lists(options.include_lists)
+    exclude = _read_id_lists(options.exclude_lists)
+
+    def check_id(test_id):
+        if with_re and not with_re.search(test_id):
+            return False
+        if without_re and without_re.search(test_id):
+            return False
+        if include is not None and test_id not in include:
+            return False
+        if exclude is not None and test_id in exclude:
+            return False
+        return True
+    return check_id
+
+
+def _make_predicate(options):
+    """Make the predicate for the --with, --without and tag options.
+
+    :return: The predicate, or None if none of those options were given.
+    """
+    predicates = []
+    if options.with_regexps or options.without_regexps:
+        predicates.append(_make_regexp_filter(
+            options.with_regexps, options.without_regexps))
+    if options.with_tags or options.without_tags:
+        predicates.append(test_results.make_tag_filter(
+            options.with_tags, options.without_tags))
+    if not predicates:
+        return None
+    return test_results.and_predicates(predicates)
+
+
+def _make_filter(result, options, predicate, profiler=None):
+    """Make a StreamResult that passes the tests options select to result."""
     fixup_expected_failures = set()
     for path in options.fixup_expected_failures or ():
         fixup_expected_failures.update(pysubunit.read_test_list(path))
-    return testtools.StreamToExtendedDecorator(test_results.TestResultFilter(
-        testtools.ExtendedToStreamDecorator(
-            v2.StreamResultToBytes(output)),
+    result_filter = test_results.StreamResultFilter(
+        result,
         filter_error=options.error,
         filter_failure=options.failure,
         filter_success=options.success,
         filter_skip=options.skip,
         filter_xfail=options.xfail,
         filter_predicate=predicate,
-        fixup_expected_failures=fixup_expected_failures))
+        fixup_expected_failures=fixup_expected_failures,
+        passthrough=not options.no_passthrough,
+        id_predicate=_make_id_predicate(options),
+        spill_threshold=options.spill_threshold)
+    if profiler is not None:
+        result_filter = profiler.wrap(result_filter)
+    return result_filter
+
+
+def _make_result(output, options, predicate, metrics=None, profiler=None):
+    """Make the result that we'll send the test outcomes to.
+
+    Events that carry packet_bytes are written to output as the packets
+    they were read from.
+    """
+    result = v2.StreamResultToBytes(output, metrics=metrics)
+    if profiler is not None:
+        result = profiler.wrap(result)
+    return _make_filter(result, options, predicate, profiler=profiler)
 
 
 def main():
     parser = make_options(__doc__)
     (options, args) = parser.parse_args()
 
-    regexp_filter = _make_regexp_filter(
-        options.with_regexps, options.without_regexps)
-    tag_filter = test_results.make_tag_filter(
-        options.with_tags, options.without_tags)
-    filter_predicate = test_results.and_predicates(
-        [regexp_filter, tag_filter])
-
-    filters.filter_by_result(
-        lambda output_to: _make_result(sys.stdout, options, filter_predicate),
-        output_path=None,
-        passthrough=(not options.no_passthrough),
-        forward=False,
-        protocol_version=2,
-        input_stream=filters.find_stream(sys.stdin, args))
+    filter_predicate = _make_predicate(options)
+    if options.stats_to:
+        metrics = v2.StreamMetrics()
+    else:
+        metrics = None
+    if options.profile:
+        profiler = test_results.ResultProfiler()
+    else:
+        profiler = None
+
+    try:
+        result = _make_result(
+            sys.stdout, options, filter_predicate, metrics=metrics,
+            profiler=profiler)
+    except ValueError as e:
+        parser.error(str(e))
+    case = v2.ByteStreamToStreamResult(
+        filters.find_stream(sys.stdin, args), non_subunit_name='stdout',
+        metrics=metrics, packet_bytes=True)
+    result.startTestRun()
+    case.run(result)
+    result.stopTestRun()
+    if metrics is not None:
+        filters.write_metrics(metrics, options.stats_to)
+    if profiler is not None:
+        profiler.report(sys.stderr)
     sys.exit(0)
 
 
@@ -18,11 +18,9 @@
 import optparse
 import sys
 
-import testtools
-
-import pysubunit
 from pysubunit import filters
 from pysubunit import test_results
+from pysubunit import v2
 
 
 def main():
@@ -40,25 +38,20 @@ def main():
         help="Hide all non subunit input.", default=False,
         dest="no_passthrough")
     (options, args) = parser.parse_args()
-    test = pysubunit.ByteStreamToStreamResult(
+    test = v2.ByteStreamToStreamResult(
         filters.find_stream(sys.stdin, args), non_subunit_name="stdout")
-    result = test_results.TestIdPrintingResult(sys.stdout,
-                                               options.times,
-                                               options.exists)
-    if not options.no_passthrough:
-        result = testtools.StreamResultRouter(result)
-        cat = test_results.CatFiles(sys.stdout)
-        result.add_rule(cat, 'test_id', test_id=None)
-    summary = testtools.StreamSummary()
-    result = testtools.CopyStreamResult([result, summary])
+    result = test_results.StreamIdPrintingResult(
+        sys.stdout, options.times, options.exists,
+        passthrough=not options.no_passthrough)
     result.startTestRun()
     test.run(result)
     result.stopTestRun()
-    if summary.wasSuccessful():
+    if result.wasSuccessful():
         exit_code = 0
     else:
         exit_code = 1
     sys.exit(exit_code)
 
-if __name__ == 'main':
+
+if __name__ == '__main__':
     main()
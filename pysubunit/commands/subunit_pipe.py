@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Run several subunit filters over a stream in one process.
+
+Each argument is a stage, quoted as it would be typed on its own command
+line. The stream is parsed once and passed through the stages in order; if
+the last stage is not an output, the result is written as v2 subunit.
+
+  subunit-pipe 'tags worker-1' 'filter --no-skip' csv
+
+is equivalent to
+
+  subunit-tags worker-1 | subunit-filter --no-skip | subunit2csv
+
+Stages:
+  tags TAG|-TAG...   add and remove tags, as subunit-tags does.
+  filter OPTIONS     filter tests with the options of subunit-filter.
+
+Outputs:
+  v2                 a v2 subunit stream (the default).
+  v1                 a v1 subunit stream, as subunit-2to1 does.
+  csv                CSV, as subunit2csv does.
+  junitxml           JUnit XML, as subunit2junitxml does.
+  stats              a summary, as subunit-stats does.
+  disk [-d DIR]      files on disk, as subunit2disk does.
+"""
+
+import optparse
+import shlex
+import sys
+
+import pysubunit
+from pysubunit import filters
+from pysubunit import v2
+
+STAGES = {}
+OUTPUTS = {}
+
+
+def stage(name):
+    """Register a stage: a function of (args, result) returning the
+    StreamResult that feeds result."""
+    def register(function):
+        STAGES[name] = function
+        return function
+    return register
+
+
+def output(name):
+    """Register an output: a function of (args, stream, options) returning
+    a StreamResult and a callable giving the exit code once the run ends."""
+    def register(function):
+        OUTPUTS[name] = function
+        return function
+    return register
+
+
+def _passthrough(result, stream):
+    """Route non-test events around a result that would drop them."""
+    import testtools
+    from pysubunit import test_results
+    router = testtools.StreamResultRouter(result)
+    router.add_rule(
+        test_results.CatFiles(stream), 'test_id', test_id=None)
+    return router
+
+
+def _extended(result):
+    import testtools
+    return testtools.StreamToExtendedDecorator(result)
+
+
+@stage('tags')
+def _tags(args, result):
+    new_tags, gone_tags = pysubunit.tags_to_new_gone(args)
+    return pysubunit._Tagger(result, new_tags, gone_tags)
+
+
+@stage('filter')
+def _filter(args, result):
+    from pysubunit.commands import subunit_filter
+    options, args = subunit_filter.make_options(None).parse_args(args)
+    if args:
+        raise ValueError('filter: unexpected arguments %r' % (args,))
+    return subunit_filter._make_filter(
+        result, options, subunit_filter._make_predicate(options))
+
+
+def _exit_code(result):
+    return lambda: 0 if result.wasSuccessful() else 1
+
+
+@output('v2')
+def _v2(args, stream, options):
+    return v2.StreamResultToBytes(stream, metrics=options.metrics), lambda: 0
+
+
+@output('v1')
+def _v1(args, stream, options):
+    return _passthrough(_extended(
+        pysubunit.TestProtocolClient(stream)), stream), lambda: 0
+
+
+@output('csv')
+def _csv(args, stream, options):
+    from pysubunit import test_results
+    result = test_results.CsvResult(stream)
+    return _passthrough(_extended(result), stream), _exit_code(result)
+
+
+@output('junitxml')
+def _junitxml(args, stream, options):
+    from junitxml import JUnitXmlResult
+    result = JUnitXmlResult(stream)
+    return _passthrough(_extended(result), stream), _exit_code(result)
+
+
+@output('stats')
+def _stats(args, stream, options):
+    from pysubunit import stats
+    result = stats.StreamResultStats(stream)
+
+    def finish():
+        result.formatStats()
+        return _exit_code(result)()
+    return _passthrough(result, stream), finish
+
+
+@output('disk')
+def _disk(args, stream, options):
+    import testtools
+    from pysubunit import _to_disk
+    parser = optparse.OptionParser(prog='disk')
+    parser.add_option(
+        "-d", "--directory", help="Root directory to export to.",
+        default=".")
+    disk_options, args = parser.parse_args(args)
+    if args:
+        raise ValueError('disk: unexpected arguments %r' % (args,))
+    exporter = _to_disk.DiskExporter(disk_options.directory)
+    return testtools.StreamToDict(exporter.export), lambda: 0
+
+
+def make_pipeline(stages, stream, options):
+    """Build the StreamResult for a list of stage command lines.
+
+    :param stages: A list of stages, each a list of words.
+    :param stream: The stream for the output stage to write to.
+    :param options: The subunit-pipe options.
+    :return: A StreamResult and a callable giving the exit code once the
+        run has finished.
+    """
+    stages = list(stages)
+    name, args = 'v2', []
+    if stages and stages[-1] and stages[-1][0] in OUTPUTS:
+        words = stages.pop()
+        name, args = words[0], words[1:]
+    result, finish = OUTPUTS[name](args, stream, options)
+    for words in reversed(stages):
+        if not words or words[0] not in STAGES:
+            raise ValueError('unknown stage %r' % ' '.join(words))
+        result = STAGES[words[0]](words[1:], result)
+    return result, finish
+
+
+def make_options(description):
+    parser = optparse.OptionParser(
+        usage='%prog [options] STAGE...', description=description,
+        formatter=_RawDescription())
+    parser.disable_interspersed_args()
+    parser.add_option(
+        "--v1", dest="protocol_version", action="store_const", const=1,
+        default=2, help="Read a v1 stream, as subunit-1to2 does.")
+    parser.add_option(
+        "--no-passthrough", action="store_true", default=False,
+        help="Discard all non subunit input.")
+    filters.add_stats_option(parser)
+    return parser
+
+
+class _RawDescription(optparse.IndentedHelpFormatter):
+
+    def format_description(self, description):
+        return description
+
+
+def main():
+    parser = make_options(__doc__)
+    (options, args) = parser.parse_args()
+    if options.stats_to:
+        options.metrics = v2.StreamMetrics()
+    else:
+        options.metrics = None
+    try:
+        result, finish = make_pipeline(
+            [shlex.split(arg) for arg in args], sys.stdout, options)
+    except ValueError as e:
+        parser.error(str(e))
+    passthrough = None
+    if options.protocol_version == 1:
+        import testtools
+        result = testtools.ExtendedToStreamDecorator(result)
+        if options.no_passthrough:
+            passthrough = pysubunit.DiscardStream()
+    elif options.no_passthrough:
+        import testtools
+        result = testtools.StreamResultRouter(result)
+        result.add_rule(
+            testtools.StreamResult(), 'test_id', test_id=None,
+            do_start_stop_run=False)
+    filters.run_tests_from_stream(
+        sys.stdin, result, passthrough_stream=passthrough,
+        protocol_version=options.protocol_version, metrics=options.metrics)
+    if options.metrics is not None:
+        filters.write_metrics(options.metrics, options.stats_to)
+    sys.exit(finish())
+
+
+if __name__ == '__main__':
+    main()
@@ -14,26 +14,81 @@
 # under the License.
 
 
-"""Filter a subunit stream to get aggregate statistics."""
+"""Filter a subunit stream to get aggregate statistics.
 
-import sys
+With --verbose or --json the statistics also break the tests down by status
+and by tag, and report how long the tests took and which were slowest.
+"""
 
-import testtools
+import codecs
+import json
+import sys
 
 import pysubunit
 from pysubunit import filters
+from pysubunit import stats
+from pysubunit import v2
 
 
-def main():
-    result = pysubunit.TestResultStats(sys.stdout)
+def make_options(description):
+    parser = filters.make_options(description)
+    parser.add_option(
+        "--json", action="store_true", default=False,
+        help="Write the statistics as JSON. Non-subunit input is not "
+             "passed through.")
+    parser.add_option(
+        "-v", "--verbose", action="store_true", default=False,
+        help="Follow the totals with the counts by status and tag, the test "
+             "times and the slowest tests.")
+    parser.add_option(
+        "--slowest", type=int, default=10, metavar="N",
+        help="Report the N slowest tests (default: %default).")
+    return parser
+
+
+class _StatsReport(stats.StreamResultStats):
+    """Write the statistics to the output stream when the run stops.
 
-    def show_stats(r):
-        r.decorated.formatStats()
+    The output stream is closed once the run is over, so the report can not
+    wait until then.
+    """
 
-    filters.run_filter_script(
-        lambda output: testtools.StreamToExtendedDecorator(result),
-        __doc__, show_stats, protocol_version=2, passthrough_subunit=False)
+    def __init__(self, output, options):
+        self._output = pysubunit.make_stream_binary(output)
+        super(_StatsReport, self).__init__(
+            codecs.getwriter('utf-8')(self._output), slowest=options.slowest)
+        self._options = options
+
+    def stopTestRun(self):
+        super(_StatsReport, self).stopTestRun()
+        if self._options.json:
+            json.dump(self.as_dict(), self._stream, indent=2, sort_keys=True)
+            self._stream.write('\n')
+        else:
+            self.formatStats(verbose=self._options.verbose)
+        self._output.flush()
+
+
+def main():
+    parser = make_options(__doc__)
+    (options, args) = parser.parse_args()
+    if options.stats_to:
+        metrics = v2.StreamMetrics()
+    else:
+        metrics = None
+    result = filters.filter_by_result(
+        lambda output: _StatsReport(output, options), options.output_to,
+        not (options.no_passthrough or options.json), options.forward,
+        protocol_version=2,
+        passthrough_subunit=False,
+        input_stream=filters.find_stream(sys.stdin, args), metrics=metrics)
+    if metrics is not None:
+        filters.write_metrics(metrics, options.stats_to)
+    if result.wasSuccessful():
+        sys.exit(0)
+    else:
+        sys.exit(1)
 
 
-if __name__ == 'main':
+if __name__ == '__main__':
     main()
@@ -15,7 +15,7 @@
 
 """Handlers for outcome details."""
 
-import io
+import tempfile
 
 import six
 import testtools
@@ -26,6 +26,77 @@ end_marker = six.binary_type("]\n".encode('latin-1'))
 quoted_marker = six.binary_type(" ]".encode('latin-1'))
 empty = six.binary_type(''.encode('latin-1'))
 
+# Details bigger than this are moved out of memory to a temporary file.
+SPOOL_THRESHOLD = 1024 * 1024
+
+
+class _Spool(object):
+    """A write-only byte buffer whose contents can be read back lazily.
+
+    Writes are kept as a list of chunks until they add up to more than
+    threshold bytes, after which everything is moved to a temporary file.
+    The file is closed by close(), or when the spool is garbage collected,
+    which is when the Content reading from it is discarded.
+    """
+
+    def __init__(self, threshold=None):
+        self._chunks = []
+        self._size = 0
+        self._file = None
+        if threshold is None:
+            threshold = SPOOL_THRESHOLD
+        self._threshold = threshold
+
+    def write(self, data):
+        if not data:
+            return
+        if type(data) is not six.binary_type:
+            # Callers may reuse their buffer once write returns.
+            data = memoryview(data).tobytes()
+        if self._file is not None:
+            self._file.seek(0, 2)
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size > self._threshold:
+            self._file = tempfile.TemporaryFile()
+            for chunk in self._chunks:
+                self._file.write(chunk)
+            self._chunks = None
+
+    def iter_bytes(self):
+        """Yield the bytes written so far, in chunks.
+
+        Each iterator keeps its own position in the file, so iterators
+        that are interleaved or abandoned do not affect one another.
+        """
+        if self._file is None:
+            for chunk in self._chunks:
+                yield chunk
+            return
+        offset = 0
+        while True:
+            self._file.seek(offset)
+            block = self._file.read(65536)
+            if not block:
+                break
+            offset += len(block)
+            yield block
+
+    def getvalue(self):
+        """Return everything written so far as a single bytes object."""
+        return empty.join(self.iter_bytes())
+
+    def close(self):
+        """Close the temporary file, if any; the spool cannot be read
+        afterwards."""
+        if self._file is not None:
+            self._file.close()
+
+    def __del__(self):
+        self.close()
+
 
 class DetailsParser(object):
     """Base class/API reference for details parsing."""
@@ -35,18 +106,22 @@ class SimpleDetailsParser(DetailsParser):
     """Parser for single-part [] delimited details."""
 
     def __init__(self, state):
-        self._message = six.binary_type("".encode('latin-1'))
+        self._spool = _Spool()
         self._state = state
 
+    @property
+    def _message(self):
+        return self._spool.getvalue()
+
     def lineReceived(self, line):
         if line == end_marker:
             self._state.endDetails()
             return
         if line[0:2] == quoted_marker:
             # quoted ] start
-            self._message += line[1:]
+            self._spool.write(line[1:])
         else:
-            self._message += line
+            self._spool.write(line)
 
     def get_details(self, style=None):
         result = {}
@@ -57,7 +132,7 @@ class SimpleDetailsParser(DetailsParser):
             result['traceback'] = testtools.content.Content(
                 testtools.content_type.ContentType("text", "x-traceback",
                                                    {"charset": "utf8"}),
-                lambda: [self._message])
+                self._spool.iter_bytes)
         else:
             if style == 'skip':
                 name = 'reason'
@@ -65,11 +140,11 @@ class SimpleDetailsParser(DetailsParser):
                 name = 'message'
             result[name] = testtools.content.Content(
                 testtools.content_type.ContentType("text", "plain"),
-                lambda: [self._message])
+                self._spool.iter_bytes)
         return result
 
     def get_message(self):
-        return self._message
+        return self._spool.getvalue()
 
 
 class MultipartDetailsParser(DetailsParser):
@@ -94,7 +169,7 @@ class MultipartDetailsParser(DetailsParser):
 
     def _get_name(self, line):
         self._name = line[:-1].decode('utf8')
-        self._body = io.BytesIO()
+        self._body = _Spool()
         self._chunk_parser = chunked.Decoder(self._body)
         self._parse_state = self._feed_chunks
 
@@ -103,9 +178,8 @@ class MultipartDetailsParser(DetailsParser):
         if residue is not None:
             # Line based use always ends on no residue.
             assert residue == empty, 'residue: %r' % (residue,)
-            body = self._body
             self._details[self._name] = testtools.content.Content(
-                self._content_type, lambda: [body.getvalue()])
+                self._content_type, self._body.iter_bytes)
             self._chunk_parser.close()
             self._parse_state = self._look_for_content
 
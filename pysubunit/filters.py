@@ -13,6 +13,7 @@
 # under the License.
 
 
+import json
 from optparse import OptionParser
 import sys
 
@@ -37,12 +38,28 @@ def make_options(description):
         "-f", "--forward", action="store_true", default=False,
         help="Forward subunit stream on stdout. When set, received "
              "non-subunit output will be encapsulated in subunit.")
+    add_stats_option(parser)
     return parser
 
 
+def add_stats_option(parser):
+    """Add the --stats-to option to an OptionParser."""
+    parser.add_option(
+        "--stats-to", dest="stats_to", default=None, metavar="FILE",
+        help="Write JSON counters and timings for the v2 parser to FILE "
+             "when the run finishes.")
+
+
+def write_metrics(metrics, path):
+    """Write a v2.StreamMetrics to path as JSON."""
+    with open(path, 'w') as stats_file:
+        json.dump(metrics.as_dict(), stats_file, indent=2, sort_keys=True)
+        stats_file.write('\n')
+
+
 def run_tests_from_stream(input_stream, result, passthrough_stream=None,
                           forward_stream=None, protocol_version=1,
-                          passthrough_subunit=True):
+                          passthrough_subunit=True, metrics=None):
     """Run tests from a subunit input stream through 'result'.
 
     Non-test events - top level file attachments - are expected to be
@@ -66,6 +83,8 @@ def run_tests_from_stream(input_stream, result, passthrough_stream=None,
         otherwise unwrap it. Only has effect when forward_stream is None.
         (when forwarding as subunit non-subunit input is always turned into
         subunit)
+    :param metrics: An optional v2.StreamMetrics for the input parser. Only
+        used with protocol version 2.
     """
     if 1 == protocol_version:
         test = pysubunit.ProtocolTestCase(
@@ -97,7 +116,8 @@ def run_tests_from_stream(input_stream, result, passthrough_stream=None,
             result = testtools.StreamResultRouter(result)
             result.add_rule(passthrough_result, 'test_id', test_id=None)
         test = v2.ByteStreamToStreamResult(input_stream,
-                                           non_subunit_name='stdout')
+                                           non_subunit_name='stdout',
+                                           metrics=metrics)
     else:
         raise Exception("Unknown protocol version.")
     result.startTestRun()
@@ -107,7 +127,7 @@ def run_tests_from_stream(input_stream, result, passthrough_stream=None,
 
 def filter_by_result(result_factory, output_path, passthrough, forward,
                      input_stream=sys.stdin, protocol_version=1,
-                     passthrough_subunit=True):
+                     passthrough_subunit=True, metrics=None):
     """Filter an input stream using a test result.
 
     :param result_factory: A callable that when passed an output stream
@@ -123,6 +143,7 @@ def filter_by_result(result_factory, output_path, passthrough, forward,
         ``sys.stdin``.
     :param protocol_version: The subunit protocol version to expect.
     :param passthrough_subunit: If True, passthrough should be as subunit.
+    :param metrics: An optional v2.StreamMetrics for the input parser.
     :return: A test result with the results of the run.
     """
     if passthrough:
@@ -150,7 +171,7 @@ def filter_by_result(result_factory, output_path, passthrough, forward,
         run_tests_from_stream(
             input_stream, result, passthrough_stream, forward_stream,
             protocol_version=protocol_version,
-            passthrough_subunit=passthrough_subunit)
+            passthrough_subunit=passthrough_subunit, metrics=metrics)
     finally:
         if output_path:
             output_to.close()
@@ -176,11 +197,17 @@ def run_filter_script(result_factory, description, post_run_hook=None,
     """
     parser = make_options(description)
     (options, args) = parser.parse_args()
+    if options.stats_to:
+        metrics = v2.StreamMetrics()
+    else:
+        metrics = None
     result = filter_by_result(
         result_factory, options.output_to, not options.no_passthrough,
         options.forward, protocol_version=protocol_version,
         passthrough_subunit=passthrough_subunit,
-        input_stream=find_stream(sys.stdin, args))
+        input_stream=find_stream(sys.stdin, args), metrics=metrics)
+    if metrics is not None:
+        write_metrics(metrics, options.stats_to)
     if post_run_hook:
         post_run_hook(result)
     if not safe_hasattr(result, 'wasSuccessful'):
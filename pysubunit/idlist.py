@@ -0,0 +1,167 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Match test ids against long lists of ids, prefixes and substrings.
+
+Each line of an id list file is one pattern:
+
+  pkg.tests.test_a.TestA.test_one  the test with exactly this id.
+  pkg.tests.test_b.*               tests with ids starting pkg.tests.test_b.
+  *TestSlow*                       tests with ids containing TestSlow.
+
+Blank lines and lines starting with '#' are ignored.
+
+Exact ids are kept in a set, prefixes in a trie and substrings in an
+Aho-Corasick automaton, so checking an id takes time proportional to its
+length however long the list is.
+"""
+
+import io
+
+# The key marking the end of a prefix in a trie node; characters are never
+# None.
+_END = None
+
+
+class _Automaton(object):
+    """An Aho-Corasick automaton finding whether any of a set of strings
+    occurs in a text."""
+
+    def __init__(self):
+        # State 0 is the root. goto maps a state to its transitions,
+        # fail to the state for the longest proper suffix of the state's
+        # string that is also a state, and matches to whether a string ends
+        # at the state or any of its suffixes.
+        self.goto = [{}]
+        self.fail = [0]
+        self.matches = [False]
+        self._built = True
+
+    def add(self, string):
+        state = 0
+        for char in string:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.matches.append(False)
+                self.goto[state][char] = next_state
+            state = next_state
+        self.matches[state] = True
+        self._built = False
+
+    def _build(self):
+        goto, fail, matches = self.goto, self.fail, self.matches
+        queue = list(goto[0].values())
+        for state in queue:
+            fail[state] = 0
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                suffix = fail[state]
+                while suffix and char not in goto[suffix]:
+                    suffix = fail[suffix]
+                fail[next_state] = goto[suffix].get(char, 0)
+                matches[next_state] = (
+                    matches[next_state] or matches[fail[next_state]])
+        self._built = True
+
+    def search(self, text):
+        """Return True if any of the strings occurs in text."""
+        if not self._built:
+            self._build()
+        goto, fail, matches = self.goto, self.fail, self.matches
+        if matches[0]:
+            return True
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if matches[state]:
+                return True
+        return False
+
+
+class IdList(object):
+    """A list of test ids, id prefixes and id substrings.
+
+    ``test_id in id_list`` is True if test_id matches any of them.
+    """
+
+    def __init__(self, patterns=()):
+        self.ids = set()
+        self._prefixes = {}
+        self._substrings = None
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern):
+        """Add a pattern, in the syntax of id list files.
+
+        :raises ValueError: If pattern has a '*' other than at its end, or
+            at both its start and its end.
+        """
+        if pattern.startswith('*') and pattern.endswith('*') and (
+                len(pattern) > 1):
+            substring = pattern[1:-1]
+            if '*' in substring:
+                raise ValueError("unsupported pattern '%s'" % pattern)
+            if self._substrings is None:
+                self._substrings = _Automaton()
+            self._substrings.add(substring)
+        elif pattern.endswith('*'):
+            prefix = pattern[:-1]
+            if '*' in prefix:
+                raise ValueError("unsupported pattern '%s'" % pattern)
+            node = self._prefixes
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[_END] = True
+        elif '*' in pattern:
+            raise ValueError("unsupported pattern '%s'" % pattern)
+        else:
+            self.ids.add(pattern)
+
+    def read(self, path):
+        """Add the patterns in the id list file at path.
+
+        :raises ValueError: If the file has an unsupported pattern.
+        """
+        with io.open(path, encoding='utf-8') as id_file:
+            for number, line in enumerate(id_file, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                try:
+                    self.add(line)
+                except ValueError as e:
+                    raise ValueError('%s:%d: %s' % (path, number, e))
+
+    def _has_prefix(self, test_id):
+        node = self._prefixes
+        for char in test_id:
+            if _END in node:
+                return True
+            node = node.get(char)
+            if node is None:
+                return False
+        return _END in node
+
+    def __contains__(self, test_id):
+        if test_id in self.ids:
+            return True
+        if self._prefixes and self._has_prefix(test_id):
+            return True
+        return (self._substrings is not None and
+                self._substrings.search(test_id))
@@ -0,0 +1,319 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Run isolated tests in a pool of long lived worker processes.
+
+run_isolated forks a new process (and protocol client) for every
+IsolatedTestCase or IsolatedTestSuite it runs. When there are thousands of
+those, forking and reporting dominate the run. An IsolatedWorkerPool forks
+its workers once, after the tests are loaded, and has each run many isolated
+units in turn, reporting over one v2 pipe. Workers are replaced after
+max_tests units, or when they die.
+
+Tests still cannot affect the process that runs them, but a unit can see
+state left behind by earlier units in the same worker. Use max_tests=1 for
+a fresh process per unit.
+"""
+
+import collections
+import io
+import os
+import sys
+import traceback
+import unittest
+
+import extras
+import testtools
+
+import pysubunit
+from pysubunit import run as _run
+from pysubunit import test_results
+from pysubunit import v2
+
+selectors = extras.try_imports(['selectors', 'selectors2'])
+
+__all__ = [
+    'IsolatedWorkerPool',
+    'PooledTestSuite',
+    ]
+
+# The test id of the packet a worker sends when it has finished a unit.
+_DONE = 'pysubunit.pool.done'
+
+
+def isolated_units(test):
+    """Yield the units of test that are run in isolation from each other.
+
+    Plain suites are expanded; cases and IsolatedTestSuites are units.
+    """
+    if (isinstance(test, unittest.TestSuite) and
+            not isinstance(test, pysubunit.IsolatedTestSuite)):
+        for child in test:
+            for unit in isolated_units(child):
+                yield unit
+    else:
+        yield test
+
+
+def _run_unit(unit, result):
+    # Isolated units are already in a worker; don't fork again.
+    if isinstance(unit, pysubunit.IsolatedTestSuite):
+        unittest.TestSuite.run(unit, result)
+    elif isinstance(unit, pysubunit.IsolatedTestCase):
+        unittest.TestCase.run(unit, result)
+    else:
+        unit.run(result)
+
+
+def _unit_id(unit):
+    try:
+        return unit.id()
+    except AttributeError:
+        return '%s.%s' % (type(unit).__module__, type(unit).__name__)
+
+
+class _Worker(object):
+    """The parent's view of a worker process."""
+
+    def __init__(self, pid, commands, results, route_code):
+        self.pid = pid
+        self.commands = commands
+        self.results = results
+        self.route_code = route_code
+        self.unit = None
+        self.done = 0
+        self.buffered = bytearray()
+
+
+class _Done(testtools.StreamResult):
+    """Receive the unit finished packets from workers."""
+
+    def __init__(self, pool):
+        super(_Done, self).__init__()
+        self.pool = pool
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        worker = self.pool._routes[route_code]
+        worker.unit = None
+        worker.done += 1
+
+
+class IsolatedWorkerPool(object):
+    """Run isolated units in a pool of pre-forked worker processes.
+
+    :ivar size: The number of workers to run at once.
+    :ivar max_tests: Replace a worker after it has run this many units.
+        None means never.
+    """
+
+    def __init__(self, size=1, max_tests=100):
+        self.size = size
+        self.max_tests = max_tests
+        self._route_codes = 0
+
+    def run(self, test, result):
+        """Run the units of test in the pool, reporting to result.
+
+        As with run_isolated, result is expected to be inside a test run
+        already.
+        """
+        units = list(isolated_units(test))
+        self._queue = collections.deque(range(len(units)))
+        self._workers = {}
+        self._routes = {}
+        self._lost = test_results._LostTests(result)
+        decorator = testtools.StreamToExtendedDecorator(self._lost)
+        self._in_flight = test_results._InFlight()
+        router = testtools.StreamResultRouter(
+            testtools.CopyStreamResult([decorator, self._in_flight]))
+        router.add_rule(
+            test_results.CatFiles(sys.stdout), 'test_id', test_id=None)
+        router.add_rule(_Done(self), 'test_id', test_id=_DONE)
+        self._decorator = decorator
+        decorator.hook.startTestRun()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        selector = selectors.DefaultSelector()
+        try:
+            self._replace(units, selector)
+            while self._workers:
+                for key, _ in selector.select():
+                    self._read(key.fileobj, units, selector, router)
+        finally:
+            selector.close()
+        decorator.hook.stopTestRun()
+        return result
+
+    def _spawn(self, units, selector):
+        self._route_codes += 1
+        route_code = str(self._route_codes)
+        command_read, command_write = os.pipe()
+        result_read, result_write = os.pipe()
+        try:
+            pid = os.fork()
+        except OSError:
+            for fd in command_read, command_write, result_read, result_write:
+                os.close(fd)
+            raise
+        if pid == 0:
+            inherited = [command_write, result_read]
+            for worker in self._workers.values():
+                inherited.append(worker.results)
+                if worker.commands is not None:
+                    inherited.append(worker.commands)
+            self._serve(
+                units, command_read, result_write, route_code, inherited)
+        os.close(command_read)
+        os.close(result_write)
+        worker = _Worker(pid, command_write, result_read, route_code)
+        self._workers[result_read] = worker
+        self._routes[route_code] = worker
+        selector.register(result_read, selectors.EVENT_READ)
+        return worker
+
+    def _serve(self, units, command_fd, result_fd, route_code, inherited):
+        """Run units as the parent asks for them; never returns."""
+        code = 1
+        try:
+            # Other workers must see EOF when the parent closes their pipes.
+            for fd in inherited:
+                os.close(fd)
+            os.dup2(result_fd, 1)
+            os.close(result_fd)
+            stream = os.fdopen(1, 'wb')
+            output = v2.StreamResultToBytes(stream)
+            result = testtools.ExtendedToStreamDecorator(
+                _run._RouteCodeTagger([output], route_code))
+            result.startTestRun()
+            for line in io.open(command_fd, 'rb'):
+                _run_unit(units[int(line)], result)
+                # Anything the unit printed belongs before the marker.
+                sys.stdout.flush()
+                output.status(test_id=_DONE, route_code=route_code)
+            result.stopTestRun()
+            stream.flush()
+            code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _replace(self, units, selector):
+        """Start workers until size of them take units, or none are queued.
+
+        If no worker can be started and none are left to run the queued
+        units, they are reported as errors.
+        """
+        while self._queue and self.size > sum(
+                1 for worker in self._workers.values()
+                if worker.commands is not None):
+            try:
+                worker = self._spawn(units, selector)
+            except OSError as e:
+                if not self._workers:
+                    self._report_unrun(units, e)
+                return
+            self._dispatch(worker)
+
+    def _dispatch(self, worker):
+        if not self._queue or (
+                self.max_tests is not None and worker.done >= self.max_tests):
+            self._retire(worker)
+            return
+        worker.unit = self._queue.popleft()
+        try:
+            os.write(worker.commands, b'%d\n' % worker.unit)
+        except OSError:
+            # The worker is gone; another will run the unit once its exit
+            # is seen.
+            self._queue.appendleft(worker.unit)
+            worker.unit = None
+            self._retire(worker)
+
+    def _retire(self, worker):
+        # Closing the command pipe lets the worker finish.
+        if worker.commands is not None:
+            os.close(worker.commands)
+            worker.commands = None
+
+    def _read(self, fd, units, selector, router):
+        worker = self._workers[fd]
+        data = os.read(fd, 65536)
+        if data:
+            worker.buffered += data
+            end = v2.complete_packets(worker.buffered)
+            if end:
+                v2.ByteStreamToStreamResult(
+                    io.BytesIO(bytes(worker.buffered[:end])),
+                    non_subunit_name='stdout').run(router)
+                del worker.buffered[:end]
+            if worker.unit is None and worker.commands is not None:
+                self._dispatch(worker)
+                if worker.commands is None:
+                    # Retired: start its replacement straight away.
+                    self._replace(units, selector)
+            return
+        # The worker has exited, or died.
+        selector.unregister(fd)
+        os.close(fd)
+        del self._workers[fd]
+        del self._routes[worker.route_code]
+        self._retire(worker)
+        _, status = os.waitpid(worker.pid, 0)
+        if worker.buffered:
+            # The worker died part way through writing a packet; pass on
+            # what it wrote as it is.
+            router.status(
+                file_name='stdout', file_bytes=bytes(worker.buffered))
+            del worker.buffered[:]
+        if worker.unit is not None:
+            self._report_crash(worker, units[worker.unit], status)
+        self._replace(units, selector)
+
+    def _report_crash(self, worker, unit, status):
+        test_id = self._in_flight.tests.pop(worker.route_code, None)
+        if test_id is None:
+            test_id = _unit_id(unit)
+        self._lost.lose(
+            test_id, 'worker process %d died with status %d running %s\n' % (
+                worker.pid, status, _unit_id(unit)))
+        self._decorator.status(
+            test_id=test_id, test_status='fail',
+            route_code=worker.route_code)
+
+    def _report_unrun(self, units, error):
+        message = 'could not start a worker process: %s\n' % (error,)
+        while self._queue:
+            unit = units[self._queue.popleft()]
+            for test in testtools.iterate_tests(unit):
+                self._lost.lose(test.id(), message)
+                self._decorator.status(test_id=test.id(), test_status='fail')
+
+
+class PooledTestSuite(unittest.TestSuite):
+    """A TestSuite whose isolated units run in an IsolatedWorkerPool.
+
+    Set pool_size and max_tests on the class or the instance to size the
+    pool.
+    """
+
+    pool_size = 1
+    max_tests = 100
+
+    def run(self, result=None):
+        if result is None:
+            result = testtools.testresult.TestResult()
+        IsolatedWorkerPool(self.pool_size, self.max_tests).run(self, result)
+        return result
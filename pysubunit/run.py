@@ -19,22 +19,229 @@
 """Run a unittest testcase reporting results as Subunit.
 
   $ python -m subunit.run mylib.tests.test_suite
+
+Pass --parallel N to split the tests across N forked worker processes.
 """
 
+import argparse
+import heapq
 import io
+import json
 import os
 import sys
+import traceback
+import unittest
 
+import extras
+from testtools import CopyStreamResult
 from testtools import ExtendedToStreamDecorator
+from testtools import iterate_tests
+from testtools import StreamResult
 from testtools import run as testtools_run
 
+import pysubunit
 from pysubunit.test_results import AutoTimingTestResultDecorator
 from pysubunit import v2
 
+selectors = extras.try_imports(['selectors', 'selectors2'])
+
+
+class _DurationCollector(StreamResult):
+    """Collect test durations from inprogress and final status timestamps."""
+
+    def __init__(self):
+        super(_DurationCollector, self).__init__()
+        self.durations = {}
+        self._started = {}
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        if test_id is None or timestamp is None:
+            return
+        key = (test_id, route_code)
+        if test_status == 'inprogress':
+            self._started[key] = timestamp
+        elif test_status not in (None, 'exists') and key in self._started:
+            duration = timestamp - self._started.pop(key)
+            self.durations[test_id] = duration.total_seconds()
+
+
+def read_durations(stream):
+    """Read per-test durations from a previous run's subunit v2 stream.
+
+    :param stream: A byte stream holding the v2 output of an earlier run.
+    :return: A dict mapping test id to the seconds it took.
+    """
+    collector = _DurationCollector()
+    v2.ByteStreamToStreamResult(
+        stream, non_subunit_name='stdout').run(collector)
+    return collector.durations
+
+
+def partition_tests(test_ids, concurrency, durations=None):
+    """Split test_ids into concurrency partitions.
+
+    Without durations, tests are kept in their original order and split
+    into contiguous runs, so tests sharing a class or module (and their
+    fixtures) mostly stay together.
+
+    With durations (as returned by read_durations), tests with a known
+    duration are assigned longest first, each to the partition with the
+    least work so far. The remaining tests are then split evenly as above,
+    with any larger shares going to the least loaded partitions.
+    Each partition keeps the original test order.
+
+    :return: A list of concurrency lists of test ids.
+    """
+    if durations:
+        order = dict((test_id, index)
+                     for index, test_id in enumerate(test_ids))
+        timed = [test_id for test_id in test_ids if test_id in durations]
+        untimed = [test_id for test_id in test_ids
+                   if test_id not in durations]
+        timed.sort(key=lambda test_id: durations[test_id], reverse=True)
+        loads = [(0.0, index) for index in range(concurrency)]
+        partitions = [[] for index in range(concurrency)]
+        for test_id in timed:
+            load, index = heapq.heappop(loads)
+            partitions[index].append(test_id)
+            heapq.heappush(loads, (load + durations[test_id], index))
+        # Larger shares of the untimed tests go to the lighter partitions.
+        for (load, index), extra in zip(
+                sorted(loads), partition_tests(untimed, concurrency)):
+            partitions[index].extend(extra)
+            partitions[index].sort(key=order.__getitem__)
+        return partitions
+    size, extra = divmod(len(test_ids), concurrency)
+    partitions = []
+    start = 0
+    for index in range(concurrency):
+        end = start + size + (index < extra)
+        partitions.append(list(test_ids[start:end]))
+        start = end
+    return partitions
+
+
+class _RouteCodeTagger(CopyStreamResult):
+    """Prefix the route code of every event with a fixed route code."""
+
+    def __init__(self, targets, route_code):
+        super(_RouteCodeTagger, self).__init__(targets)
+        self.route_code = route_code
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        if route_code is None:
+            route_code = self.route_code
+        else:
+            route_code = self.route_code + '/' + route_code
+        super(_RouteCodeTagger, self).status(
+            test_id=test_id, test_status=test_status, test_tags=test_tags,
+            runnable=runnable, file_name=file_name, file_bytes=file_bytes,
+            eof=eof, mime_type=mime_type, route_code=route_code,
+            timestamp=timestamp)
+
+
+def _write_all(stream, data):
+    while data:
+        written = stream.write(data)
+        if written is None:
+            # Buffered streams write everything.
+            break
+        data = data[written:]
+    stream.flush()
+
+
+# Tests whose ids start with these stand for modules that failed to import;
+# see testtools.run.list_test.
+_import_failure_prefixes = (
+    'unittest.loader.ModuleImportFailure.',
+    'discover.ModuleImportFailure.',
+    )
+
+# How many exists packets to encode before writing them out.
+_LIST_BATCH = 1000
+
+
+def _load_list_cache(path, key):
+    """Return the cached listing in path, or None if it is out of date.
+
+    The cache is valid if it was saved with the same key and none of the
+    files it records (the test modules and their directories) have changed
+    since. Nothing else is checked: tests generated from other files, or
+    parametrized from data, are listed as they were when the cache was
+    saved.
+    """
+    try:
+        with open(path, 'rb') as cache:
+            header = json.loads(cache.readline().decode('utf8'))
+            if header.get('key') != key:
+                return None
+            for filename, mtime in header['mtimes'].items():
+                if _mtime(filename) != mtime:
+                    return None
+            return cache.read()
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def _mtime(path):
+    """Return the modification time of path, in ns where the OS has it."""
+    stat = os.stat(path)
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime)
+
+
+def _list_parser():
+    """Return a parser for just the options listing from a cache needs."""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        '-l', '--list', dest='listtests', default=False, action='store_true')
+    parser.add_argument('--load-list', dest='load_list', default=None)
+    parser.add_argument('--list-cache', dest='list_cache', default=None)
+    return parser
+
+
+def _save_list_cache(path, key, modules, data):
+    """Save the listing data of the tests from modules to path."""
+    mtimes = {}
+    for name in modules:
+        filename = getattr(sys.modules.get(name), '__file__', None)
+        if filename is None:
+            continue
+        # Directories change when test modules are added or removed.
+        for watched in (filename, os.path.dirname(filename) or '.'):
+            try:
+                mtimes[watched] = _mtime(watched)
+            except OSError:
+                pass
+    header = json.dumps({'key': key, 'mtimes': mtimes}, sort_keys=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as cache:
+        cache.write(header.encode('utf8') + b'\n')
+        cache.write(data)
+    os.rename(temp_path, path)
+
+
+class _ParallelRunResult(object):
+    """The outcome of a parallel run, as seen by the parent process.
+
+    :ivar failed_workers: The route codes of workers whose tests did not
+        all pass, or which died.
+    """
+
+    def __init__(self):
+        self.failed_workers = []
+
+    def wasSuccessful(self):
+        return not self.failed_workers
+
 
 class SubunitTestRunner(object):
     def __init__(self, verbosity=None, failfast=None, buffer=None, stream=None,
-                 stdout=None, tb_locals=False):
+                 stdout=None, tb_locals=False, parallel=None,
+                 durations=None):
         """Create a TestToolsTestRunner.
 
         :param verbosity: Ignored.
@@ -43,6 +250,10 @@ class SubunitTestRunner(object):
         :param stream: Upstream unittest stream parameter.
         :param stdout: Testtools stream parameter.
         :param tb_locals: Testtools traceback in locals parameter.
+        :param parallel: If more than 1, run the tests in this many forked
+            worker processes. Each worker's events carry its own route code.
+        :param durations: Optional per-test durations (see read_durations)
+            used to balance the work given to parallel workers.
 
         Either stream or stdout can be supplied, and stream will take
         precedence.
@@ -50,10 +261,20 @@ class SubunitTestRunner(object):
         self.failfast = failfast
         self.stream = stream or stdout or sys.stdout
         self.tb_locals = tb_locals
+        self.parallel = parallel
+        self.durations = durations
+        self.list_cache = None
+        self.list_cache_key = None
+        self.cached_list = None
 
     def run(self, test):
         "Run the given test case or test suite."
-        result, _ = self._list(test)
+        result, test_ids, _ = self._list(test)
+        if self.parallel is not None and self.parallel > 1:
+            return self._run_parallel(test, result.output_stream, test_ids)
+        return self._run(test, result)
+
+    def _run(self, test, result):
         result = ExtendedToStreamDecorator(result)
         result = AutoTimingTestResultDecorator(result)
         if self.failfast is not None:
@@ -66,9 +287,122 @@ class SubunitTestRunner(object):
             result.stopTestRun()
         return result
 
+    def _run_parallel(self, test, stream, test_ids):
+        cases = {}
+        for case in iterate_tests(test):
+            cases.setdefault(case.id(), []).append(case)
+        suites = []
+        for partition in partition_tests(
+                test_ids, self.parallel, self.durations):
+            suites.append(
+                unittest.TestSuite(cases[test_id].pop(0)
+                                   for test_id in partition))
+        # Tests list_test could not name (failed imports) still need to be
+        # run, so that their errors are reported.
+        for leftovers in cases.values():
+            suites[0].addTests(leftovers)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        workers = {}
+        for index, suite in enumerate(suites):
+            route_code = str(index)
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                for other_fd in workers:
+                    os.close(other_fd)
+                self._run_worker(suite, write_fd, route_code)
+            os.close(write_fd)
+            workers[read_fd] = (pid, route_code)
+        self._multiplex(stream, list(workers))
+        result = _ParallelRunResult()
+        for pid, route_code in workers.values():
+            _, status = os.waitpid(pid, 0)
+            if status:
+                result.failed_workers.append(route_code)
+            if not os.WIFEXITED(status) or os.WEXITSTATUS(status) > 1:
+                # The worker died rather than finishing its tests.
+                output = v2.StreamResultToBytes(stream)
+                output.status(
+                    test_id='pysubunit.run.worker', test_status='fail',
+                    route_code=route_code, eof=True,
+                    file_name='traceback', file_bytes=(
+                        'worker %s (pid %d) exited with status %d\n' % (
+                            route_code, pid, status)).encode('utf8'),
+                    mime_type='text/plain;charset=utf8')
+        return result
+
+    def _run_worker(self, suite, write_fd, route_code):
+        """Run suite in a forked worker; never returns."""
+        code = 3
+        try:
+            # Anything the tests print is carried through the pipe as
+            # non-subunit content.
+            os.dup2(write_fd, 1)
+            os.close(write_fd)
+            stream = os.fdopen(1, 'wb')
+            result = v2.StreamResultToBytes(stream)
+            result = _RouteCodeTagger([result], route_code)
+            result = self._run(suite, result)
+            stream.flush()
+            code = 0 if result.wasSuccessful() else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                # os._exit does not flush what the tests printed.
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+
+    def _multiplex(self, stream, fds):
+        """Copy the worker streams on fds to stream, a packet at a time."""
+        selector = selectors.DefaultSelector()
+        pending = {}
+        for fd in fds:
+            selector.register(fd, selectors.EVENT_READ)
+            pending[fd] = bytearray()
+        while pending:
+            for key, _ in selector.select():
+                fd = key.fd
+                data = os.read(fd, 65536)
+                buffered = pending[fd]
+                if not data:
+                    selector.unregister(fd)
+                    os.close(fd)
+                    del pending[fd]
+                    if buffered:
+                        # A torn packet from a dying worker: pass it on
+                        # for the consumer's parser to report.
+                        _write_all(stream, buffered)
+                    continue
+                buffered += data
+                end = v2.complete_packets(buffered)
+                if end:
+                    _write_all(stream, buffered[:end])
+                    del buffered[:end]
+        selector.close()
+
     def list(self, test, loader=None):
         "List the test."
-        result, errors = self._list(test)
+        stream = self._output_stream()
+        data = self.cached_list
+        if data is None and self.list_cache is not None:
+            data = _load_list_cache(self.list_cache, self.list_cache_key)
+        if data is not None:
+            _write_all(stream, data)
+            errors = []
+        else:
+            modules = set()
+            written = [] if self.list_cache is not None else None
+            errors = self._write_exists(
+                stream, test, modules=modules, written=written)
+            if written is not None and not errors:
+                _save_list_cache(self.list_cache, self.list_cache_key,
+                                 modules, b''.join(written))
+        result = v2.StreamResultToBytes(stream)
         if loader is not None:
             # We were called with the updated API by testtools.run, so look for
             # errors on the loader, not the test list result.
@@ -81,25 +415,126 @@ class SubunitTestRunner(object):
             sys.exit(2)
 
     def _list(self, test):
-        test_ids, errors = testtools_run.list_test(test)
+        stream = self._output_stream()
+        test_ids = []
+        errors = self._write_exists(stream, test, test_ids=test_ids)
+        return v2.StreamResultToBytes(stream), test_ids, errors
+
+    def _output_stream(self):
         try:
             fileno = self.stream.fileno()
         except Exception:
             fileno = None
         if fileno is not None:
-            stream = os.fdopen(fileno, 'wb', 0)
-        else:
-            stream = self.stream
-        result = v2.StreamResultToBytes(stream)
-        for test_id in test_ids:
-            result.status(test_id=test_id, test_status='exists')
-        return result, errors
+            return os.fdopen(fileno, 'wb', 0)
+        return pysubunit.make_stream_binary(self.stream)
+
+    def _write_exists(self, stream, test, test_ids=None, modules=None,
+                      written=None):
+        """Write an exists packet for each test in test, as it is walked.
+
+        Packets are encoded and written _LIST_BATCH tests at a time.
+
+        :param test_ids: If not None, a list to append the test ids to.
+        :param modules: If not None, a set to add the test modules to.
+        :param written: If not None, a list to append the bytes written to.
+        :return: The import errors found, as testtools.run.list_test would
+            return them.
+        """
+        errors = []
+        batch = []
+        for case in iterate_tests(test):
+            test_id = case.id()
+            for prefix in _import_failure_prefixes:
+                if test_id.startswith(prefix):
+                    errors.append(test_id[len(prefix):])
+                    break
+            else:
+                batch.append(test_id)
+                if modules is not None:
+                    modules.add(type(case).__module__)
+            if len(batch) == _LIST_BATCH:
+                self._write_batch(stream, batch, test_ids, written)
+                batch = []
+        if batch:
+            self._write_batch(stream, batch, test_ids, written)
+        return errors
+
+    def _write_batch(self, stream, batch, test_ids, written):
+        data = v2.encode_exists(batch)
+        _write_all(stream, data)
+        if test_ids is not None:
+            test_ids.extend(batch)
+        if written is not None:
+            written.append(data)
 
 
 class SubunitTestProgram(testtools_run.TestProgram):
 
     USAGE = testtools_run.USAGE_AS_MAIN
 
+    parallel = None
+    durations_from = None
+    list_cache = None
+
+    def _getParentArgParser(self):
+        parser = super(SubunitTestProgram, self)._getParentArgParser()
+        parser.add_argument(
+            '--parallel', dest='parallel', type=int, default=None,
+            metavar='N', help='Run the tests in N forked worker processes')
+        parser.add_argument(
+            '--durations-from', dest='durations_from', default=None,
+            metavar='FILE',
+            help='A subunit v2 stream from an earlier run, used to balance '
+            'the tests given to --parallel workers by their durations')
+        parser.add_argument(
+            '--list-cache', dest='list_cache', default=None, metavar='FILE',
+            help='Cache the output of --list in FILE, and reuse it without '
+            'loading the tests while the same arguments are given and the '
+            'test modules are unchanged. Delete FILE when tests come from '
+            'anything else, such as data files')
+        return parser
+
+    def parseArgs(self, argv):
+        # The arguments select the tests, so they are part of the list
+        # cache key.
+        self._cache_key = list(argv[1:])
+        self._cached_list = None
+        options, _ = _list_parser().parse_known_args(argv[1:])
+        if options.listtests and options.list_cache is not None:
+            self._cached_list = _load_list_cache(
+                options.list_cache, self._list_cache_key(options.load_list))
+            if self._cached_list is not None:
+                # Listing from the cache: skip discovering and importing
+                # the tests altogether.
+                self.listtests = True
+                self.list_cache = options.list_cache
+                self.load_list = None
+                self.test = unittest.TestSuite()
+                return
+        super(SubunitTestProgram, self).parseArgs(argv)
+
+    def _list_cache_key(self, load_list):
+        if not load_list:
+            return self._cache_key
+        try:
+            return self._cache_key + [_mtime(load_list)]
+        except OSError:
+            return None
+
+    def _get_runner(self):
+        runner = super(SubunitTestProgram, self)._get_runner()
+        if self.parallel is not None:
+            runner.parallel = self.parallel
+        if self.durations_from is not None:
+            with open(self.durations_from, 'rb') as stream:
+                runner.durations = read_durations(stream)
+        if self.list_cache is not None:
+            runner.list_cache = self.list_cache
+            runner.list_cache_key = self._list_cache_key(self.load_list)
+            runner.cached_list = self._cached_list
+        return runner
+
     def usageExit(self, msg=None):
         if msg:
             print(msg)
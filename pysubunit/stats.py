@@ -0,0 +1,346 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Statistics about the tests in a v2 stream.
+
+StreamResultStats works on the events of the stream as they arrive. A test
+is only tracked from its first event to its final status; after that, it
+is only counted. Durations go into a DurationSketch, which takes the same
+memory however many tests there are, and can be merged with the sketches of
+other runs.
+"""
+
+import collections
+import heapq
+import math
+
+import testtools
+
+# The statuses that make a run fail. Tests that were still running when the
+# run stopped are counted as 'inprogress', or 'unknown' if they never had a
+# status.
+FAILING = frozenset(['fail', 'inprogress', 'unknown'])
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class DurationSketch(object):
+    """A mergeable sketch of the distribution of some durations.
+
+    Durations are counted in buckets whose bounds grow geometrically, so
+    each quantile is reported to within relative_accuracy of a duration
+    that was added, using memory proportional to the logarithm of the
+    range of the durations rather than to their number. Past max_buckets,
+    the buckets of the shortest durations are folded together.
+
+    Sketches with the same relative_accuracy can be merged, for instance to
+    get the percentiles of the tests of many runs.
+    """
+
+    # Durations shorter than this, including negative ones from clocks that
+    # went backwards, are counted as zero.
+    min_duration = 1e-9
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(
+                'relative_accuracy must be between 0 and 1, not %r' % (
+                    relative_accuracy,))
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        # Bucket i counts the durations in (gamma ** (i - 1), gamma ** i].
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, duration, count=1):
+        """Add count durations of duration seconds."""
+        self.count += count
+        self.total += duration * count
+        if self.max is None or duration > self.max:
+            self.max = duration
+        if duration < self.min_duration:
+            self.zero_count += count
+            return
+        index = int(math.ceil(math.log(duration) / self._log_gamma))
+        self._add_bucket(index, count)
+
+    def _add_bucket(self, index, count):
+        buckets = self.buckets
+        if index in buckets:
+            buckets[index] += count
+            return
+        buckets[index] = count
+        if len(buckets) > self.max_buckets:
+            lowest, second = sorted(buckets)[:2]
+            buckets[second] += buckets.pop(lowest)
+
+    def merge(self, other):
+        """Add the durations counted by another DurationSketch.
+
+        :raises ValueError: If other has a different relative_accuracy.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(
+                'cannot merge sketches with relative accuracies %r and %r' % (
+                    self.relative_accuracy, other.relative_accuracy))
+        self.count += other.count
+        self.total += other.total
+        if other.max is not None and (
+                self.max is None or other.max > self.max):
+            self.max = other.max
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self._add_bucket(index, count)
+
+    def quantile(self, quantile):
+        """Return the duration at quantile, between 0 and 1, or None if no
+        durations were added.
+
+        This is the nearest rank, like percentiles of a sorted list, to
+        within relative_accuracy.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(quantile * self.count)))
+        seen = self.zero_count
+        if seen >= rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # The value within relative_accuracy of the whole bucket.
+                return min(
+                    2 * self._gamma ** index / (self._gamma + 1), self.max)
+        return self.max
+
+    def as_dict(self):
+        """Return the sketch as a dict that can be dumped as JSON."""
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'zero_count': self.zero_count,
+            'buckets': dict(
+                (str(index), count) for index, count in self.buckets.items()),
+            }
+
+    @classmethod
+    def from_dict(cls, data, max_buckets=2048):
+        """Make a DurationSketch from the result of as_dict()."""
+        sketch = cls(data['relative_accuracy'], max_buckets=max_buckets)
+        sketch.count = data['count']
+        sketch.total = data['total']
+        sketch.max = data['max']
+        sketch.zero_count = data['zero_count']
+        for index, count in data['buckets'].items():
+            sketch._add_bucket(int(index), count)
+        return sketch
+
+
+class StreamResultStats(testtools.StreamResult):
+    """A StreamResult which gathers statistics about the tests it sees.
+
+    The totals are those of pysubunit.TestResultStats: expected failures
+    and unexpected successes count as passed, and tests that did not finish
+    as failed. 'exists' events are counted in statuses but not as tests.
+
+    :ivar statuses: A Counter of final status to number of tests.
+    :ivar tags: A dict of tag to a Counter of final status to number of
+        tests with that tag.
+    :ivar durations: A DurationSketch of the durations in seconds of the
+        tests with a timestamp on their final status, measured from their
+        inprogress event, or if that had none their first timestamp.
+    :ivar slowest: The slowest tests, as a heap of (duration, test_id).
+    """
+
+    def __init__(self, stream, slowest=10):
+        """Create a StreamResultStats.
+
+        :param stream: The stream formatStats writes to.
+        :param slowest: The number of slowest tests to keep.
+        """
+        super(StreamResultStats, self).__init__()
+        self._stream = stream
+        self.slowest_count = slowest
+        self._reset()
+
+    def _reset(self):
+        self.statuses = collections.Counter()
+        self.tags = {}
+        self.durations = DurationSketch()
+        self.slowest = []
+        self.first_timestamp = None
+        self.last_timestamp = None
+        # Maps (test_id, route_code) to [first timestamp, tags, status] of
+        # the tests that have not finished.
+        self._running = {}
+
+    def startTestRun(self):
+        super(StreamResultStats, self).startTestRun()
+        self._reset()
+
+    def stopTestRun(self):
+        super(StreamResultStats, self).stopTestRun()
+        running, self._running = self._running, {}
+        for (test_id, _), (start, tags, status) in running.items():
+            self._finish(test_id, status, tags, start, None)
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        if timestamp is not None:
+            if self.first_timestamp is None:
+                self.first_timestamp = timestamp
+            self.last_timestamp = timestamp
+        if test_id is None:
+            return
+        if test_status == 'exists':
+            self.statuses['exists'] += 1
+            return
+        key = (test_id, route_code)
+        test = self._running.get(key)
+        if test is None:
+            test = self._running[key] = [timestamp, None, 'unknown']
+        elif test[0] is None:
+            test[0] = timestamp
+        if test_tags is not None:
+            test[1] = test_tags
+        if test_status is None:
+            return
+        if test_status == 'inprogress':
+            if timestamp is not None:
+                test[0] = timestamp
+            test[2] = test_status
+            return
+        del self._running[key]
+        self._finish(test_id, test_status, test[1], test[0], timestamp)
+
+    def _finish(self, test_id, status, tags, start, end):
+        self.statuses[status] += 1
+        for tag in tags or ():
+            counts = self.tags.get(tag)
+            if counts is None:
+                counts = self.tags[tag] = collections.Counter()
+            counts[status] += 1
+        if start is None or end is None:
+            return
+        duration = (end - start).total_seconds()
+        self.durations.add(duration)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (duration, test_id))
+        elif self.slowest and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, test_id))
+
+    @property
+    def total_tests(self):
+        return sum(self.statuses.values()) - self.statuses['exists']
+
+    @property
+    def failed_tests(self):
+        return sum(self.statuses[status] for status in FAILING)
+
+    @property
+    def skipped_tests(self):
+        return self.statuses['skip']
+
+    @property
+    def passed_tests(self):
+        return self.total_tests - self.failed_tests - self.skipped_tests
+
+    @property
+    def seen_tags(self):
+        return set(self.tags)
+
+    def wasSuccessful(self):
+        """Tells whether or not this result was a success"""
+        return self.failed_tests == 0
+
+    def percentiles(self):
+        """Return a dict of percentile to test duration, or {} if no test
+        had a duration."""
+        if not self.durations.count:
+            return {}
+        return dict(
+            (percentile, self.durations.quantile(percentile / 100.0))
+            for percentile in PERCENTILES)
+
+    def as_dict(self):
+        """Return the statistics as a dict that can be dumped as JSON."""
+        if self.first_timestamp is None:
+            elapsed = None
+        else:
+            elapsed = (
+                self.last_timestamp - self.first_timestamp).total_seconds()
+        return {
+            'total_tests': self.total_tests,
+            'passed_tests': self.passed_tests,
+            'failed_tests': self.failed_tests,
+            'skipped_tests': self.skipped_tests,
+            'statuses': dict(self.statuses),
+            'tags': dict(
+                (tag, dict(counts)) for tag, counts in self.tags.items()),
+            'elapsed': elapsed,
+            'durations': {
+                'count': self.durations.count,
+                'total': self.durations.total,
+                'percentiles': dict(
+                    (str(percentile), duration) for percentile, duration
+                    in self.percentiles().items()),
+                'sketch': self.durations.as_dict(),
+                },
+            'slowest': [
+                {'id': test_id, 'duration': duration}
+                for duration, test_id in sorted(self.slowest, reverse=True)],
+            }
+
+    def formatStats(self, verbose=False):
+        """Write the summary to the stream.
+
+        By default this is the summary TestResultStats writes. With verbose
+        the counts by status and tag, the test times and the slowest tests
+        follow it.
+        """
+        write = self._stream.write
+        write("Total tests:   %5d\n" % self.total_tests)
+        write("Passed tests:  %5d\n" % self.passed_tests)
+        write("Failed tests:  %5d\n" % self.failed_tests)
+        write("Skipped tests: %5d\n" % self.skipped_tests)
+        write("Seen tags: %s\n" % (", ".join(sorted(self.tags))))
+        if not verbose:
+            return
+        if self.statuses:
+            write("Statuses: %s\n" % _format_counts(self.statuses))
+        if self.tags:
+            write("Tags:\n")
+        for tag in sorted(self.tags):
+            write("  %s: %s\n" % (tag, _format_counts(self.tags[tag])))
+        if self.durations.count:
+            percentiles = self.percentiles()
+            write("Test time: %.3fs total, %s\n" % (
+                self.durations.total, ", ".join(
+                    "%d%% %.3fs" % (percentile, percentiles[percentile])
+                    for percentile in PERCENTILES)))
+        if self.slowest:
+            write("Slowest tests:\n")
+            for duration, test_id in sorted(self.slowest, reverse=True):
+                write("  %8.3fs %s\n" % (duration, test_id))
+
+
+def _format_counts(counts):
+    return ", ".join(
+        "%s %d" % (status, count) for status, count in sorted(counts.items()))
@@ -15,8 +15,11 @@
 
 """TestResult helper classes used to by pysubunit."""
 
+import collections
 import csv
 import datetime
+import tempfile
+import timeit
 
 import testtools
 import testtools.compat
@@ -24,6 +27,7 @@ import testtools.content
 
 import iso8601
 import pysubunit
+from pysubunit import stats
 
 
 # NOT a TestResult, because we are implementing the interface, not inheriting
@@ -331,11 +335,12 @@ def make_tag_filter(with_tags, without_tags):
 
 class _PredicateFilter(TestResultDecorator, TagsMixin):
 
-    def __init__(self, result, predicate):
+    def __init__(self, result, predicate, profiler=None):
         super(_PredicateFilter, self).__init__(result)
         self._clear_tags()
-        self.decorated = TimeCollapsingDecorator(
-            TagCollapsingDecorator(self.decorated))
+        self.decorated = _profiled(profiler, TimeCollapsingDecorator(
+            _profiled(profiler, TagCollapsingDecorator(
+                _profiled(profiler, self.decorated)))))
         self._predicate = predicate
         # The current test (for filtering tags)
         self._current_test = None
@@ -432,6 +437,16 @@ class _PredicateFilter(TestResultDecorator, TagsMixin):
         return id
 
 
+def _compat_predicate(filter_predicate):
+    def compat(test, outcome, error, details, tags):
+        # 0.0.7 and earlier did not support the 'tags' parameter.
+        try:
+            return filter_predicate(test, outcome, error, details, tags)
+        except TypeError:
+            return filter_predicate(test, outcome, error, details)
+    return compat
+
+
 class TestResultFilter(TestResultDecorator):
     """A pyunit TestResult interface implementation which filters tests.
 
@@ -446,7 +461,8 @@ class TestResultFilter(TestResultDecorator):
 
     def __init__(self, result, filter_error=False, filter_failure=False,
                  filter_success=True, filter_skip=False, filter_xfail=False,
-                 filter_predicate=None, fixup_expected_failures=None):
+                 filter_predicate=None, fixup_expected_failures=None,
+                 profiler=None):
         """Create a FilterResult object filtering to result.
 
         :param filter_error: Filter out errors.
@@ -463,6 +479,8 @@ class TestResultFilter(TestResultDecorator):
             parameter for efficiency.
         :param fixup_expected_failures: Set of test ids to consider known
             failing.
+        :param profiler: If not None, a ResultProfiler used to profile the
+            decorators this filter builds internally.
         """
         predicates = []
         if filter_error:
@@ -481,17 +499,10 @@ class TestResultFilter(TestResultDecorator):
             predicates.append(
                 lambda t, outcome, e, d, tags: outcome != 'expectedfailure')
         if filter_predicate is not None:
-            def compat(test, outcome, error, details, tags):
-                # 0.0.7 and earlier did not support the 'tags' parameter.
-                try:
-                    return filter_predicate(
-                        test, outcome, error, details, tags)
-                except TypeError:
-                    return filter_predicate(test, outcome, error, details)
-            predicates.append(compat)
+            predicates.append(_compat_predicate(filter_predicate))
         predicate = and_predicates(predicates)
-        super(TestResultFilter, self).__init__(
-            _PredicateFilter(result, predicate))
+        super(TestResultFilter, self).__init__(_profiled(
+            profiler, _PredicateFilter(result, predicate, profiler=profiler)))
         if fixup_expected_failures is None:
             self._fixup_expected_failures = frozenset()
         else:
@@ -521,6 +532,354 @@ class TestResultFilter(TestResultDecorator):
         return (test.id() in self._fixup_expected_failures)
 
 
+class _Spilled(object):
+    """Bytes a StreamResultFilter has written to its spill file."""
+
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+    def read(self, spill_file):
+        spill_file.seek(self.offset)
+        return spill_file.read(self.length)
+
+
+class StreamResultFilter(testtools.StreamResult):
+    """A StreamResult which filters tests.
+
+    This makes the same decisions as TestResultFilter does when it is
+    wrapped in StreamToExtendedDecorator and ExtendedToStreamDecorator, but
+    without turning each test into a test object and back: the events of a
+    test are buffered until its final status, and then either forwarded to
+    the result as they came in or dropped. Events outside of a test are
+    forwarded as they arrive.
+
+    Only the final status of a test whose outcome is fixed up is changed.
+    If the events carry packet_bytes (see v2.ByteStreamToStreamResult), that
+    event's packet_bytes is set to None so that it is encoded afresh.
+
+    With a spill_threshold, the attachments of unfinished tests are kept in
+    memory up to that many bytes in all, and written to a temporary file
+    past it. They are only read back for tests that may be kept.
+    """
+
+    # The outcome filter_predicate is called with for each final status;
+    # unexpected successes are never filtered.
+    outcomes = {
+        'success': 'success',
+        'fail': 'failure',
+        'skip': 'skip',
+        'xfail': 'expectedfailure',
+        'uxsuccess': None,
+        }
+
+    fixups = {'fail': 'xfail', 'success': 'uxsuccess'}
+
+    def __init__(self, result, filter_error=False, filter_failure=False,
+                 filter_success=True, filter_skip=False, filter_xfail=False,
+                 filter_predicate=None, fixup_expected_failures=None,
+                 passthrough=True, id_predicate=None, spill_threshold=None):
+        """Create a StreamResultFilter filtering to result.
+
+        The other parameters are those of TestResultFilter. filter_predicate
+        is only called for tests the other parameters keep, and is passed a
+        testtools.PlaceHolder for the test.
+
+        :param passthrough: If False, events outside of a test are dropped.
+        :param id_predicate: A callable taking a test id and returning True
+            if the test may be passed through. It is called on the first
+            event of a test; the events of tests it rejects are dropped as
+            they arrive rather than buffered.
+        :param spill_threshold: If not None, the number of bytes of
+            attachments to hold in memory before spilling them to disk.
+        """
+        super(StreamResultFilter, self).__init__()
+        self.result = result
+        filtered = set()
+        for outcome, flag in [
+                ('error', filter_error), ('failure', filter_failure),
+                ('success', filter_success), ('skip', filter_skip),
+                ('expectedfailure', filter_xfail)]:
+            if flag:
+                filtered.add(outcome)
+        self._filtered = frozenset(filtered)
+        if filter_predicate is not None:
+            filter_predicate = _compat_predicate(filter_predicate)
+        self._predicate = filter_predicate
+        self._fixup_expected_failures = frozenset(
+            fixup_expected_failures or ())
+        self.passthrough = passthrough
+        self._id_predicate = id_predicate
+        # Maps (test_id, route_code) to the events of the test so far, or to
+        # None if id_predicate rejected the test.
+        self._tests = {}
+        self.spill_threshold = spill_threshold
+        # The attachment bytes held in memory, and the number of events
+        # whose attachments are in the spill file.
+        self._held_bytes = 0
+        self._spilled_events = 0
+        self._spill_file = None
+
+    def startTestRun(self):
+        self._tests = {}
+        self.result.startTestRun()
+
+    def stopTestRun(self):
+        # Tests that never finished are reported as failures, most recently
+        # started first, as StreamToExtendedDecorator does.
+        tests, self._tests = self._tests, {}
+        for events in reversed(list(tests.values())):
+            if events is not None:
+                self._finish(events, None)
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        self.result.stopTestRun()
+
+    def status(self, **kwargs):
+        test_id = kwargs.get('test_id')
+        if test_id is None:
+            if self.passthrough:
+                self.result.status(**kwargs)
+            return
+        test_status = kwargs.get('test_status')
+        if test_status == 'exists':
+            return
+        key = (test_id, kwargs.get('route_code'))
+        final = test_status not in (None, 'inprogress')
+        try:
+            events = self._tests[key]
+        except KeyError:
+            if (self._id_predicate is not None and
+                    not self._id_predicate(test_id)):
+                if not final:
+                    self._tests[key] = None
+                return
+            events = self._tests[key] = []
+        if events is None:
+            if final:
+                del self._tests[key]
+            return
+        if self.spill_threshold is not None and kwargs.get('file_bytes'):
+            self._hold(kwargs)
+        events.append(kwargs)
+        if final:
+            del self._tests[key]
+            self._finish(events, test_status)
+
+    def _hold(self, event):
+        """Account for the attachment of event, spilling it if need be."""
+        data = [event['file_bytes'], event.get('packet_bytes') or b'']
+        size = len(data[0]) + len(data[1])
+        if self._held_bytes + size <= self.spill_threshold:
+            self._held_bytes += size
+            return
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile()
+        spill_file = self._spill_file
+        spill_file.seek(0, 2)
+        for name, value in zip(['file_bytes', 'packet_bytes'], data):
+            if value:
+                event[name] = _Spilled(spill_file.tell(), len(value))
+                spill_file.write(value)
+        self._spilled_events += 1
+
+    def _release(self, events, load):
+        """Stop accounting for the attachments of a finished test.
+
+        :param load: If True, read spilled attachments back into events.
+        """
+        for event in events:
+            file_bytes = event.get('file_bytes')
+            if not file_bytes:
+                continue
+            if not isinstance(file_bytes, _Spilled):
+                self._held_bytes -= len(file_bytes) + len(
+                    event.get('packet_bytes') or b'')
+                continue
+            self._spilled_events -= 1
+            if load:
+                for name in ('file_bytes', 'packet_bytes'):
+                    if isinstance(event.get(name), _Spilled):
+                        event[name] = event[name].read(self._spill_file)
+        if not self._spilled_events and self._spill_file is not None:
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+
+    def _finish(self, events, test_status):
+        """Forward a test's events if it is kept.
+
+        :param test_status: The final status of the test, or None if it
+            did not finish.
+        """
+        test_id = events[0]['test_id']
+        status = test_status or 'fail'
+        if test_id in self._fixup_expected_failures:
+            status = self.fixups.get(status, status)
+        outcome = self.outcomes[status]
+        if self.spill_threshold is not None:
+            self._release(events, outcome not in self._filtered)
+        if outcome is not None:
+            if outcome in self._filtered:
+                return
+            if (self._predicate is not None and
+                    not self._call_predicate(events, outcome)):
+                return
+        if status != test_status:
+            if test_status is None:
+                event = {'test_id': test_id,
+                         'route_code': events[0].get('route_code')}
+                for previous in events:
+                    if previous.get('test_tags') is not None:
+                        event['test_tags'] = previous['test_tags']
+            else:
+                event = dict(events.pop())
+                if 'packet_bytes' in event:
+                    event['packet_bytes'] = None
+            event['test_status'] = status
+            events.append(event)
+        for event in events:
+            self.result.status(**event)
+
+    def _call_predicate(self, events, outcome):
+        tests = []
+        record = testtools.StreamToDict(tests.append)
+        record.startTestRun()
+        for event in events:
+            event = dict(event)
+            event.pop('packet_bytes', None)
+            record.status(**event)
+        record.stopTestRun()
+        test = tests[0]
+        return self._predicate(
+            testtools.PlaceHolder(
+                test['id'], details=test['details'], tags=test['tags']),
+            outcome, None, test['details'], test['tags'])
+
+
+class ResultProfiler(object):
+    """Collect call counts and timings from a chain of result decorators.
+
+    Each layer of interest is wrapped with ``wrap`` where it is handed to
+    the layer above it. Every method call through a wrapped layer is
+    counted and timed: cumulative time includes the layers below, own time
+    excludes any time spent in other wrapped layers it called.
+
+    :ivar layers: The names of the wrapped layers, in the order they were
+        wrapped.
+    :ivar calls: A dict mapping (layer, method) to a list of
+        [calls, cumulative time, own time].
+    """
+
+    def __init__(self, timer=None):
+        """Create a ResultProfiler.
+
+        :param timer: A callable returning the current time in seconds.
+            Defaults to timeit.default_timer.
+        """
+        self.timer = timer or timeit.default_timer
+        self.layers = []
+        self.calls = {}
+        # Time spent in wrapped callees, one entry per active call.
+        self._stack = []
+
+    def wrap(self, result, name=None):
+        """Return a ProfilingResultDecorator recording calls to result.
+
+        :param name: The name to report the layer as. Defaults to the class
+            name of result; repeated names are numbered to keep them apart.
+        """
+        if name is None:
+            name = result.__class__.__name__
+        unique_name = name
+        count = 1
+        while unique_name in self.layers:
+            count += 1
+            unique_name = '%s#%d' % (name, count)
+        self.layers.append(unique_name)
+        return ProfilingResultDecorator(result, self, unique_name)
+
+    def _call(self, layer, method, function, args, kwargs):
+        stack = self._stack
+        stack.append(0.0)
+        start = self.timer()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = self.timer() - start
+            callees = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            stats = self.calls.get((layer, method))
+            if stats is None:
+                stats = self.calls[(layer, method)] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += elapsed - callees
+
+    def report(self, stream):
+        """Write a per layer breakdown of the collected data to stream.
+
+        Layers are ordered by the total own time spent in them, most
+        expensive first.
+        """
+        own_times = dict((layer, 0.0) for layer in self.layers)
+        for (layer, method), (calls, cumulative, own) in self.calls.items():
+            own_times[layer] += own
+        total = sum(own_times.values()) or 1.0
+        row = '  %-24s %10s %12s %12s\n'
+        for layer in sorted(self.layers, key=lambda name: -own_times[name]):
+            stream.write('%s: %.6fs own (%.1f%%)\n' % (
+                layer, own_times[layer], 100 * own_times[layer] / total))
+            methods = sorted(
+                (key[1], stats) for key, stats in self.calls.items()
+                if key[0] == layer)
+            if not methods:
+                continue
+            stream.write(row % ('method', 'calls', 'cumulative', 'own'))
+            for method, (calls, cumulative, own) in methods:
+                stream.write(row % (
+                    method, calls, '%.6f' % cumulative, '%.6f' % own))
+
+
+class ProfilingResultDecorator(object):
+    """Forward everything to a result, timing method calls.
+
+    Created by ResultProfiler.wrap. Attribute reads and writes are passed
+    through to the decorated result; callables are wrapped (once per
+    name) so that calling them is recorded by the profiler.
+    """
+
+    def __init__(self, decorated, profiler, name):
+        object.__setattr__(self, 'decorated', decorated)
+        object.__setattr__(self, '_profiler', profiler)
+        object.__setattr__(self, '_name', name)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.decorated, name)
+        if name.startswith('__') or not callable(attribute):
+            return attribute
+        profiler = self._profiler
+        layer = self._name
+
+        def method(*args, **kwargs):
+            return profiler._call(layer, name, attribute, args, kwargs)
+        object.__setattr__(self, name, method)
+        return method
+
+    def __setattr__(self, name, value):
+        setattr(self.decorated, name, value)
+
+
+def _profiled(profiler, result):
+    """Wrap result with profiler, if there is one."""
+    if profiler is None:
+        return result
+    return profiler.wrap(result)
+
+
 class TestIdPrintingResult(testtools.TestResult):
     """Print test ids to a stream.
 
@@ -616,6 +975,127 @@ class TestIdPrintingResult(testtools.TestResult):
             self._end_test(test_id)
 
 
+class StreamIdPrintingResult(testtools.StreamResult):
+    """Print the ids of the tests in a stream, in constant memory.
+
+    Only the tests that have not finished are tracked, and only the number
+    of tests with each final status is kept, so listing a stream takes
+    memory in proportion to the tests running at once rather than to the
+    tests in it. Lines are gathered and written buffer_size bytes at a
+    time; with passthrough, attachments outside of a test go through the
+    same buffer, so they stay in order with the ids.
+
+    The ids and times written are those of TestIdPrintingResult: a test is
+    listed when it finishes, or at the end of the run if it does not, and
+    is timed from its last interim event. Where
+    TestIdPrintingResult fails for want of a start time, 0.000 is written.
+
+    wasSuccessful() agrees with testtools.StreamSummary: the run failed if
+    a test failed or did not finish.
+    """
+
+    def __init__(self, stream, show_times=False, show_exists=False,
+                 passthrough=False, buffer_size=65536):
+        """Create a StreamIdPrintingResult writing to stream.
+
+        :param stream: The stream to write to; text streams are unwrapped.
+        :param show_times: Write the duration of each test after its id.
+        :param show_exists: Write the ids of 'exists' tests too.
+        :param passthrough: Write the attachments outside of a test, such
+            as non-subunit input, to the stream.
+        :param buffer_size: Write to stream once this many bytes are
+            pending.
+        """
+        super(StreamIdPrintingResult, self).__init__()
+        self._stream = pysubunit.make_stream_binary(stream)
+        self.show_times = show_times
+        self.show_exists = show_exists
+        self.passthrough = passthrough
+        self.buffer_size = buffer_size
+        self._reset()
+
+    def _reset(self):
+        self.statuses = collections.Counter()
+        self._time = None
+        # Maps (test_id, route_code) to the status of the tests that have
+        # not finished.
+        self._running = {}
+        # Maps test_id to the time of its last interim event.
+        self._starts = {}
+        self._pending = []
+        self._pending_size = 0
+
+    def startTestRun(self):
+        super(StreamIdPrintingResult, self).startTestRun()
+        self._reset()
+
+    def stopTestRun(self):
+        super(StreamIdPrintingResult, self).stopTestRun()
+        self.statuses.update(self._running.values())
+        self._running = {}
+        starts, self._starts = self._starts, {}
+        for test_id, start in starts.items():
+            self._report(test_id, start)
+        self.flush()
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        if test_id is None:
+            if self.passthrough and file_name is not None:
+                self._write(file_bytes)
+            return
+        if timestamp is not None:
+            self._time = timestamp
+        key = (test_id, route_code)
+        if test_status in (None, 'inprogress'):
+            self._starts[test_id] = self._time
+            if test_status is not None or key not in self._running:
+                self._running[key] = test_status or 'unknown'
+            return
+        self._running.pop(key, None)
+        self.statuses[test_status] += 1
+        if test_status == 'exists':
+            if self.show_exists:
+                self._report(test_id, None)
+        else:
+            self._report(test_id, self._starts.pop(test_id, None))
+
+    def _report(self, test_id, start):
+        if not self.show_times:
+            line = test_id + u'\n'
+        else:
+            if start is None or self._time is None:
+                seconds = 0
+            else:
+                seconds = (self._time - start).total_seconds()
+            line = u'%s %0.3f\n' % (test_id, seconds)
+        self._write(line.encode('utf-8'))
+
+    def _write(self, data):
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the pending output to the stream."""
+        if not self._pending:
+            return
+        self._stream.write(b''.join(self._pending))
+        self._stream.flush()
+        self._pending = []
+        self._pending_size = 0
+
+    @property
+    def failed_tests(self):
+        return sum(self.statuses[status] for status in stats.FAILING)
+
+    def wasSuccessful(self):
+        """Tells whether or not this result was a success"""
+        return self.failed_tests == 0
+
+
 class TestByTestResult(testtools.TestResult):
     """Call something every time a test completes."""
 
@@ -710,6 +1190,49 @@ class CsvResult(TestByTestResult):
         self._write_row(['test', 'status', 'start_time', 'stop_time'])
 
 
+class _InFlight(testtools.StreamResult):
+    """Track the test each route is part way through."""
+
+    def __init__(self):
+        super(_InFlight, self).__init__()
+        self.tests = {}
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        if test_id is None:
+            return
+        if test_status == 'inprogress':
+            self.tests[route_code] = test_id
+        elif test_status not in (None, 'exists'):
+            self.tests.pop(route_code, None)
+
+
+class _LostTests(TestResultDecorator):
+    """Report the tests lost with the process running them as errors.
+
+    StreamToExtendedDecorator can only report a test that did not finish as
+    a failure. The tests passed to lose() are reported as errors instead,
+    with the reason given as their traceback.
+    """
+
+    def __init__(self, decorated):
+        super(_LostTests, self).__init__(decorated)
+        self._lost = {}
+
+    def lose(self, test_id, reason):
+        self._lost[test_id] = reason
+
+    def addFailure(self, test, err=None, details=None):
+        reason = self._lost.pop(test.id(), None)
+        if reason is None:
+            return super(_LostTests, self).addFailure(
+                test, err, details=details)
+        details = dict(details or {})
+        details['traceback'] = testtools.content.text_content(reason)
+        return self.decorated.addError(test, details=details)
+
+
 class CatFiles(testtools.StreamResult):
     """Cat file attachments received to a stream."""
 
@@ -14,6 +14,8 @@
 # under the License.
 
 import io
+import os
+import tempfile
 import unittest
 
 from testtools import compat
@@ -132,10 +134,39 @@ class TestDecode(unittest.TestCase):
         self.assertRaises(ValueError,
                           self.decoder.write, compat._b('a\r\r\n'))
 
+    def test_decode_strict_non_hex_header(self):
+        self.assertRaises(ValueError,
+                          self.decoder.write, compat._b('1x\r\nabc'))
+
     def test_decode_short_header(self):
         self.assertRaises(ValueError,
                           self.decoder.write, compat._b('\n'))
 
+    def test_decode_header_split_across_writes(self):
+        self.assertEqual(None, self.decoder.write(compat._b('1')))
+        self.assertEqual(None, self.decoder.write(compat._b('0\r')))
+        self.assertEqual(None, self.decoder.write(compat._b('\n' + 'a' * 15)))
+        self.assertEqual(compat._b('x'),
+                         self.decoder.write(compat._b('b0\r\nx')))
+        self.assertEqual(compat._b('a' * 15 + 'b'), self.output.getvalue())
+
+    def test_decode_many_chunks_in_one_write(self):
+        self.assertEqual(compat._b(''), self.decoder.write(
+            compat._b('1\r\na' * 5000 + '0\r\n')))
+        self.assertEqual(compat._b('a' * 5000), self.output.getvalue())
+
+    def test_decode_reused_input_buffer(self):
+        buffer = bytearray(compat._b('3\r\nab'))
+        self.assertEqual(None, self.decoder.write(buffer))
+        buffer[:] = compat._b('c0\r\n')
+        self.assertEqual(compat._b(''), self.decoder.write(buffer))
+        self.assertEqual(compat._b('abc'), self.output.getvalue())
+
+    def test_decode_not_a_header_waits_nonstrict(self):
+        self.decoder = pysubunit.chunked.Decoder(self.output, strict=False)
+        self.assertEqual(None, self.decoder.write(compat._b('zz\r\n')))
+        self.assertRaises(ValueError, self.decoder.close)
+
 
 class TestEncode(unittest.TestCase):
 
@@ -179,3 +210,77 @@ class TestEncode(unittest.TestCase):
         self.assertEqual(
             compat._b('10000\r\n' + '1' * 65536 + '10000\r\n' +
                       '2' * 65536 + '0\r\n'), self.output.getvalue())
+
+    def test_encode_megabyte_write(self):
+        # Longer than any chunk the encoder buffers itself.
+        self.encoder.write(compat._b('ab'))
+        self.encoder.write(compat._b('x' * 0x100000))
+        self.encoder.close()
+        self.assertEqual(
+            compat._b('100002\r\nab' + 'x' * 0x100000 + '0\r\n'),
+            self.output.getvalue())
+        decoded = io.BytesIO()
+        decoder = pysubunit.chunked.Decoder(decoded)
+        self.assertEqual(compat._b(''), decoder.write(self.output.getvalue()))
+        self.assertEqual(0x100002, len(decoded.getvalue()))
+
+    def test_encode_one_write_per_chunk(self):
+        writes = []
+
+        class Output(object):
+            def write(self, data):
+                writes.append(bytes(data))
+        encoder = pysubunit.chunked.Encoder(Output())
+        encoder.write(compat._b('abc'))
+        encoder.write(bytearray(compat._b('def')))
+        encoder.close()
+        self.assertEqual([compat._b('6\r\nabcdef0\r\n')], writes)
+
+    def test_encode_buffer_size(self):
+        self.encoder = pysubunit.chunked.Encoder(self.output, buffer_size=4)
+        self.encoder.write(compat._b('ab'))
+        self.encoder.write(compat._b('cd'))
+        self.encoder.write(compat._b('e'))
+        self.encoder.close()
+        self.assertEqual(compat._b('4\r\nabcd1\r\ne0\r\n'),
+                         self.output.getvalue())
+
+    def test_encode_reused_after_flush(self):
+        self.encoder = pysubunit.chunked.Encoder(self.output, buffer_size=4)
+        for data in ('abc', 'def', 'g'):
+            self.encoder.write(compat._b(data))
+        self.encoder.close()
+        self.assertEqual(compat._b('6\r\nabcdef1\r\ng0\r\n'),
+                         self.output.getvalue())
+
+
+class TestEncodeToFileIO(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        self.output = io.FileIO(handle, 'w+')
+        self.addCleanup(self.output.close)
+
+    def written(self):
+        self.output.seek(0)
+        return self.output.read()
+
+    def test_encode_writev(self):
+        encoder = pysubunit.chunked.Encoder(self.output)
+        encoder.write(compat._b('abc'))
+        encoder.write(bytearray(compat._b('def')))
+        encoder.write(compat._b('1' * 65536))
+        encoder.close()
+        self.assertEqual(
+            compat._b('10006\r\nabcdef' + '1' * 65536 + '0\r\n'),
+            self.written())
+
+    def test_encode_many_small_writes(self):
+        encoder = pysubunit.chunked.Encoder(self.output, buffer_size=4096)
+        for i in range(2000):
+            encoder.write(compat._b('a'))
+        encoder.close()
+        self.assertEqual(compat._b('7D0\r\n' + 'a' * 2000 + '0\r\n'),
+                         self.written())
@@ -100,3 +100,61 @@ class TestMultipartDetails(base.TestCase):
         self.assertEqual(
             compat._b('').join(expected['something'].iter_bytes()),
             compat._b('').join(found['something'].iter_bytes()))
+
+
+class TestSpool(base.TestCase):
+
+    def test_in_memory(self):
+        spool = pysubunit.details._Spool(threshold=10)
+        spool.write(compat._b("foo"))
+        spool.write(bytearray(compat._b("bar")))
+        self.assertEqual(None, spool._file)
+        self.assertEqual(compat._b("foobar"), spool.getvalue())
+        self.assertEqual(
+            [compat._b("foo"), compat._b("bar")], list(spool.iter_bytes()))
+
+    def test_spills_past_threshold(self):
+        spool = pysubunit.details._Spool(threshold=4)
+        spool.write(compat._b("foo"))
+        spool.write(compat._b("bar"))
+        self.addCleanup(spool.close)
+        spool.write(compat._b("baz"))
+        self.assertEqual(compat._b("foobarbaz"), spool.getvalue())
+        # Reading back can be repeated.
+        self.assertEqual(compat._b("foobarbaz"), spool.getvalue())
+
+    def test_iterators_are_independent(self):
+        spool = pysubunit.details._Spool(threshold=4)
+        self.addCleanup(spool.close)
+        spool.write(compat._b("x") * 100000)
+        abandoned = spool.iter_bytes()
+        next(abandoned)
+        self.assertEqual(compat._b("x") * 100000, spool.getvalue())
+        self.assertEqual(100000 - 65536, len(next(abandoned)))
+
+    def test_close(self):
+        spool = pysubunit.details._Spool(threshold=4)
+        spool.write(compat._b("foobar"))
+        spool_file = spool._file
+        spool.close()
+        self.assertTrue(spool_file.closed)
+        del spool
+        spool = pysubunit.details._Spool(threshold=4)
+        spool.write(compat._b("foobar"))
+        spool_file = spool._file
+        del spool
+        self.assertTrue(spool_file.closed)
+
+    def test_large_multipart_body(self):
+        self.patch(pysubunit.details, 'SPOOL_THRESHOLD', 4)
+        parser = pysubunit.details.MultipartDetailsParser(None)
+        parser.lineReceived(compat._b("Content-Type: text/plain\n"))
+        parser.lineReceived(compat._b("log\n"))
+        for i in range(3):
+            parser.lineReceived(compat._b("5\r\n"))
+            parser.lineReceived(compat._b("line\n"))
+        parser.lineReceived(compat._b("0\r\n"))
+        self.addCleanup(parser._body.close)
+        self.assertEqual(
+            compat._b("line\n" * 3),
+            parser.get_details()['log'].as_text().encode('utf8'))
@@ -0,0 +1,90 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for pysubunit.idlist."""
+
+import io
+import os
+import random
+
+import fixtures
+
+from pysubunit import idlist
+from pysubunit.tests import base
+
+
+class TestIdList(base.TestCase):
+
+    def test_ids(self):
+        id_list = idlist.IdList(['a.b', 'a.c'])
+        self.assertIn('a.b', id_list)
+        self.assertNotIn('a.bc', id_list)
+        self.assertNotIn('a', id_list)
+
+    def test_prefixes(self):
+        id_list = idlist.IdList(['a.b.*', 'a.bc*', 'x*'])
+        self.assertIn('a.b.c', id_list)
+        self.assertIn('a.b.', id_list)
+        self.assertIn('a.bcd', id_list)
+        self.assertIn('x', id_list)
+        self.assertNotIn('a.b', id_list)
+        self.assertNotIn('a.c', id_list)
+
+    def test_substrings(self):
+        id_list = idlist.IdList(['*she*', '*hers*', '*Slow*'])
+        self.assertIn('ushers', id_list)
+        self.assertIn('a.TestSlow.test_b', id_list)
+        self.assertNotIn('hes', id_list)
+        self.assertNotIn('a.TestSlo.test_w', id_list)
+
+    def test_everything(self):
+        self.assertIn('a', idlist.IdList(['*']))
+        self.assertIn('a', idlist.IdList(['**']))
+        self.assertNotIn('a', idlist.IdList([]))
+
+    def test_substrings_match_as_find_does(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            patterns = [''.join(rng.choice('abc') for _ in range(
+                rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+            id_list = idlist.IdList('*%s*' % p for p in patterns)
+            for _ in range(20):
+                text = ''.join(
+                    rng.choice('abcd') for _ in range(rng.randint(0, 12)))
+                self.assertEqual(
+                    any(p in text for p in patterns), text in id_list,
+                    (patterns, text))
+
+    def test_unsupported_patterns(self):
+        for pattern in ['a*b', '*a', '*a*b*', 'a**']:
+            self.assertRaises(ValueError, idlist.IdList, [pattern])
+
+    def write_list(self, content):
+        path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'ids')
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_read(self):
+        id_list = idlist.IdList()
+        id_list.read(self.write_list(
+            u'# slow tests\n\na.b\n  c.*  \n*\u2603*\n'))
+        self.assertIn('a.b', id_list)
+        self.assertIn('c.d', id_list)
+        self.assertIn(u'x\u2603', id_list)
+        self.assertNotIn('# slow tests', id_list)
+
+    def test_read_unsupported_pattern(self):
+        path = self.write_list(u'a\n*b\n')
+        e = self.assertRaises(ValueError, idlist.IdList().read, path)
+        self.assertEqual("%s:2: unsupported pattern '*b'" % path, str(e))
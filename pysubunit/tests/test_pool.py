@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import io
+import os
+import unittest
+
+import fixtures
+import testtools
+
+import pysubunit
+from pysubunit import pool
+from pysubunit.tests import base
+
+
+@testtools.skipIf(os.name != "posix", "Need a posix system for forking tests")
+class TestIsolatedWorkerPool(base.TestCase):
+
+    class Sample(unittest.TestCase):
+
+        PIDS = None
+        STATE = False
+
+        def _record(self):
+            Sample = TestIsolatedWorkerPool.Sample
+            with open(Sample.PIDS, 'a') as pids:
+                pids.write('%d\n' % os.getpid())
+            Sample.STATE = True
+
+        def test_pass(self):
+            self._record()
+
+        def test_fail(self):
+            self._record()
+            self.fail('failed in a worker')
+
+        def test_crash(self):
+            os._exit(3)
+
+        def test_torn_crash(self):
+            os.write(1, b'\xb3\x29')
+            os._exit(3)
+
+        def test_lose_commands(self):
+            # The worker passes, then dies reading its next command.
+            self._record()
+            os.close(TestIsolatedWorkerPool.Sample.COMMANDS)
+
+    class IsolatedSample(pysubunit.IsolatedTestCase, Sample):
+        pass
+
+    def setUp(self):
+        super(TestIsolatedWorkerPool, self).setUp()
+        path = self.useFixture(fixtures.TempDir()).path
+        self.patch(self.Sample, 'PIDS', os.path.join(path, 'pids'))
+
+    def pids(self):
+        with open(self.Sample.PIDS) as pids:
+            return [int(pid) for pid in pids]
+
+    def test_runs_units_in_workers(self):
+        result = unittest.TestResult()
+        suite = unittest.TestSuite([
+            self.Sample('test_pass'), self.Sample('test_fail'),
+            self.Sample('test_pass')])
+        pool.IsolatedWorkerPool(size=2).run(suite, result)
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual(1, len(result.failures))
+        self.assertIn('failed in a worker', result.failures[0][1])
+        self.assertFalse(self.Sample.STATE)
+        pids = self.pids()
+        self.assertEqual(3, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(2, len(set(pids)))
+
+    def test_workers_are_recycled(self):
+        result = unittest.TestResult()
+        suite = unittest.TestSuite(
+            [self.Sample('test_pass') for _ in range(5)])
+        pool.IsolatedWorkerPool(size=1, max_tests=2).run(suite, result)
+        self.assertEqual(5, result.testsRun)
+        self.assertEqual(3, len(set(self.pids())))
+
+    def test_crash_reported_for_test_in_flight(self):
+        result = unittest.TestResult()
+        suite = unittest.TestSuite([
+            self.Sample('test_pass'), self.Sample('test_crash'),
+            self.Sample('test_pass')])
+        pool.IsolatedWorkerPool(size=1).run(suite, result)
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual([], result.failures)
+        self.assertEqual(1, len(result.errors))
+        test, error = result.errors[0]
+        self.assertEqual(self.Sample('test_crash').id(), test.id())
+        self.assertIn('died with status', error)
+        self.assertEqual(2, len(set(self.pids())))
+
+    def test_torn_output_passed_on(self):
+        stdout = io.TextIOWrapper(io.BytesIO())
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        result = unittest.TestResult()
+        pool.IsolatedWorkerPool(size=1).run(
+            self.Sample('test_torn_crash'), result)
+        self.assertEqual(1, len(result.errors))
+        self.assertEqual(b'\xb3\x29', stdout.buffer.getvalue())
+
+    def test_worker_dying_between_units_is_replaced(self):
+        serve = pool.IsolatedWorkerPool._serve
+
+        def record_commands(self, units, command_fd, *args):
+            TestIsolatedWorkerPool.Sample.COMMANDS = command_fd
+            serve(self, units, command_fd, *args)
+        self.patch(pool.IsolatedWorkerPool, '_serve', record_commands)
+        result = unittest.TestResult()
+        suite = unittest.TestSuite([
+            self.Sample('test_lose_commands'), self.Sample('test_pass')])
+        pool.IsolatedWorkerPool(size=1).run(suite, result)
+        self.assertEqual(2, result.testsRun)
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(2, len(set(self.pids())))
+
+    def test_units_reported_when_no_worker_starts(self):
+        def fork():
+            raise OSError(11, 'Resource temporarily unavailable')
+        self.useFixture(fixtures.MonkeyPatch('os.fork', fork))
+        result = unittest.TestResult()
+        suite = unittest.TestSuite([
+            self.Sample('test_pass'),
+            pysubunit.IsolatedTestSuite([
+                self.Sample('test_pass'), self.Sample('test_fail')])])
+        pool.IsolatedWorkerPool(size=2).run(suite, result)
+        self.assertEqual(3, result.testsRun)
+        self.assertEqual(3, len(result.errors))
+        self.assertIn('could not start a worker process',
+                      result.errors[0][1])
+
+    def test_isolated_cases_do_not_fork_again(self):
+        result = unittest.TestResult()
+        suite = unittest.TestSuite([
+            self.IsolatedSample('test_pass'),
+            self.IsolatedSample('test_pass')])
+        pool.IsolatedWorkerPool(size=1).run(suite, result)
+        self.assertEqual(2, result.testsRun)
+        self.assertEqual(1, len(set(self.pids())))
+
+    def test_pooled_test_suite(self):
+        suite = pool.PooledTestSuite([self.Sample('test_pass')] * 2)
+        suite.pool_size = 2
+        result = suite.run(unittest.TestResult())
+        self.assertEqual(2, result.testsRun)
+        self.assertTrue(result.wasSuccessful())
+
+
+class TestIsolatedUnits(base.TestCase):
+
+    def test_expands_plain_suites(self):
+        Sample = TestIsolatedWorkerPool.Sample
+        isolated = pysubunit.IsolatedTestSuite([Sample('test_pass')])
+        case = Sample('test_fail')
+        suite = unittest.TestSuite([unittest.TestSuite([case]), isolated])
+        self.assertEqual([case, isolated], list(pool.isolated_units(suite)))
@@ -10,10 +10,15 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
 import io
+import json
+import os
+import sys
 import unittest
 
-import mock
+import fixtures
+import iso8601
 import testtools
 from testtools.compat import _b
 from testtools.matchers import StartsWith
@@ -56,30 +61,92 @@ class TestSubunitTestRunner(base.TestCase):
     def test_list_errors_if_errors_from_list_test(self):
         bytestream = io.BytesIO()
         runner = run.SubunitTestRunner(stream=bytestream)
-
-        def list_test(test):
-            return [], ['failed import']
-
-        with mock.patch('testtools.run.list_test',
-                        return_value=([], ['failed import'])):
-            exc = self.assertRaises(SystemExit, runner.list, None)
-            self.assertEqual((2,), exc.args)
+        failed = testtools.PlaceHolder(
+            'unittest.loader.ModuleImportFailure.failed_import')
+        exc = self.assertRaises(SystemExit, runner.list, failed)
+        self.assertEqual((2,), exc.args)
+        bytestream.seek(0)
+        eventstream = StreamResult()
+        v2.ByteStreamToStreamResult(bytestream).run(eventstream)
+        self.assertEqual(b'failed_import', eventstream._events[0][6])
 
     def test_list_includes_loader_errors(self):
         bytestream = io.BytesIO()
         runner = run.SubunitTestRunner(stream=bytestream)
 
-        def list_test(test):
-            return [], []
-
         class Loader(object):
             errors = ['failed import']
 
         loader = Loader()
-        with mock.patch('testtools.run.list_test', return_value=([], [])):
-            exc = self.assertRaises(SystemExit, runner.list, None,
-                                    loader=loader)
-            self.assertEqual((2,), exc.args)
+        exc = self.assertRaises(SystemExit, runner.list, unittest.TestSuite(),
+                                loader=loader)
+        self.assertEqual((2,), exc.args)
+
+    def test_list_writes_batches(self):
+        bytestream = io.BytesIO()
+        writes = []
+        bytestream.write = lambda data: writes.append(bytes(data))
+        runner = run.SubunitTestRunner(stream=bytestream)
+        self.patch(run, '_LIST_BATCH', 2)
+        tests = [testtools.PlaceHolder('name%d' % i) for i in range(5)]
+        runner.list(unittest.TestSuite(tests))
+        self.assertEqual([2, 2, 1], [data.count(b'name') for data in writes])
+        eventstream = StreamResult()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(b''.join(writes))).run(eventstream)
+        self.assertEqual(
+            [('status', 'name%d' % i, 'exists') for i in range(5)],
+            [event[:3] for event in eventstream._events])
+
+    def test_list_cache(self):
+        path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'list-cache')
+        tests = [self.FailingTest('test_fail')]
+
+        def list_tests(tests):
+            bytestream = io.BytesIO()
+            runner = run.SubunitTestRunner(stream=bytestream)
+            runner.list_cache = path
+            runner.list_cache_key = ['key']
+            runner.list(unittest.TestSuite(tests))
+            return bytestream.getvalue()
+
+        listed = list_tests(tests)
+        self.assertTrue(os.path.exists(path))
+        self.assertIn(b'test_fail', listed)
+        # The cache is used while the test modules are unchanged.
+        self.assertEqual(listed, list_tests([]))
+        with open(path, 'rb') as cache:
+            header = json.loads(cache.readline().decode('utf8'))
+        self.assertIn(__file__.replace('.pyc', '.py'), header['mtimes'])
+        header['mtimes'][__file__.replace('.pyc', '.py')] -= 1
+        with open(path, 'rb') as cache:
+            cache.readline()
+            data = cache.read()
+        with open(path, 'wb') as cache:
+            cache.write(json.dumps(header).encode('utf8') + b'\n' + data)
+        self.assertEqual(b'', list_tests([]))
+
+    def test_list_cache_hit_loads_no_tests(self):
+        path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'list-cache')
+        argv = ['progName', '--list', '--list-cache', path,
+                'pysubunit.tests.test_run.TestSubunitTestRunner.FailingTest']
+
+        def list_tests():
+            bytestream = io.BytesIO()
+            stream = io.TextIOWrapper(bytestream, encoding='utf8')
+            run.main(argv=argv, stdout=stream)
+            stream.flush()
+            return bytestream.getvalue()
+
+        listed = list_tests()
+        self.assertIn(b'test_fail', listed)
+
+        def load(*args, **kwargs):
+            self.fail('tests were loaded')
+        self.patch(unittest.TestLoader, 'loadTestsFromNames', load)
+        self.assertEqual(listed, list_tests())
 
     class FailingTest(base.TestCase):
         def test_fail(self):
@@ -111,3 +178,164 @@ class TestSubunitTestRunner(base.TestCase):
                   "pysubunit.tests.test_run.TestSubunitTestRunner."
                   "ExitingTest"], stdout=stream)
         self.assertEqual(0, exc.args[0])
+
+
+class TestPartitionTests(base.TestCase):
+
+    def test_even_split_keeps_order(self):
+        self.assertEqual(
+            [['a', 'b'], ['c', 'd'], ['e']],
+            run.partition_tests(['a', 'b', 'c', 'd', 'e'], 3))
+
+    def test_more_workers_than_tests(self):
+        self.assertEqual(
+            [['a'], [], []], run.partition_tests(['a'], 3))
+
+    def test_longest_first(self):
+        durations = {'a': 1.0, 'b': 5.0, 'c': 3.0, 'd': 2.0, 'e': 2.0}
+        partitions = run.partition_tests(
+            ['a', 'b', 'c', 'd', 'e'], 2, durations)
+        self.assertEqual([['b', 'e'], ['a', 'c', 'd']], partitions)
+
+    def test_unknown_tests_split_evenly(self):
+        durations = {'a': 10.0}
+        partitions = run.partition_tests(
+            ['a', 'x', 'y', 'z'], 2, durations)
+        self.assertEqual([['a', 'z'], ['x', 'y']], partitions)
+
+
+class TestReadDurations(base.TestCase):
+
+    def test_durations_from_timestamps(self):
+        start = datetime.datetime(2014, 1, 1, tzinfo=iso8601.UTC)
+        output = io.BytesIO()
+        result = v2.StreamResultToBytes(output)
+        result.status(test_id='foo', test_status='exists')
+        result.status(test_id='foo', test_status='inprogress',
+                      timestamp=start)
+        result.status(test_id='bar', test_status='inprogress',
+                      timestamp=start, route_code='1')
+        result.status(test_id='foo', test_status='success',
+                      timestamp=start + datetime.timedelta(seconds=2))
+        result.status(test_id='bar', test_status='fail', route_code='1',
+                      timestamp=start + datetime.timedelta(seconds=0.5))
+        result.status(test_id='untimed', test_status='success')
+        output.seek(0)
+        self.assertEqual(
+            {'foo': 2.0, 'bar': 0.5}, run.read_durations(output))
+
+
+@testtools.skipIf(os.name != "posix", "Need a posix system for forking tests")
+class TestParallelRun(base.TestCase):
+
+    class Sample(base.TestCase):
+
+        def test_one(self):
+            pass
+
+        def test_two(self):
+            pass
+
+        def test_three(self):
+            self.fail('three')
+
+        def test_passes(self):
+            pass
+
+    class Printer(unittest.TestCase):
+
+        def test_prints(self):
+            sys.stdout.write(u'printed by a worker\n')
+
+    def _run(self, parallel, names, case=None):
+        bytestream = io.BytesIO()
+        runner = run.SubunitTestRunner(stream=bytestream, parallel=parallel)
+        suite = unittest.TestSuite(
+            (case or self.Sample)(name) for name in names)
+        result = runner.run(suite)
+        events = StreamResult()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(bytestream.getvalue()),
+            non_subunit_name='stdout').run(events)
+        return result, events._events
+
+    def test_routes_each_worker(self):
+        names = ['test_one', 'test_two', 'test_three']
+        result, events = self._run(2, names)
+        self.assertFalse(result.wasSuccessful())
+        outcomes = {
+            (event[1].rsplit('.', 1)[1], event[2], event[9])
+            for event in events if event[2] in ('success', 'fail')}
+        self.assertEqual({
+            ('test_one', 'success', '0'),
+            ('test_two', 'success', '0'),
+            ('test_three', 'fail', '1'),
+            }, outcomes)
+        exists = [event[1].rsplit('.', 1)[1] for event in events
+                  if event[2] == 'exists']
+        self.assertEqual(names, exists)
+
+    def test_successful_run(self):
+        result, _ = self._run(3, ['test_one', 'test_two'])
+        self.assertTrue(result.wasSuccessful())
+
+    def test_worker_output_is_passed_through(self):
+        # A buffered stdout on the real file descriptor 1, as workers have
+        # outside of tests.
+        stdout = io.TextIOWrapper(io.open(1, 'wb', closefd=False))
+        self.useFixture(fixtures.MonkeyPatch('sys.stdout', stdout))
+        _, events = self._run(2, ['test_prints'], self.Printer)
+        output = b''.join(
+            event[6] for event in events
+            if event[1] is None and event[5] == 'stdout')
+        self.assertEqual(b'printed by a worker\n', output)
+
+    def test_parallel_option(self):
+        bytestream = io.BytesIO()
+        stream = io.TextIOWrapper(bytestream, encoding="utf8")
+        run.main(argv=["progName", "--parallel", "2",
+                       "pysubunit.tests.test_run.TestParallelRun.Sample"],
+                 stdout=stream)
+        events = StreamResult()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(bytestream.getvalue()),
+            non_subunit_name='stdout').run(events)
+        self.assertEqual(
+            {'0', '1'},
+            {event[9] for event in events._events
+             if event[2] == 'success'})
+
+    def test_durations_from_option(self):
+        durations = io.BytesIO()
+        result = v2.StreamResultToBytes(durations)
+        start = datetime.datetime(2014, 1, 1, tzinfo=iso8601.UTC)
+        test_id = self.Sample('test_one').id()
+        result.status(test_id=test_id, test_status='inprogress',
+                      timestamp=start)
+        result.status(test_id=test_id, test_status='success',
+                      timestamp=start + datetime.timedelta(seconds=60))
+        path = os.path.join(self.useFixture(fixtures.TempDir()).path, 'last')
+        with open(path, 'wb') as stream:
+            stream.write(durations.getvalue())
+        bytestream = io.BytesIO()
+        stream = io.TextIOWrapper(bytestream, encoding="utf8")
+        run.main(argv=["progName", "--parallel", "2",
+                       "--durations-from", path,
+                       "pysubunit.tests.test_run.TestParallelRun.Sample"],
+                 stdout=stream)
+        events = StreamResult()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(bytestream.getvalue()),
+            non_subunit_name='stdout').run(events)
+        routes = {}
+        for event in events._events:
+            if event[2] in ('success', 'fail'):
+                routes.setdefault(event[9], set()).add(
+                    event[1].rsplit('.', 1)[1])
+        # Without durations the split would be by position: test_one and
+        # test_passes, then test_three and test_two. The long test_one
+        # instead gets the smaller share of the untimed tests.
+        self.assertEqual(
+            sorted([{'test_one', 'test_two'}, {'test_passes', 'test_three'}],
+                   key=sorted),
+            sorted(routes.values(), key=sorted))
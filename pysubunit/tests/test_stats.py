@@ -0,0 +1,252 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for pysubunit.stats."""
+
+import datetime
+import random
+
+import iso8601
+import testtools
+from testtools import compat
+
+import pysubunit
+from pysubunit import stats
+from pysubunit.tests import base
+
+
+def at(seconds):
+    return datetime.datetime(2013, 2, 1, tzinfo=iso8601.UTC) + (
+        datetime.timedelta(seconds=seconds))
+
+
+class TestStreamResultStats(base.TestCase):
+
+    def setUp(self):
+        super(TestStreamResultStats, self).setUp()
+        self.output = compat.StringIO()
+        self.result = stats.StreamResultStats(self.output, slowest=2)
+        self.result.startTestRun()
+
+    def run_test(self, test_id, status, start=None, end=None, tags=None):
+        self.result.status(test_id=test_id, test_status='inprogress',
+                           test_tags=tags, timestamp=start)
+        self.result.status(test_id=test_id, test_status=status,
+                           test_tags=tags, timestamp=end)
+
+    def test_empty(self):
+        self.result.stopTestRun()
+        self.assertEqual(0, self.result.total_tests)
+        self.assertEqual(set(), self.result.seen_tags)
+        self.assertTrue(self.result.wasSuccessful())
+        self.assertEqual({}, self.result.percentiles())
+
+    def test_format_stats(self):
+        # The v1 stream TestResultStats is tested with, as v2 events.
+        self.run_test('passed', 'success', tags=set(['global']))
+        self.run_test('failed', 'fail', tags=set(['global', 'local']))
+        self.run_test('error', 'fail', tags=set(['global']))
+        self.run_test('skipped', 'skip', tags=set(['global']))
+        self.run_test('todo', 'xfail', tags=set(['global']))
+        self.result.stopTestRun()
+        self.result.formatStats()
+        self.assertEqual("""\
+Total tests:       5
+Passed tests:      2
+Failed tests:      2
+Skipped tests:     1
+Seen tags: global, local
+""", self.output.getvalue())
+        self.assertFalse(self.result.wasSuccessful())
+
+    def test_format_stats_verbose(self):
+        self.run_test('passed', 'success', tags=set(['global']))
+        self.run_test('failed', 'fail', tags=set(['global', 'local']))
+        self.run_test('error', 'fail', tags=set(['global']))
+        self.run_test('skipped', 'skip', tags=set(['global']))
+        self.run_test('todo', 'xfail', tags=set(['global']))
+        self.result.stopTestRun()
+        self.result.formatStats(verbose=True)
+        self.assertEqual("""\
+Total tests:       5
+Passed tests:      2
+Failed tests:      2
+Skipped tests:     1
+Seen tags: global, local
+Statuses: fail 2, skip 1, success 1, xfail 1
+Tags:
+  global: fail 2, skip 1, success 1, xfail 1
+  local: fail 1
+""", self.output.getvalue())
+        self.assertFalse(self.result.wasSuccessful())
+
+    def test_same_totals_as_test_result_stats(self):
+        old = pysubunit.TestResultStats(compat.StringIO())
+        for status in ['success', 'fail', 'skip', 'xfail', 'uxsuccess']:
+            self.run_test(status, status)
+        self.result.status(test_id='hung', test_status='inprogress')
+        self.result.stopTestRun()
+        extended = testtools.StreamToExtendedDecorator(old)
+        extended.startTestRun()
+        for status in ['success', 'fail', 'skip', 'xfail', 'uxsuccess']:
+            extended.status(test_id=status, test_status='inprogress')
+            extended.status(test_id=status, test_status=status)
+        extended.status(test_id='hung', test_status='inprogress')
+        extended.stopTestRun()
+        for name in ['total_tests', 'passed_tests', 'failed_tests',
+                     'skipped_tests']:
+            self.assertEqual(
+                getattr(old, name), getattr(self.result, name), name)
+
+    def test_unfinished_tests(self):
+        self.result.status(test_id='a', test_status='inprogress')
+        self.result.status(test_id='b', file_name='log', file_bytes=b'1')
+        self.result.stopTestRun()
+        self.assertEqual(
+            {'inprogress': 1, 'unknown': 1}, dict(self.result.statuses))
+        self.assertEqual(2, self.result.failed_tests)
+
+    def test_exists_is_not_a_test(self):
+        self.result.status(test_id='a', test_status='exists')
+        self.result.stopTestRun()
+        self.assertEqual({'exists': 1}, dict(self.result.statuses))
+        self.assertEqual(0, self.result.total_tests)
+
+    def assertClose(self, expected, actual, relative_accuracy=0.01):
+        self.assertTrue(
+            abs(actual - expected) <= expected * relative_accuracy,
+            '%r is not within %r of %r' % (
+                actual, relative_accuracy, expected))
+
+    def test_durations(self):
+        for i in range(1, 11):
+            self.run_test('test_%d' % i, 'success', at(0), at(i))
+        self.run_test('untimed', 'success')
+        self.result.stopTestRun()
+        self.assertEqual(10, self.result.durations.count)
+        percentiles = self.result.percentiles()
+        self.assertEqual([50, 90, 95, 99], sorted(percentiles))
+        for percentile, expected in [(50, 5), (90, 9), (95, 10), (99, 10)]:
+            self.assertClose(expected, percentiles[percentile])
+        self.assertEqual(
+            [{'id': 'test_10', 'duration': 10.0},
+             {'id': 'test_9', 'duration': 9.0}],
+            self.result.as_dict()['slowest'])
+
+    def test_durations_from_inprogress(self):
+        # An untimed attachment first does not lose the duration, and an
+        # earlier timed one does not stretch it.
+        self.result.status(test_id='a', file_name='log', file_bytes=b'1')
+        self.run_test('a', 'success', at(1), at(3))
+        self.result.status(test_id='b', file_name='log', file_bytes=b'1',
+                           timestamp=at(0))
+        self.run_test('b', 'success', at(2), at(3))
+        self.result.stopTestRun()
+        self.assertEqual(
+            [{'id': 'a', 'duration': 2.0}, {'id': 'b', 'duration': 1.0}],
+            self.result.as_dict()['slowest'])
+
+    def test_as_dict(self):
+        self.run_test('a', 'success', at(1), at(3), tags=set(['x']))
+        self.run_test('b', 'fail', at(3), at(4))
+        self.result.stopTestRun()
+        as_dict = self.result.as_dict()
+        durations = as_dict.pop('durations')
+        self.assertEqual(2, durations['count'])
+        self.assertEqual(3.0, durations['total'])
+        self.assertClose(2.0, durations['percentiles']['99'])
+        self.assertEqual(
+            durations['sketch'], self.result.durations.as_dict())
+        self.assertEqual({
+            'total_tests': 2,
+            'passed_tests': 1,
+            'failed_tests': 1,
+            'skipped_tests': 0,
+            'statuses': {'success': 1, 'fail': 1},
+            'tags': {'x': {'success': 1}},
+            'elapsed': 3.0,
+            'slowest': [{'id': 'a', 'duration': 2.0},
+                        {'id': 'b', 'duration': 1.0}],
+            }, as_dict)
+
+
+class TestDurationSketch(base.TestCase):
+
+    def make_durations(self, seed, count=2000):
+        rng = random.Random(seed)
+        return [rng.lognormvariate(-3, 2) for _ in range(count)]
+
+    def assertQuantiles(self, durations, sketch):
+        durations = sorted(durations)
+        for percentile in [1, 50, 90, 95, 99, 100]:
+            quantile = percentile / 100.0
+            rank = max(1, -(-percentile * len(durations) // 100))
+            expected = durations[rank - 1]
+            actual = sketch.quantile(quantile)
+            self.assertTrue(
+                abs(actual - expected) <= expected * 0.01,
+                (quantile, expected, actual))
+
+    def test_empty(self):
+        sketch = stats.DurationSketch()
+        self.assertEqual(None, sketch.quantile(0.5))
+        self.assertEqual(0, sketch.count)
+
+    def test_quantiles_within_relative_accuracy(self):
+        durations = self.make_durations(0)
+        sketch = stats.DurationSketch()
+        for duration in durations:
+            sketch.add(duration)
+        self.assertEqual(len(durations), sketch.count)
+        self.assertAlmostEqual(sum(durations), sketch.total)
+        self.assertQuantiles(durations, sketch)
+
+    def test_zero_and_negative_durations(self):
+        sketch = stats.DurationSketch()
+        for duration in [0, -1, 0, 5]:
+            sketch.add(duration)
+        self.assertEqual(3, sketch.zero_count)
+        self.assertEqual(0.0, sketch.quantile(0.75))
+        self.assertEqual(5, sketch.quantile(1))
+
+    def test_merge(self):
+        first, second = self.make_durations(1), self.make_durations(2)
+        merged = stats.DurationSketch()
+        for duration in first:
+            merged.add(duration)
+        other = stats.DurationSketch()
+        for duration in second:
+            other.add(duration)
+        merged.merge(other)
+        self.assertQuantiles(first + second, merged)
+
+    def test_merge_needs_same_accuracy(self):
+        self.assertRaises(
+            ValueError, stats.DurationSketch().merge,
+            stats.DurationSketch(0.05))
+
+    def test_as_dict_round_trip(self):
+        sketch = stats.DurationSketch()
+        for duration in self.make_durations(3) + [0]:
+            sketch.add(duration)
+        data = sketch.as_dict()
+        self.assertEqual(data, stats.DurationSketch.from_dict(data).as_dict())
+
+    def test_max_buckets(self):
+        sketch = stats.DurationSketch(max_buckets=10)
+        for exponent in range(-20, 20):
+            sketch.add(2.0 ** exponent)
+        self.assertEqual(10, len(sketch.buckets))
+        self.assertEqual(2.0 ** 19, sketch.quantile(1))
+        # Only the shortest durations lose accuracy.
+        self.assertTrue(
+            abs(sketch.quantile(0.9) - 2.0 ** 15) <= 2.0 ** 15 * 0.01)
@@ -13,12 +13,15 @@
 """Tests for subunit.TestResultFilter."""
 
 from datetime import datetime
+import json
 import os
 import subprocess
 import sys
 import unittest
 
+import fixtures
 import iso8601
+import testtools
 from testtools import compat
 from testtools.testresult import doubles
 
@@ -295,6 +298,176 @@ xfail todo
              ('stopTest', foo), ], result._events)
 
 
+class TestStreamResultFilter(base.TestCase):
+
+    def run_filter(self, events, **kwargs):
+        result = doubles.StreamResult()
+        result_filter = test_results.StreamResultFilter(result, **kwargs)
+        result_filter.startTestRun()
+        for event in events:
+            result_filter.status(**event)
+        result_filter.stopTestRun()
+        return [event[1:4] for event in result._events
+                if event[0] == 'status']
+
+    def test_outcomes(self):
+        events = []
+        for test_id, status in [('a', 'success'), ('b', 'fail'),
+                                ('c', 'skip'), ('d', 'xfail'),
+                                ('e', 'uxsuccess')]:
+            events.append(dict(test_id=test_id, test_status='inprogress'))
+            events.append(dict(test_id=test_id, test_status=status))
+        self.assertEqual(
+            ['b', 'b', 'd', 'd', 'e', 'e'],
+            [event[0] for event in self.run_filter(events, filter_skip=True)])
+
+    def test_events_forwarded_when_the_test_ends(self):
+        events = [
+            dict(test_id='a', test_status='inprogress'),
+            dict(file_name='stdout', file_bytes=b'hi'),
+            dict(test_id='a', file_name='log', file_bytes=b'1'),
+            dict(test_id='a', test_status='fail'),
+            ]
+        self.assertEqual([
+            (None, None, None),
+            ('a', 'inprogress', None),
+            ('a', None, None),
+            ('a', 'fail', None),
+            ], self.run_filter(events))
+
+    def test_no_passthrough(self):
+        events = [dict(file_name='stdout', file_bytes=b'hi')]
+        self.assertEqual([], self.run_filter(events, passthrough=False))
+
+    def test_exists_dropped(self):
+        events = [dict(test_id='a', test_status='exists')]
+        self.assertEqual(
+            [], self.run_filter(events, filter_success=False))
+
+    def test_unfinished_tests_fail(self):
+        events = [
+            dict(test_id='a', test_status='inprogress', test_tags=set(['x'])),
+            dict(test_id='b', test_status='inprogress'),
+            ]
+        self.assertEqual([
+            ('b', 'inprogress', None),
+            ('b', 'fail', None),
+            ('a', 'inprogress', set(['x'])),
+            ('a', 'fail', set(['x'])),
+            ], self.run_filter(events))
+
+    def test_fixup_expected_failures(self):
+        events = [
+            dict(test_id='a', test_status='fail', test_tags=set(['x'])),
+            dict(test_id='b', test_status='success'),
+            dict(test_id='c', test_status='fail'),
+            ]
+        self.assertEqual([
+            ('a', 'xfail', set(['x'])),
+            ('b', 'uxsuccess', None),
+            ], self.run_filter(
+                events, filter_failure=True,
+                fixup_expected_failures=set(['a', 'b'])))
+
+    def test_fixup_clears_packet_bytes(self):
+        received = []
+
+        class Result(testtools.StreamResult):
+            def status(self, **kwargs):
+                received.append(
+                    (kwargs['test_status'], kwargs['packet_bytes']))
+        result_filter = test_results.StreamResultFilter(
+            Result(), fixup_expected_failures=set(['a']))
+        result_filter.status(
+            test_id='a', test_status='inprogress', packet_bytes=b'1')
+        result_filter.status(
+            test_id='a', test_status='fail', packet_bytes=b'2')
+        self.assertEqual(
+            [('inprogress', b'1'), ('xfail', None)], received)
+
+    def test_predicate(self):
+        calls = []
+
+        def predicate(test, outcome, err, details, tags):
+            calls.append((test.id(), outcome, err,
+                          b''.join(details['log'].iter_bytes()), tags))
+            return False
+        events = [
+            dict(test_id='a', test_status='inprogress', test_tags=set(['x'])),
+            dict(test_id='a', file_name='log', file_bytes=b'boom'),
+            dict(test_id='a', test_status='fail', test_tags=set(['x'])),
+            ]
+        self.assertEqual(
+            [], self.run_filter(events, filter_predicate=predicate))
+        self.assertEqual(
+            [('a', 'failure', None, b'boom', set(['x']))], calls)
+
+    def test_id_predicate(self):
+        ids = []
+
+        def id_predicate(test_id):
+            ids.append(test_id)
+            return test_id != 'b'
+        events = [
+            dict(test_id='a', test_status='inprogress'),
+            dict(test_id='b', test_status='inprogress'),
+            dict(test_id='b', file_name='log', file_bytes=b'1'),
+            dict(test_id='a', test_status='fail'),
+            dict(test_id='b', test_status='fail'),
+            dict(test_id='c', test_status='fail'),
+            dict(test_id='b', test_status='inprogress'),
+            ]
+        self.assertEqual(
+            [('a', 'inprogress', None), ('a', 'fail', None),
+             ('c', 'fail', None)],
+            self.run_filter(events, id_predicate=id_predicate))
+        self.assertEqual(['a', 'b', 'c', 'b'], ids)
+
+    def test_spill_threshold(self):
+        events = [
+            dict(test_id='a', test_status='inprogress'),
+            dict(test_id='b', test_status='inprogress'),
+            dict(test_id='a', file_name='log', file_bytes=b'123'),
+            dict(test_id='b', file_name='log', file_bytes=b'4567'),
+            dict(test_id='a', file_name='log', file_bytes=b'89'),
+            dict(test_id='b', test_status='success'),
+            dict(test_id='a', test_status='fail'),
+            ]
+        expected = doubles.StreamResult()
+        for event in events:
+            if event['test_id'] == 'a':
+                expected.status(**event)
+        result = doubles.StreamResult()
+        result_filter = test_results.StreamResultFilter(
+            result, spill_threshold=4)
+        result_filter.startTestRun()
+        for event in events[:5]:
+            result_filter.status(**event)
+        self.assertEqual(3, result_filter._held_bytes)
+        self.assertEqual(2, result_filter._spilled_events)
+        for event in events[5:]:
+            result_filter.status(**event)
+        self.assertEqual(0, result_filter._held_bytes)
+        self.assertEqual(0, result_filter._spilled_events)
+        result_filter.stopTestRun()
+        self.assertEqual(expected._events, result._events[1:-1])
+
+    def test_spilled_packet_bytes(self):
+        received = []
+
+        class Result(testtools.StreamResult):
+            def status(self, **kwargs):
+                received.append(
+                    (kwargs.get('file_bytes'), kwargs['packet_bytes']))
+        result_filter = test_results.StreamResultFilter(
+            Result(), spill_threshold=0)
+        result_filter.status(test_id='a', file_name='log', file_bytes=b'1',
+                             packet_bytes=b'2')
+        result_filter.status(test_id='a', test_status='fail',
+                             packet_bytes=b'3')
+        self.assertEqual([(b'1', b'2'), (None, b'3')], received)
+
+
 class TestFilterCommand(base.TestCase):
 
     def run_command(self, args, stream):
@@ -342,6 +515,77 @@ class TestFilterCommand(base.TestCase):
         ids = set(event[1] for event in events._events)
         self.assertEqual(set(['foo', 'baz']), ids)
 
+    def test_id_regexps(self):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        for test_id in ['foo.a', 'foo.b', 'bar.a']:
+            stream.status(test_id=test_id, test_status="inprogress")
+            stream.status(test_id=test_id, test_status="success",
+                          file_name='log', file_bytes=b'foo.b')
+        output = self.run_command(
+            ['-s', '--with-id', '^foo', '--without-id', 'b$'],
+            byte_stream.getvalue())
+        events = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(compat.BytesIO(output)).run(events)
+        ids = set(event[1] for event in events._events)
+        self.assertEqual(set(['foo.a']), ids)
+
+    def test_id_lists(self):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        test_ids = ['pkg.test_a.test_1', 'pkg.test_a.test_2',
+                    'pkg.test_b.TestSlow.test_3', 'pkg.test_b.test_4',
+                    'other.test_5']
+        for test_id in test_ids:
+            stream.status(test_id=test_id, test_status="inprogress")
+            stream.status(test_id=test_id, test_status="success")
+        list_dir = self.useFixture(fixtures.TempDir()).path
+        include_path = os.path.join(list_dir, 'include')
+        with open(include_path, 'w') as include_file:
+            include_file.write('pkg.*\nother.test_5\n')
+        exclude_path = os.path.join(list_dir, 'exclude')
+        with open(exclude_path, 'w') as exclude_file:
+            exclude_file.write('pkg.test_a.test_2\n*Slow*\n')
+        output = self.run_command(
+            ['-s', '--include-list', include_path,
+             '--exclude-list', exclude_path], byte_stream.getvalue())
+        events = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(compat.BytesIO(output)).run(events)
+        ids = set(event[1] for event in events._events)
+        self.assertEqual(
+            set(['pkg.test_a.test_1', 'pkg.test_b.test_4', 'other.test_5']),
+            ids)
+
+    def test_fixup_expected_failures(self):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(test_id="foo", test_status="inprogress")
+        stream.status(test_id="foo", test_status="fail")
+        list_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'expected')
+        with open(list_path, 'w') as list_file:
+            list_file.write('foo\n')
+        output = self.run_command(
+            ['--fixup-expected-failures', list_path, '--xfail'],
+            byte_stream.getvalue())
+        events = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(compat.BytesIO(output)).run(events)
+        self.assertEqual([
+            ('status', 'foo', 'inprogress'),
+            ('status', 'foo', 'xfail'),
+            ], [event[:3] for event in events._events])
+
+    def test_kept_tests_copied_verbatim(self):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(
+            test_id="foo", test_status="inprogress", test_tags=set(["a"]),
+            timestamp=datetime(2013, 2, 1, tzinfo=iso8601.UTC),
+            route_code='0')
+        stream.status(test_id="foo", test_status="success", route_code='0')
+        output = self.run_command(['-s'], byte_stream.getvalue())
+        self.assertEqual(byte_stream.getvalue(), output)
+
     def test_no_passthrough(self):
         output = self.run_command(['--no-passthrough'], b'hi thar')
         self.assertEqual(b'', output)
@@ -352,3 +596,19 @@ class TestFilterCommand(base.TestCase):
         stream = v2.StreamResultToBytes(byte_stream)
         stream.status(file_name="stdout", file_bytes=b'hi thar')
         self.assertEqual(byte_stream.getvalue(), output)
+
+    def test_stats_to(self):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(test_id="foo", test_status="inprogress")
+        stream.status(test_id="foo", test_status="success")
+        stats_dir = self.useFixture(fixtures.TempDir()).path
+        stats_path = os.path.join(stats_dir, 'stats.json')
+        output = self.run_command(
+            ['-s', '--stats-to', stats_path], byte_stream.getvalue())
+        with open(stats_path) as stats_file:
+            stats = json.load(stats_file)
+        self.assertEqual(2, stats['packets_read'])
+        self.assertEqual(len(byte_stream.getvalue()), stats['bytes_read'])
+        self.assertEqual(2, stats['packets_written'])
+        self.assertEqual(len(output), stats['bytes_written'])
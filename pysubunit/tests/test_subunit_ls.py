@@ -0,0 +1,83 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for subunit-ls."""
+
+import datetime
+import os
+import subprocess
+import sys
+
+import iso8601
+from testtools import compat
+
+from pysubunit.tests import base
+from pysubunit import v2
+
+
+class TestLsCommand(base.TestCase):
+
+    def run_command(self, args, stream, returncode=0):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script_path = os.path.join(root, 'commands', 'subunit_ls.py')
+        command = [sys.executable, script_path] + list(args)
+        ps = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        out, err = ps.communicate(stream)
+        if ps.returncode != returncode:
+            raise RuntimeError("%s failed: %s" % (command, err))
+        return out
+
+    def make_stream(self, status='success'):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(file_name='stdout', file_bytes=b'hi thar\n')
+        stream.status(test_id='foo', test_status='inprogress')
+        stream.status(test_id='foo', test_status='success')
+        stream.status(test_id='bar', test_status='exists')
+        stream.status(test_id='baz', test_status='inprogress')
+        stream.status(test_id='baz', test_status=status)
+        return byte_stream.getvalue()
+
+    def test_ls(self):
+        self.assertEqual(
+            b'hi thar\nfoo\nbaz\n', self.run_command([], self.make_stream()))
+
+    def test_options(self):
+        self.assertEqual(
+            b'foo\nbar\nbaz\n',
+            self.run_command(['--exists', '--no-passthrough'],
+                             self.make_stream()))
+
+    def test_times(self):
+        def at(seconds):
+            return datetime.datetime(2013, 2, 1, tzinfo=iso8601.UTC) + (
+                datetime.timedelta(seconds=seconds))
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(test_id='foo', test_status='inprogress',
+                      timestamp=at(0))
+        stream.status(test_id='foo', file_name='log', file_bytes=b'x',
+                      timestamp=at(1))
+        stream.status(test_id='foo', test_status='success', timestamp=at(3))
+        stream.status(test_id='bar', test_status='inprogress',
+                      timestamp=at(4))
+        self.assertEqual(
+            b'foo 2.000\nbar 0.000\n',
+            self.run_command(['--times'], byte_stream.getvalue(),
+                             returncode=1))
+
+    def test_failures_set_the_exit_code(self):
+        self.run_command([], self.make_stream('fail'), returncode=1)
+        self.run_command([], self.make_stream('uxsuccess'))
+        self.run_command([], self.make_stream('inprogress'), returncode=1)
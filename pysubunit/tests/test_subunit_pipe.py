@@ -0,0 +1,111 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tests for subunit-pipe."""
+
+import io
+import os
+import subprocess
+import sys
+
+from testtools.testresult import doubles
+
+from pysubunit.tests import base
+from pysubunit import v2
+
+
+class TestPipeCommand(base.TestCase):
+
+    def run_command(self, args, stream, returncode=0):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script_path = os.path.join(root, 'commands', 'subunit_pipe.py')
+        command = [sys.executable, script_path] + list(args)
+        ps = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        out, err = ps.communicate(stream)
+        if ps.returncode != returncode:
+            raise RuntimeError("%s failed: %s" % (command, err))
+        return out
+
+    def make_stream(self):
+        byte_stream = io.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(file_name='stdout', file_bytes=b'hi thar')
+        stream.status(test_id='foo', test_status='inprogress')
+        stream.status(test_id='foo', test_status='success')
+        stream.status(
+            test_id='bar', test_status='inprogress', test_tags=set(['a']))
+        stream.status(
+            test_id='bar', test_status='fail', test_tags=set(['a']),
+            file_name='traceback', file_bytes=b'boom', eof=True)
+        return byte_stream.getvalue()
+
+    def parse(self, output):
+        events = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(io.BytesIO(output)).run(events)
+        return [event[:4] for event in events._events]
+
+    def outcomes(self, output):
+        return [event for event in self.parse(output)
+                if event[2] not in (None, 'inprogress')]
+
+    def test_no_stages(self):
+        self.assertEqual(self.make_stream(), self.run_command(
+            [], self.make_stream()))
+
+    def test_stages_run_in_order(self):
+        output = self.run_command(
+            ['tags b -a', "filter --with-tag b --no-passthrough -s"],
+            self.make_stream())
+        self.assertEqual([
+            ('status', 'foo', 'success', set(['b'])),
+            ('status', 'bar', 'fail', set(['b'])),
+            ], self.outcomes(output))
+
+    def test_filter_passthrough(self):
+        output = self.run_command(['filter'], self.make_stream())
+        self.assertEqual(
+            ('status', None, None, None), self.parse(output)[0])
+        self.assertEqual(
+            [('status', 'bar', 'fail', set(['a']))], self.outcomes(output))
+
+    def test_no_passthrough(self):
+        output = self.run_command(['--no-passthrough'], self.make_stream())
+        self.assertEqual(
+            ['foo', 'foo', 'bar', 'bar'],
+            [event[1] for event in self.parse(output)])
+
+    def test_csv_output(self):
+        output = self.run_command(
+            ['--no-passthrough', 'filter -s --without-tag a', 'csv'],
+            self.make_stream())
+        lines = output.splitlines()
+        self.assertEqual(b'test,status,start_time,stop_time', lines[0])
+        self.assertEqual([b'foo', b'success'], lines[1].split(b',')[:2])
+        self.assertEqual(2, len(lines))
+
+    def test_stats_output_fails_with_the_run(self):
+        output = self.run_command(
+            ['--no-passthrough', 'stats'], self.make_stream(), returncode=1)
+        self.assertIn(b'Failed tests:      1', output)
+
+    def test_v1_input(self):
+        output = self.run_command(
+            ['--v1', 'tags quux'], b'test: foo\nsuccess: foo\n')
+        self.assertEqual([
+            ('status', 'foo', 'inprogress', set(['quux'])),
+            ('status', 'foo', 'success', set(['quux'])),
+            ], self.parse(output))
+
+    def test_unknown_stage(self):
+        self.run_command(['frobnicate'], b'', returncode=2)
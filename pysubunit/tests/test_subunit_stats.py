@@ -12,11 +12,18 @@
 
 """Tests for subunit.TestResultStats."""
 
+import json
+import os
+import subprocess
+import sys
 import unittest
 
+import fixtures
 from testtools import compat
 
 import pysubunit
+from pysubunit.tests import base
+from pysubunit import v2
 
 
 class TestTestResultStats(unittest.TestCase):
@@ -72,3 +79,79 @@ Seen tags: global, local
         self.setUpUsedStream()
         self.result.formatStats()
         self.assertEqual(expected, self.output.getvalue())
+
+
+class TestStatsCommand(base.TestCase):
+
+    def run_command(self, args, stream, returncode=0):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        script_path = os.path.join(root, 'commands', 'subunit_stats.py')
+        command = [sys.executable, script_path] + list(args)
+        ps = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        out, err = ps.communicate(stream)
+        if ps.returncode != returncode:
+            raise RuntimeError("%s failed: %s" % (command, err))
+        return out
+
+    def make_stream(self):
+        byte_stream = compat.BytesIO()
+        stream = v2.StreamResultToBytes(byte_stream)
+        stream.status(file_name='stdout', file_bytes=b'hi thar\n')
+        stream.status(test_id='foo', test_status='inprogress',
+                      test_tags=set(['a']))
+        stream.status(test_id='foo', test_status='success',
+                      test_tags=set(['a']))
+        stream.status(test_id='bar', test_status='inprogress')
+        stream.status(test_id='bar', test_status='fail')
+        return byte_stream.getvalue()
+
+    def test_text(self):
+        output = self.run_command([], self.make_stream(), returncode=1)
+        self.assertEqual(b"""\
+hi thar
+Total tests:       2
+Passed tests:      1
+Failed tests:      1
+Skipped tests:     0
+Seen tags: a
+""", output)
+
+    def test_verbose(self):
+        output = self.run_command(
+            ['--verbose'], self.make_stream(), returncode=1)
+        self.assertEqual(b"""\
+hi thar
+Total tests:       2
+Passed tests:      1
+Failed tests:      1
+Skipped tests:     0
+Seen tags: a
+Statuses: fail 1, success 1
+Tags:
+  a: success 1
+""", output)
+
+    def test_json(self):
+        output = self.run_command(
+            ['--json'], self.make_stream(), returncode=1)
+        result = json.loads(output.decode('utf8'))
+        self.assertEqual(2, result['total_tests'])
+        self.assertEqual({'fail': 1, 'success': 1}, result['statuses'])
+        self.assertEqual({'a': {'success': 1}}, result['tags'])
+
+    def test_output_to(self):
+        path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'stats')
+        output = self.run_command(
+            ['--output-to', path], self.make_stream(), returncode=1)
+        self.assertEqual(b'hi thar\n', output)
+        with open(path, 'rb') as stats:
+            self.assertEqual(b"""\
+Total tests:       2
+Passed tests:      1
+Failed tests:      1
+Skipped tests:     0
+Seen tags: a
+""", stats.read())
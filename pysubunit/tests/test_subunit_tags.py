@@ -13,8 +13,11 @@
 """Tests for subunit.tag_stream."""
 
 import io
+import struct
+import zlib
 
 from testtools import matchers
+from testtools.testresult import doubles
 
 import pysubunit
 import pysubunit.test_results
@@ -83,3 +86,51 @@ class TestSubUnitTags(base.TestCase):
         self.assertEqual(
             0, pysubunit.tag_stream(self.original, self.filtered, ["-bar"]))
         self.assertEqual(reference.getvalue(), self.filtered.getvalue())
+
+    def test_unchanged_packets_copied_verbatim(self):
+        stream = v2.StreamResultToBytes(self.original)
+        stream.status(
+            test_id='test', test_status='inprogress', test_tags=set(['foo']))
+        stream.status(
+            test_id='test', test_status='success', test_tags=set(['foo']),
+            file_name='log', file_bytes=b'x' * 1000, eof=True)
+        # A packet with a nanosecond timestamp, which StreamResultToBytes
+        # would round to microseconds if it were re-encoded.
+        packet = (b'\xb3\x2a\x82\x17\x00\x00\x00\x01\x41\x5b\x04test'
+                  b'\x01\x03foo')
+        packet = packet[:3] + bytes(bytearray([len(packet) + 4])) + packet[4:]
+        packet += struct.pack('>I', zlib.crc32(packet) & 0xffffffff)
+        self.original.write(packet)
+        self.original.seek(0)
+        self.assertEqual(
+            0, pysubunit.tag_stream(
+                self.original, self.filtered, ["foo", "-bar"]))
+        self.assertEqual(self.original.getvalue(), self.filtered.getvalue())
+
+    def test_non_subunit_content(self):
+        self.original.write(b'caf\xc3\xa9 \xe2\xb2\xb3\n')
+        self.original.seek(0)
+        pysubunit.tag_stream(self.original, self.filtered, ["quux"])
+        events = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(self.filtered.getvalue())).run(events)
+        self.assertEqual([
+            ('status', None, None, set(['quux']), True, 'stdout',
+             b'caf\xc3\xa9 \xe2\xb2\xb3\n', False, None, None, None),
+            ], events._events)
+
+    def test_damaged_packet(self):
+        stream = v2.StreamResultToBytes(self.original)
+        stream.status(test_id='test', test_status='success')
+        packet = self.original.getvalue()
+        self.original.seek(0)
+        self.original.write(packet[:-1] + b'\x00')
+        self.original.seek(0)
+        pysubunit.tag_stream(self.original, self.filtered, ["quux"])
+        events = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(self.filtered.getvalue())).run(events)
+        self.assertEqual(
+            [('subunit.parser', None), ('subunit.parser', 'fail')],
+            [event[1:3] for event in events._events])
+        self.assertEqual(set(['quux']), events._events[1][3])
@@ -13,6 +13,7 @@
 import datetime
 import io
 import os
+import subprocess
 import sys
 import tempfile
 
@@ -93,6 +94,26 @@ class TestTestImports(base.TestCase):
         from pysubunit import TestProtocolClient  # noqa
         from pysubunit import TestProtocolServer  # noqa
 
+    def test_attributes_after_plain_import(self):
+        # Run in a fresh interpreter: other tests have already imported the
+        # submodules, which would hide a name the package fails to provide.
+        code = ('import pysubunit\n'
+                'pysubunit.details.DetailsParser\n'
+                'pysubunit.chunked.Decoder\n'
+                'pysubunit._StringException\n'
+                'pysubunit._ReadingFailureDetails\n'
+                'pysubunit.TestProtocolServer\n')
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(pysubunit.__file__))))
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [root, env.get('PYTHONPATH')]))
+        proc = subprocess.Popen(
+            [sys.executable, '-c', code], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        self.assertEqual(0, proc.returncode, err)
+
 
 class TestDiscardStream(base.TestCase):
 
@@ -153,6 +174,35 @@ class TestTestProtocolServerPipe(base.TestCase):
         pass
 
 
+class TestIterLines(base.TestCase):
+
+    def lines(self, stream, block_size=4):
+        return list(pysubunit._iter_lines(stream, block_size=block_size))
+
+    def test_lines_across_blocks(self):
+        source = compat._b("a\nbcdefghij\n\nk\r\nlmn\nopqrs")
+        self.assertEqual(
+            [compat._b(line) for line in
+             ["a\n", "bcdefghij\n", "\n", "k\r\n", "lmn\n", "opqrs"]],
+            self.lines(compat.BytesIO(source)))
+
+    def test_empty(self):
+        self.assertEqual([], self.lines(compat.BytesIO()))
+
+    def test_block_ends_on_newline(self):
+        self.assertEqual(
+            [compat._b("abc\n"), compat._b("def\n")],
+            self.lines(compat.BytesIO(compat._b("abc\ndef\n"))))
+
+    def test_readline_only(self):
+        class ReadlineOnly(object):
+            def __init__(self, source):
+                self.readline = compat.BytesIO(source).readline
+        self.assertEqual(
+            [compat._b("a\n"), compat._b("b")],
+            self.lines(ReadlineOnly(compat._b("a\nb"))))
+
+
 class TestTestProtocolServerStartTest(base.TestCase):
 
     def setUp(self):
@@ -331,6 +381,16 @@ class TestTestProtocolServerPassThrough(base.TestCase):
         self.protocol.lineReceived(bytes)
         self.assertEqual(self.stdout.getvalue(), bytes)
 
+    def test_near_directives_passthrough(self):
+        # Lines that start like a directive but are not one are stdout.
+        lines = [compat._b("testsuite: foo\n"), compat._b("tags\n"),
+                 compat._b("\n"), compat._b(" test: foo\n"),
+                 compat._b("uxsuccess: foo\n")]
+        for line in lines:
+            self.protocol.lineReceived(line)
+        self.assertEqual(self.stdout.getvalue(), compat._b("").join(lines))
+        self.assertEqual([], self.client._events)
+
 
 class TestTestProtocolServerLostConnection(base.TestCase):
 
@@ -1020,6 +1080,40 @@ class TestTestProtocolServerStreamTime(base.TestCase):
                                        iso8601.UTC))
             ], self.result._events)
 
+    def parse_times(self, *lines):
+        self.result = doubles.ExtendedTestResult()
+        self.protocol = pysubunit.TestProtocolServer(
+            self.result, stream=compat.BytesIO())
+        for line in lines:
+            self.protocol.lineReceived(compat._b(line))
+        return [event[1] for event in self.result._events]
+
+    def test_time_microseconds(self):
+        self.assertEqual(
+            [datetime.datetime(2009, 10, 11, 12, 13, 14, 15, iso8601.UTC)],
+            self.parse_times("time: 2009-10-11 12:13:14.000015Z\n"))
+
+    def test_time_other_formats(self):
+        self.assertEqual(
+            [datetime.datetime(2009, 10, 11, 12, 13, 14, 0, iso8601.UTC),
+             datetime.datetime(2009, 10, 11, 11, 13, 14, 0, iso8601.UTC)],
+            self.parse_times("time: 2009-10-11T12:13:14+00:00\n",
+                             "time: 2009-10-11 12:13:14+01:00\n"))
+
+    def test_time_repeated(self):
+        times = self.parse_times(
+            "time: 2009-10-11 12:13:14.000015Z\n",
+            "time: 2009-10-11 12:13:14.000015Z\n",
+            "time: 2009-10-11 12:13:15.000000Z\n")
+        self.assertEqual(
+            [datetime.datetime(2009, 10, 11, 12, 13, 14, 15, iso8601.UTC)] * 2
+            + [datetime.datetime(2009, 10, 11, 12, 13, 15, 0, iso8601.UTC)],
+            times)
+
+    def test_time_invalid(self):
+        self.assertRaises(
+            TypeError, self.parse_times, "time: 2009-13-11 12:13:14Z\n")
+
 
 class TestRemotedTestCase(base.TestCase):
 
@@ -1162,6 +1256,49 @@ class TestIsolatedTestCase(base.TestCase):
         self.assertEqual(self.SampleIsolatedTestCase.TEARDOWN, False)
         self.assertEqual(self.SampleIsolatedTestCase.TEST, False)
 
+    @testtools.skipIf(os.name != "posix",
+                      "Need a posix system for forking tests")
+    def test_run_v2(self):
+        class V2SampleIsolatedTestCase(self.SampleIsolatedTestCase):
+            protocol_version = 2
+
+            def test_fails(self):
+                self.fail('boom')
+
+        result = testtools.TestResult()
+        V2SampleIsolatedTestCase("test_sets_global_state").run(result)
+        V2SampleIsolatedTestCase("test_fails").run(result)
+        self.assertEqual(result.testsRun, 2)
+        self.assertEqual(1, len(result.failures))
+        self.assertIn('boom', result.failures[0][1])
+        self.assertEqual(self.SampleIsolatedTestCase.SETUP, False)
+        self.assertEqual(self.SampleIsolatedTestCase.TEST, False)
+
+    @testtools.skipIf(os.name != "posix",
+                      "Need a posix system for forking tests")
+    def test_child_dying_mid_test(self):
+        class DyingSampleIsolatedTestCase(self.SampleIsolatedTestCase):
+
+            def test_dies(self):
+                os._exit(3)
+
+        for protocol_version in 1, 2:
+            result = testtools.TestResult()
+            test = DyingSampleIsolatedTestCase("test_dies")
+            test.protocol_version = protocol_version
+            test.run(result)
+            self.assertEqual(1, result.testsRun)
+            self.assertEqual([], result.failures)
+            self.assertEqual(1, len(result.errors))
+            self.assertIn("lost connection during test '%s'" % test.id(),
+                          result.errors[0][1])
+
+    def test_unknown_protocol_version(self):
+        test = self.SampleIsolatedTestCase("test_sets_global_state")
+        self.assertRaises(
+            ValueError, pysubunit.run_isolated, unittest.TestCase, test,
+            unittest.TestResult(), protocol_version=3)
+
 
 class TestIsolatedTestSuite(base.TestCase):
 
@@ -1199,6 +1336,18 @@ class TestIsolatedTestSuite(base.TestCase):
         self.assertEqual(self.SampleTestToIsolate.TEARDOWN, False)
         self.assertEqual(self.SampleTestToIsolate.TEST, False)
 
+    @testtools.skipIf(os.name != "posix",
+                      "Need a posix system for forking tests")
+    def test_run_v2(self):
+        result = unittest.TestResult()
+        suite = pysubunit.IsolatedTestSuite()
+        suite.protocol_version = 2
+        suite.addTest(self.SampleTestToIsolate("test_sets_global_state"))
+        suite.addTest(self.SampleTestToIsolate("test_sets_global_state"))
+        suite.run(result)
+        self.assertEqual(result.testsRun, 2)
+        self.assertEqual(self.SampleTestToIsolate.TEST, False)
+
 
 class TestTestProtocolClient(base.TestCase):
 
@@ -1443,3 +1592,81 @@ class TestTestProtocolClient(base.TestCase):
     def test_tags_gone(self):
         self.protocol.tags(set(), set(['bar']))
         self.assertEqual(compat._b("tags: -bar\n"), self.io.getvalue())
+
+
+class TestBufferedTestProtocolClient(base.TestCase):
+
+    class Output(io.BytesIO):
+
+        def __init__(self):
+            super(TestBufferedTestProtocolClient.Output, self).__init__()
+            self.writes = []
+            self.flushes = 0
+
+        def write(self, data):
+            self.writes.append(bytes(data))
+
+        def flush(self):
+            self.flushes += 1
+
+    def setUp(self):
+        super(TestBufferedTestProtocolClient, self).setUp()
+        self.output = self.Output()
+        self.test = TestTestProtocolClient("test_start_test")
+        self.details = {'something': content.Content(
+            content_type.ContentType('text', 'plain'),
+            lambda: [compat._b('serialised\n'), compat._b('form')])}
+
+    def run_test(self, flush_policy, **kwargs):
+        protocol = pysubunit.TestProtocolClient(
+            self.output, flush_policy=flush_policy, **kwargs)
+        protocol.startTestRun()
+        protocol.startTest(self.test)
+        protocol.addFailure(self.test, details=self.details)
+        protocol.stopTest(self.test)
+        return protocol
+
+    def expected(self):
+        return compat._b(
+            "test: %s\n"
+            "failure: %s [ multipart\n"
+            "Content-Type: text/plain\n"
+            "something\n"
+            "F\r\nserialised\nform0\r\n]\n" % (
+                self.test.id(), self.test.id()))
+
+    def test_unbuffered_writes_many_times(self):
+        self.run_test(None)
+        self.assertEqual(self.expected(), compat._b('').join(
+            self.output.writes))
+        self.assertThat(len(self.output.writes), matchers.GreaterThan(2))
+
+    def test_event(self):
+        self.run_test('event')
+        self.assertEqual(
+            [compat._b("test: %s\n" % self.test.id()),
+             self.expected()[len("test: %s\n" % self.test.id()):]],
+            self.output.writes)
+        self.assertEqual(2, self.output.flushes)
+
+    def test_test(self):
+        self.run_test('test')
+        self.assertEqual([self.expected()], self.output.writes)
+        self.assertEqual(1, self.output.flushes)
+
+    def test_run(self):
+        protocol = self.run_test('run')
+        self.assertEqual([], self.output.writes)
+        protocol.stopTestRun()
+        self.assertEqual([self.expected()], self.output.writes)
+
+    def test_buffer_size(self):
+        self.run_test('run', buffer_size=10)
+        self.assertEqual(self.expected(), compat._b('').join(
+            self.output.writes))
+        self.assertEqual(2, len(self.output.writes))
+
+    def test_unknown_policy(self):
+        self.assertRaises(
+            ValueError, pysubunit.TestProtocolClient, self.output,
+            flush_policy='never')
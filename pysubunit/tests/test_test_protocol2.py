@@ -214,6 +214,32 @@ class TestStreamResultToBytes(base.TestCase):
                       timestamp=timestamp)
         self.assertEqual(CONSTANT_TIMESTAMP, output.getvalue())
 
+    def test_encode_exists(self):
+        # Ids long enough to need one, two and three byte lengths.
+        test_ids = ['foo', 'b' * 100, '\u2603' * 6000]
+        result, output = self._make_result()
+        for test_id in test_ids:
+            result.status(test_id=test_id, test_status='exists')
+        self.assertEqual(output.getvalue(), v2.encode_exists(test_ids))
+
+    def test_packet_bytes_written_as_is(self):
+        result, output = self._make_result()
+        result.status(test_id="bar", test_status='success',
+                      packet_bytes=CONSTANT_ENUM)
+        self.assertEqual(CONSTANT_ENUM, output.getvalue())
+
+    def test_short_writes_are_completed(self):
+        class ShortWrites(BytesIO):
+            # Like a raw stream: takes at most two bytes a write.
+            def write(self, data):
+                return super(ShortWrites, self).write(bytes(data[:2]))
+        output = ShortWrites()
+        result = v2.StreamResultToBytes(output)
+        result.status(test_id="foo", test_status='exists',
+                      packet_bytes=CONSTANT_ENUM)
+        result.status(test_id="foo", test_status='exists')
+        self.assertEqual(CONSTANT_ENUM * 2, output.getvalue())
+
 
 class TestByteStreamToStreamResult(base.TestCase):
 
@@ -461,6 +487,24 @@ class TestByteStreamToStreamResult(base.TestCase):
                          route_code='0', mime_type='text/plain',
                          file_bytes=b'foo')
 
+    def test_packet_bytes(self):
+        events = []
+
+        class Result(object):
+            def status(self, **kwargs):
+                events.append(
+                    (kwargs.get('test_id'), kwargs['packet_bytes']))
+        source = BytesIO(b'a' + CONSTANT_ENUM + b'\xb3\x29\x01')
+        v2.ByteStreamToStreamResult(
+            source, non_subunit_name='stdout', packet_bytes=True).run(
+            Result())
+        self.assertEqual([
+            (None, None),
+            ('foo', CONSTANT_ENUM),
+            ('subunit.parser', None),
+            ('subunit.parser', None),
+            ], events)
+
     @hypothesis.given(hypothesis.strategies.binary())
     def test_hypothesis_decoding(self, code_bytes):
         source = BytesIO(code_bytes)
@@ -469,3 +513,92 @@ class TestByteStreamToStreamResult(base.TestCase):
             source, non_subunit_name="stdout")
         stream.run(result)
         self.assertEqual(b'', source.read())
+
+
+class TestCompletePackets(base.TestCase):
+
+    def _packets(self, *test_ids):
+        output = BytesIO()
+        result = v2.StreamResultToBytes(output)
+        for test_id in test_ids:
+            result.status(test_id=test_id, test_status='success')
+        return output.getvalue()
+
+    def test_whole_packets(self):
+        data = self._packets('foo', 'bar' * 10000)
+        self.assertEqual(len(data), v2.complete_packets(data))
+
+    def test_torn_packet(self):
+        first = self._packets('foo')
+        data = first + self._packets('bar')
+        for end in range(len(first), len(data)):
+            self.assertEqual(len(first), v2.complete_packets(data[:end]))
+
+    def test_non_subunit_bytes(self):
+        packet = self._packets('foo')
+        data = b'noise\n' + packet + b'more noise'
+        self.assertEqual(len(data), v2.complete_packets(data))
+        self.assertEqual(6, v2.complete_packets(data[:8]))
+
+    def test_signature_inside_utf8_text(self):
+        # U+00B3 is encoded as C2 B3; its second byte starts no packet.
+        data = u'x\u00b3y\n'.encode('utf8')
+        self.assertEqual(len(data), v2.complete_packets(data))
+        self.assertEqual(len(data), v2.complete_packets(bytearray(data)))
+
+    def test_torn_utf8_character(self):
+        # Held back: the next byte decides whether B3 starts a packet.
+        self.assertEqual(1, v2.complete_packets(u'x\u00b3'.encode('utf8')[:2]))
+        self.assertEqual(0, v2.complete_packets(b'\xe6\x97'))
+
+
+class TestStreamMetrics(base.TestCase):
+
+    def _timer(self):
+        # A fake clock that advances one unit per reading.
+        ticks = iter(range(100000))
+        return lambda: next(ticks)
+
+    def test_writer_counts_packets_and_bytes(self):
+        metrics = v2.StreamMetrics(timer=self._timer())
+        output = BytesIO()
+        result = v2.StreamResultToBytes(output, metrics=metrics)
+        result.status(test_id='foo', test_status='success')
+        result.status(file_name='bar', file_bytes=b'woo', eof=True)
+        self.assertEqual(2, metrics.packets_written)
+        self.assertEqual(1, metrics.attachments_written)
+        self.assertEqual(len(output.getvalue()), metrics.bytes_written)
+        self.assertThat(metrics.write_time, matchers.GreaterThan(0))
+        self.assertThat(metrics.encode_time, matchers.GreaterThan(0))
+
+    def test_parser_counts_packets_and_bytes(self):
+        metrics = v2.StreamMetrics(timer=self._timer())
+        source_bytes = (b'foo\n' + CONSTANT_SUCCESS + CONSTANT_FILE_CONTENT +
+                        CONSTANT_SUCCESS[:-1] + b'\x00')
+        result = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(
+            BytesIO(source_bytes), non_subunit_name='stdout',
+            metrics=metrics).run(result)
+        self.assertEqual(2, metrics.packets_read)
+        self.assertEqual(1, metrics.attachments_read)
+        self.assertEqual(1, metrics.crc_failures)
+        self.assertEqual(1, metrics.parse_errors)
+        self.assertEqual(4, metrics.non_subunit_bytes)
+        self.assertEqual(len(source_bytes), metrics.bytes_read)
+        self.assertThat(metrics.dispatch_time, matchers.GreaterThan(0))
+
+    def test_metrics_do_not_change_events(self):
+        source_bytes = CONSTANT_SUCCESS + CONSTANT_FILE_CONTENT
+        plain = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(BytesIO(source_bytes)).run(plain)
+        metered = doubles.StreamResult()
+        v2.ByteStreamToStreamResult(
+            BytesIO(source_bytes), metrics=v2.StreamMetrics()).run(metered)
+        self.assertEqual(plain._events, metered._events)
+
+    def test_as_dict(self):
+        metrics = v2.StreamMetrics()
+        metrics.packets_read = 3
+        as_dict = metrics.as_dict()
+        self.assertEqual(set(v2.StreamMetrics.fields), set(as_dict))
+        self.assertEqual(3, as_dict['packets_read'])
@@ -12,12 +12,15 @@
 
 import csv
 import datetime
+import random
 import sys
 import unittest
 
 import iso8601
+import testtools
 from testtools import compat
 from testtools import content
+from testtools import matchers
 from testtools.testresult import doubles
 
 import pysubunit
@@ -558,3 +561,204 @@ class TestCsvResult(base.TestCase):
         stream = compat.StringIO()
         pysubunit.test_results.CsvResult(stream)
         self.assertEqual([], self.parse_stream(stream))
+
+
+class TestResultProfiler(base.TestCase):
+
+    def make_profiler(self):
+        # A fake clock that advances one unit per reading.
+        ticks = iter(range(100000))
+        if sys.version_info >= (3, 0):
+            timer = ticks.__next__
+        else:
+            timer = ticks.next
+        return pysubunit.test_results.ResultProfiler(timer=timer)
+
+    def test_forwards_calls_and_attributes(self):
+        profiler = self.make_profiler()
+        log = doubles.ExtendedTestResult()
+        result = profiler.wrap(log)
+        result.startTest(self)
+        result.addSuccess(self)
+        result.stopTest(self)
+        result.shouldStop = True
+        self.assertTrue(log.shouldStop)
+        self.assertEqual(
+            [('startTest', self), ('addSuccess', self), ('stopTest', self)],
+            log._events)
+        self.assertEqual(['ExtendedTestResult'], profiler.layers)
+        self.assertEqual(1, profiler.calls[
+            ('ExtendedTestResult', 'addSuccess')][0])
+
+    def test_own_time_excludes_wrapped_callees(self):
+        profiler = self.make_profiler()
+        inner = profiler.wrap(doubles.ExtendedTestResult(), 'inner')
+        outer = profiler.wrap(
+            pysubunit.test_results.TestResultDecorator(inner), 'outer')
+        outer.startTestRun()
+        # outer: start=0, inner: start=1, end=2, outer: end=3
+        self.assertEqual([1, 3, 2], profiler.calls[('outer', 'startTestRun')])
+        self.assertEqual([1, 1, 1], profiler.calls[('inner', 'startTestRun')])
+
+    def test_repeated_names_are_numbered(self):
+        profiler = self.make_profiler()
+        profiler.wrap(doubles.ExtendedTestResult())
+        profiler.wrap(doubles.ExtendedTestResult())
+        self.assertEqual(
+            ['ExtendedTestResult', 'ExtendedTestResult#2'], profiler.layers)
+
+    def test_filter_layers_are_profiled(self):
+        profiler = self.make_profiler()
+        log = doubles.ExtendedTestResult()
+        result = pysubunit.test_results.TestResultFilter(
+            log, filter_success=False, profiler=profiler)
+        result.startTest(self)
+        result.addSuccess(self)
+        result.stopTest(self)
+        self.assertEqual(
+            [('startTest', self), ('addSuccess', self), ('stopTest', self)],
+            log._events)
+        self.assertEqual(
+            ['ExtendedToOriginalDecorator', 'TagCollapsingDecorator',
+             'TimeCollapsingDecorator', '_PredicateFilter'],
+            profiler.layers)
+
+    def test_report(self):
+        profiler = self.make_profiler()
+        result = profiler.wrap(doubles.ExtendedTestResult(), 'log')
+        result.startTestRun()
+        stream = compat.StringIO()
+        profiler.report(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual('log: 1.000000s own (100.0%)', lines[0])
+        self.assertEqual(
+            ['startTestRun', '1', '1.000000', '1.000000'], lines[2].split())
+
+
+class TestStreamIdPrintingResult(base.TestCase):
+
+    def make_result(self, **kwargs):
+        self.output = compat.BytesIO()
+        result = pysubunit.test_results.StreamIdPrintingResult(
+            self.output, **kwargs)
+        result.startTestRun()
+        return result
+
+    def at(self, seconds):
+        return datetime.datetime(2013, 2, 1, tzinfo=iso8601.UTC) + (
+            datetime.timedelta(seconds=seconds))
+
+    def test_lists_finished_and_unfinished_tests(self):
+        result = self.make_result()
+        result.status(test_id='a', test_status='inprogress')
+        result.status(test_id='b', test_status='inprogress')
+        result.status(test_id='a', test_status='success')
+        result.status(test_id='c', test_status='exists')
+        result.stopTestRun()
+        self.assertEqual(b'a\nb\n', self.output.getvalue())
+        self.assertEqual({'success': 1, 'inprogress': 1, 'exists': 1},
+                         dict(result.statuses))
+        self.assertFalse(result.wasSuccessful())
+
+    def test_show_exists_and_times(self):
+        result = self.make_result(show_times=True, show_exists=True)
+        result.status(test_id='a', test_status='inprogress',
+                      timestamp=self.at(1))
+        # Timed from the last interim event, as TestIdPrintingResult does.
+        result.status(test_id='a', file_name='log', file_bytes=b'x',
+                      timestamp=self.at(2))
+        # Only the events of tests move the clock.
+        result.status(file_name='stdout', file_bytes=b'', timestamp=self.at(9))
+        result.status(test_id='a', test_status='success',
+                      timestamp=self.at(3.5))
+        result.status(test_id='b', test_status='success')
+        result.status(test_id='c', test_status='exists')
+        result.stopTestRun()
+        self.assertEqual(b'a 1.500\nb 0.000\nc 0.000\n',
+                         self.output.getvalue())
+
+    def test_passthrough_keeps_order(self):
+        result = self.make_result(passthrough=True)
+        result.status(file_name='stdout', file_bytes=b'one\n')
+        result.status(test_id='a', test_status='success')
+        result.status(file_name='stdout', file_bytes=b'two\n')
+        result.stopTestRun()
+        self.assertEqual(b'one\na\ntwo\n', self.output.getvalue())
+
+    def test_buffers_writes(self):
+        result = self.make_result(buffer_size=6)
+        result.status(test_id='a', test_status='success')
+        result.status(test_id='b', test_status='success')
+        self.assertEqual(b'', self.output.getvalue())
+        result.status(test_id='c', test_status='success')
+        self.assertEqual(b'a\nb\nc\n', self.output.getvalue())
+        result.status(test_id='d', test_status='success')
+        result.stopTestRun()
+        self.assertEqual(b'a\nb\nc\nd\n', self.output.getvalue())
+
+    def test_only_unfinished_tests_are_kept(self):
+        result = self.make_result()
+        for i in range(100):
+            result.status(test_id='t%d' % i, test_status='inprogress')
+            result.status(test_id='t%d' % i, test_status='fail')
+        self.assertEqual({}, result._running)
+        self.assertEqual(100, result.failed_tests)
+
+    def test_same_success_as_stream_summary(self):
+        rng = random.Random(0)
+        statuses = [None, 'inprogress', 'exists', 'success', 'fail', 'skip',
+                    'xfail', 'uxsuccess']
+        for _ in range(200):
+            result = self.make_result()
+            summary = testtools.StreamSummary()
+            summary.startTestRun()
+            for _ in range(rng.randint(0, 6)):
+                kwargs = dict(
+                    test_id=rng.choice('ab'),
+                    route_code=rng.choice([None, '0']),
+                    test_status=rng.choice(statuses))
+                if kwargs['test_status'] is None:
+                    kwargs.update(file_name='log', file_bytes=b'x')
+                result.status(**kwargs)
+                summary.status(**kwargs)
+            result.stopTestRun()
+            summary.stopTestRun()
+            self.assertEqual(summary.wasSuccessful(), result.wasSuccessful())
+
+    def test_same_output_as_test_id_printing_result(self):
+        rng = random.Random(0)
+        statuses = [None, 'inprogress', 'exists', 'success', 'fail', 'skip']
+        compared = 0
+        for show_times in [False, True] * 100:
+            events = []
+            for i in range(rng.randint(0, 8)):
+                kwargs = dict(
+                    test_id=rng.choice(['a', 'b', None]),
+                    route_code=rng.choice([None, '0']),
+                    test_status=rng.choice(statuses),
+                    timestamp=rng.choice([None, self.at(i)]))
+                if kwargs['test_id'] is None or kwargs['test_status'] is None:
+                    kwargs.update(
+                        test_status=None, file_name='log', file_bytes=b'x')
+                events.append(kwargs)
+            old_output = compat.StringIO()
+            old = testtools.StreamResultRouter(
+                pysubunit.test_results.TestIdPrintingResult(
+                    old_output, show_times))
+            old.add_rule(testtools.StreamResult(), 'test_id', test_id=None)
+            result = self.make_result(show_times=show_times)
+            old.startTestRun()
+            try:
+                for kwargs in events:
+                    old.status(**kwargs)
+                old.stopTestRun()
+            except (AttributeError, TypeError):
+                # TestIdPrintingResult cannot time a test with no start.
+                continue
+            for kwargs in events:
+                result.status(**kwargs)
+            result.stopTestRun()
+            self.assertEqual(old_output.getvalue().encode('utf8'),
+                             self.output.getvalue())
+            compared += 1
+        self.assertThat(compared, matchers.GreaterThan(100))
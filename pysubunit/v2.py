@@ -14,11 +14,12 @@
 
 
 import codecs
-utf_8_decode = codecs.utf_8_decode
 import datetime
+import operator
 import select
 import struct
 import sys
+import timeit
 import zlib
 
 import extras
@@ -26,11 +27,15 @@ import iso8601
 
 import pysubunit
 
+utf_8_decode = codecs.utf_8_decode
 builtins = extras.try_imports(['__builtin__', 'builtins'])
 
 __all__ = [
     'ByteStreamToStreamResult',
+    'StreamMetrics',
     'StreamResultToBytes',
+    'complete_packets',
+    'encode_exists',
     ]
 
 SIGNATURE = b'\xb3'
@@ -53,6 +58,25 @@ NUL_ELEMENT = b'\0'[0]
 _nul_test_broken = {}
 _PY3 = (sys.version_info >= (3,))
 
+if _PY3:
+    _byte = operator.getitem
+
+    def _crc32(data, start, end):
+        # Release the view at once: a bytearray can not be resized while
+        # one is held.
+        with memoryview(data) as view:
+            return zlib.crc32(view[start:end]) & 0xffffffff
+else:
+    def _byte(data, pos):
+        byte = data[pos]
+        if isinstance(byte, int):
+            return byte
+        return ord(byte)
+
+    def _crc32(data, start, end):
+        return zlib.crc32(
+            builtins.buffer(data, start, end - start)) & 0xffffffff
+
 
 def has_nul(buffer_or_bytes):
     """Return True if a null byte is present in buffer_or_bytes."""
@@ -74,6 +98,128 @@ class ParseError(Exception):
     """Used to pass error messages within the parser."""
 
 
+class StreamMetrics(object):
+    """Counters and timings for subunit v2 parsing and serialisation.
+
+    A StreamMetrics can be handed to ByteStreamToStreamResult and/or
+    StreamResultToBytes (the same instance can be shared by both ends of a
+    filter) to find out where the time in a pipeline goes. Counting is only
+    done when a metrics object is supplied, so unmetered streams pay nothing.
+
+    All times are wall clock seconds as measured by ``timer``.
+
+    :ivar packets_read: Packets successfully parsed.
+    :ivar bytes_read: Bytes read from the source, subunit or not.
+    :ivar crc_failures: Packets discarded because of a bad checksum.
+    :ivar parse_errors: Packets that could not be parsed (including CRC
+        failures).
+    :ivar attachments_read: Parsed packets carrying file content.
+    :ivar non_subunit_bytes: Bytes of non-subunit content encapsulated by the
+        parser.
+    :ivar read_time: Time spent blocked reading the source.
+    :ivar decode_time: Time spent decoding packets, excluding reads and
+        dispatch.
+    :ivar dispatch_time: Time spent in the result the parser reports to.
+    :ivar packets_written: Packets serialised.
+    :ivar bytes_written: Bytes written to the output stream.
+    :ivar attachments_written: Serialised packets carrying file content.
+    :ivar encode_time: Time spent encoding packets, excluding writes.
+    :ivar write_time: Time spent writing (and flushing) the output stream.
+    """
+
+    fields = (
+        'packets_read',
+        'bytes_read',
+        'crc_failures',
+        'parse_errors',
+        'attachments_read',
+        'non_subunit_bytes',
+        'read_time',
+        'decode_time',
+        'dispatch_time',
+        'packets_written',
+        'bytes_written',
+        'attachments_written',
+        'encode_time',
+        'write_time',
+        )
+
+    def __init__(self, timer=None):
+        """Create a StreamMetrics with all counters at zero.
+
+        :param timer: A callable returning the current time in seconds.
+            Defaults to timeit.default_timer.
+        """
+        self.timer = timer or timeit.default_timer
+        for field in self.fields:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        """Return the counters as a dict suitable for json.dump."""
+        return dict((field, getattr(self, field)) for field in self.fields)
+
+
+class _MeteredSource(object):
+    """Wrap a readable byte stream, accounting reads to a StreamMetrics."""
+
+    def __init__(self, source, metrics):
+        self._source = source
+        self._metrics = metrics
+
+    def read(self, count=-1):
+        metrics = self._metrics
+        start = metrics.timer()
+        content = self._source.read(count)
+        metrics.read_time += metrics.timer() - start
+        metrics.bytes_read += len(content)
+        return content
+
+    def __getattr__(self, name):
+        return getattr(self._source, name)
+
+
+class _MeteredOutput(object):
+    """Wrap a writable byte stream, accounting writes to a StreamMetrics."""
+
+    def __init__(self, output, metrics):
+        self._output = output
+        self._metrics = metrics
+
+    def write(self, data):
+        metrics = self._metrics
+        start = metrics.timer()
+        written = self._output.write(data)
+        metrics.write_time += metrics.timer() - start
+        if written is None:
+            metrics.bytes_written += len(data)
+        else:
+            metrics.bytes_written += written
+        return written
+
+    def flush(self):
+        metrics = self._metrics
+        start = metrics.timer()
+        self._output.flush()
+        metrics.write_time += metrics.timer() - start
+
+    def __getattr__(self, name):
+        return getattr(self._output, name)
+
+
+class _MeteredResult(object):
+    """Wrap a StreamResult, accounting status calls to a StreamMetrics."""
+
+    def __init__(self, result, metrics):
+        self._result = result
+        self._metrics = metrics
+
+    def status(self, **kwargs):
+        metrics = self._metrics
+        start = metrics.timer()
+        self._result.status(**kwargs)
+        metrics.dispatch_time += metrics.timer() - start
+
+
 class StreamResultToBytes(object):
     """Convert StreamResult API calls to bytes.
 
@@ -93,15 +239,20 @@ class StreamResultToBytes(object):
 
     zero_b = b'\0'[0]
 
-    def __init__(self, output_stream):
+    def __init__(self, output_stream, metrics=None):
         """Create a StreamResultToBytes with output written to output_stream.
 
         :param output_stream: A file-like object. Must support write(bytes)
             and flush() methods. Flush will be called after each write.
             The stream will be passed through subunit.make_stream_binary,
             to handle regular cases such as stdout.
+        :param metrics: An optional StreamMetrics to account packets written
+            and time spent encoding and writing them.
         """
         self.output_stream = pysubunit.make_stream_binary(output_stream)
+        self.metrics = metrics
+        if metrics is not None:
+            self.output_stream = _MeteredOutput(self.output_stream, metrics)
 
     def startTestRun(self):
         pass
@@ -111,12 +262,32 @@ class StreamResultToBytes(object):
 
     def status(self, test_id=None, test_status=None, test_tags=None,
                runnable=True, file_name=None, file_bytes=None, eof=False,
-               mime_type=None, route_code=None, timestamp=None):
-        self._write_packet(test_id=test_id, test_status=test_status,
-                           test_tags=test_tags, runnable=runnable,
-                           file_name=file_name, file_bytes=file_bytes,
-                           eof=eof, mime_type=mime_type,
-                           route_code=route_code, timestamp=timestamp)
+               mime_type=None, route_code=None, timestamp=None,
+               packet_bytes=None):
+        """Write a packet for an event.
+
+        :param packet_bytes: If not None, the packet the event was parsed
+            from (see ByteStreamToStreamResult), which is written out as it
+            is rather than encoding the event again.
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.timer()
+            write_time = metrics.write_time
+        if packet_bytes is not None:
+            self._write(packet_bytes)
+        else:
+            self._write_packet(
+                test_id=test_id, test_status=test_status,
+                test_tags=test_tags, runnable=runnable, file_name=file_name,
+                file_bytes=file_bytes, eof=eof, mime_type=mime_type,
+                route_code=route_code, timestamp=timestamp)
+        if metrics is not None:
+            metrics.packets_written += 1
+            if file_name is not None:
+                metrics.attachments_written += 1
+            metrics.encode_time += (metrics.timer() - start -
+                                    (metrics.write_time - write_time))
 
     def _write_utf8(self, a_string, packet):
         utf8 = a_string.encode('utf-8')
@@ -131,21 +302,7 @@ class StreamResultToBytes(object):
         packet.extend(self._encode_number(value))
 
     def _encode_number(self, value):
-        assert value >= 0
-        if value < 64:
-            return [struct.pack(FMT_8, value)]
-        elif value < 16384:
-            value = value | 0x4000
-            return [struct.pack(FMT_16, value)]
-        elif value < 4194304:
-            value = value | 0x800000
-            return [struct.pack(FMT_16, value >> 8),
-                    struct.pack(FMT_8, value & 0xff)]
-        elif value < 1073741824:
-            value = value | 0xc0000000
-            return [struct.pack(FMT_32, value)]
-        else:
-            raise ValueError('value too large to encode: %r' % (value,))
+        return _encode_number(value)
 
     def _write_packet(self, test_id=None, test_status=None, test_tags=None,
                       runnable=True, file_name=None, file_bytes=None,
@@ -212,7 +369,10 @@ class StreamResultToBytes(object):
         # or two writes (that python might then split).
         # For now, simplest code: join, crc32, join, output
         content = b''.join(packet)
-        data = content + struct.pack(FMT_32, zlib.crc32(content) & 0xffffffff)
+        self._write(
+            content + struct.pack(FMT_32, zlib.crc32(content) & 0xffffffff))
+
+    def _write(self, data):
         if _PY3:
             # On eventlet 0.17.3, GreenIO.write() can make partial write.
             # Use a loop to ensure that all bytes are written.
@@ -225,10 +385,275 @@ class StreamResultToBytes(object):
                 written = self.output_stream.write(view[offset:])
                 offset += written
         else:
-            self.output_stream.write(data)
+            datalen = len(data)
+            offset = 0
+            while offset < datalen:
+                written = self.output_stream.write(data[offset:])
+                if written is None:
+                    # Python 2 files do not report the length written.
+                    break
+                offset += written
         self.output_stream.flush()
 
 
+def _encode_number(value):
+    assert value >= 0
+    if value < 64:
+        return [struct.pack(FMT_8, value)]
+    elif value < 16384:
+        value = value | 0x4000
+        return [struct.pack(FMT_16, value)]
+    elif value < 4194304:
+        value = value | 0x800000
+        return [struct.pack(FMT_16, value >> 8),
+                struct.pack(FMT_8, value & 0xff)]
+    elif value < 1073741824:
+        value = value | 0xc0000000
+        return [struct.pack(FMT_32, value)]
+    else:
+        raise ValueError('value too large to encode: %r' % (value,))
+
+
+_EXISTS_FLAGS = struct.pack(
+    FMT_16, 0x2000 | FLAG_TEST_ID | FLAG_RUNNABLE | 0x1)
+
+
+def encode_exists(test_ids):
+    """Encode an 'exists' packet for each of test_ids.
+
+    The bytes are the same as StreamResultToBytes writes for
+    status(test_id=test_id, test_status='exists'), but without the per
+    packet work that status() has to do for the general case.
+
+    :return: The packets, joined.
+    """
+    packets = []
+    for test_id in test_ids:
+        utf8 = test_id.encode('utf-8')
+        body = _encode_number(len(utf8))
+        body.append(utf8)
+        packets.append(_frame(_EXISTS_FLAGS, b''.join(body)))
+    return b''.join(packets)
+
+
+def _frame(flag_bytes, body):
+    """Add the signature, length and CRC around a packet body."""
+    # Signature, flags and CRC, plus the body.
+    base_length = len(body) + 7
+    if base_length <= 62:
+        length = base_length + 1
+    elif base_length <= 16381:
+        length = base_length + 2
+    elif base_length <= 4194300:
+        length = base_length + 3
+    else:
+        raise ValueError("Length too long: %r" % base_length)
+    packet = [SIGNATURE, flag_bytes]
+    packet.extend(_encode_number(length))
+    packet.append(body)
+    content = b''.join(packet)
+    return content + struct.pack(FMT_32, zlib.crc32(content) & 0xffffffff)
+
+
+def _read_varint(data, pos):
+    """Decode the number at data[pos]; return it and the following pos."""
+    first = _byte(data, pos)
+    kind = first & 0xc0
+    if kind == 0x00:
+        return first, pos + 1
+    elif kind == 0x40:
+        return (first & 0x3f) << 8 | _byte(data, pos + 1), pos + 2
+    elif kind == 0x80:
+        return ((first & 0x3f) << 16 | _byte(data, pos + 1) << 8 |
+                _byte(data, pos + 2)), pos + 3
+    return ((first & 0x3f) << 24 | _byte(data, pos + 1) << 16 |
+            _byte(data, pos + 2) << 8 | _byte(data, pos + 3)), pos + 4
+
+
+def _utf8_lead(data, start, pos):
+    """Find the UTF-8 character that data[pos] would be part of.
+
+    :return: The index of the character's first byte, if it starts in
+        data[start:pos] and is not complete before pos, otherwise -1.
+    """
+    lead = pos - 1
+    while (lead >= start and pos - lead < 4 and
+           _byte(data, lead) & 0xc0 == 0x80):
+        lead -= 1
+    if lead < start:
+        return -1
+    byte = _byte(data, lead)
+    if 0xc0 <= byte < 0xe0:
+        length = 2
+    elif 0xe0 <= byte < 0xf0:
+        length = 3
+    elif 0xf0 <= byte < 0xf8:
+        length = 4
+    else:
+        return -1
+    if length > pos - lead:
+        return lead
+    return -1
+
+
+# The kinds of the pieces _raw_packets splits a stream into.
+_PACKET = 'packet'
+_DAMAGED = 'damaged'
+_NON_SUBUNIT = 'non-subunit'
+
+
+def _next_piece(data, pos, eof=False):
+    """Frame the piece of a stream that starts at data[pos].
+
+    :param eof: True if no more bytes will follow data.
+    :return: (kind, end) for the piece data[pos:end]; see _raw_packets for
+        the kinds. Unless eof is True, (None, end) if the piece cannot be
+        framed until data has end bytes.
+    """
+    if data.startswith(SIGNATURE, pos):
+        if len(data) - pos < 6:
+            if not eof:
+                return None, pos + 6
+            return _DAMAGED, len(data)
+        if _byte(data, pos + 3) & 0xc0 == 0xc0:
+            # A four byte length, which the parser rejects.
+            return _DAMAGED, pos + 6
+        length = max(6, _read_varint(data, pos + 3)[0])
+        end = pos + length
+        if len(data) < end:
+            if not eof:
+                return None, end
+            return _DAMAGED, len(data)
+        if length >= 8 and _crc32(data, pos, end - 4) == struct.unpack_from(
+                FMT_32, data, end - 4)[0]:
+            return _PACKET, end
+        return _DAMAGED, end
+    end = data.find(SIGNATURE, pos)
+    while end != -1 and _utf8_lead(data, pos, end) != -1:
+        end = data.find(SIGNATURE, end + 1)
+    if end == -1:
+        end = len(data)
+        lead = _utf8_lead(data, pos, end)
+        if lead != -1 and not eof:
+            # Keep a character split across reads together.
+            if lead == pos:
+                return None, end + 1
+            end = lead
+    return _NON_SUBUNIT, end
+
+
+def complete_packets(data):
+    """Return how much of data is whole packets and non-subunit content.
+
+    What is left is a torn packet, or a torn UTF-8 character in which a
+    signature byte does not start a packet, and needs more bytes before it
+    can be passed on. This is how the output of several processes is
+    interleaved into one stream without tearing packets.
+    """
+    pos = 0
+    while pos < len(data):
+        kind, end = _next_piece(data, pos)
+        if kind is None:
+            break
+        pos = end
+    return pos
+
+
+def _raw_packets(source, block_size=65536):
+    """Split a byte stream into packets without decoding them.
+
+    Yields (kind, data, start, end) for each piece of the stream, which is
+    data[start:end]:
+
+    * _PACKET: a packet whose CRC is good.
+    * _DAMAGED: the bytes ByteStreamToStreamResult reads while failing to
+      parse a packet. Parse them with it to report the error.
+    * _NON_SUBUNIT: bytes outside any packet. As in ByteStreamToStreamResult,
+      a signature byte inside a UTF-8 character does not start a packet.
+
+    data is only valid until the next piece is asked for.
+    """
+    source = pysubunit.make_stream_binary(source)
+    read = getattr(source, 'read1', source.read)
+    data = b''
+    pos = 0
+    eof = False
+    while True:
+        if pos == len(data):
+            if eof:
+                return
+            data = read(block_size)
+            pos = 0
+            if not data:
+                return
+        kind, end = _next_piece(data, pos, eof)
+        if kind is None:
+            # Read until data holds the whole piece, or the stream ends.
+            data, end, pos = data[pos:], end - pos, 0
+            while len(data) < end:
+                more = source.read(end - len(data))
+                if not more:
+                    eof = True
+                    break
+                data += more
+            continue
+        yield kind, data, pos, end
+        pos = end
+
+
+def _retag_packet(data, start, end, new_tags, gone_tags):
+    """Add and remove tags on a packet, without decoding all of it.
+
+    :param data: Bytes holding a packet with a good CRC at data[start:end].
+    :param new_tags: A set of UTF-8 encoded tags to add.
+    :param gone_tags: A set of UTF-8 encoded tags to remove. These win over
+        new_tags.
+    :return: None if the packet's tags are already right, otherwise the
+        bytes of the packet with the tags changed.
+    :raises ParseError: If the packet's fields do not fit in it.
+    """
+    flags = struct.unpack_from(FMT_16, data, start + 1)[0]
+    pos = _read_varint(data, start + 3)[1]
+    limit = end - 4
+    try:
+        if flags & FLAG_TIMESTAMP:
+            pos = _read_varint(data, pos + 4)[1]
+        if flags & FLAG_TEST_ID:
+            length, pos = _read_varint(data, pos)
+            pos += length
+        tags_start = pos
+        tags = []
+        if flags & FLAG_TAGS:
+            count, pos = _read_varint(data, pos)
+            for _ in range(count):
+                length, pos = _read_varint(data, pos)
+                tags.append(data[pos:pos + length])
+                pos += length
+    except IndexError:
+        pos = end
+    if pos > limit:
+        raise ParseError('Packet fields extend past the end of the packet')
+    current = set(tags)
+    added = new_tags - current - gone_tags
+    if not added and not gone_tags & current:
+        return None
+    tags = [tag for tag in tags if tag not in gone_tags]
+    tags.extend(sorted(added))
+    section = []
+    if tags:
+        flags |= FLAG_TAGS
+        section.extend(_encode_number(len(tags)))
+        for tag in tags:
+            section.extend(_encode_number(len(tag)))
+            section.append(tag)
+    else:
+        flags &= ~FLAG_TAGS
+    body_start = _read_varint(data, start + 3)[1]
+    body = b''.join(
+        [data[body_start:tags_start]] + section + [data[pos:limit]])
+    return _frame(struct.pack(FMT_16, flags), body)
+
+
 class ByteStreamToStreamResult(object):
     """Parse a subunit byte stream.
 
@@ -257,7 +682,8 @@ class ByteStreamToStreamResult(object):
         0x7: 'xfail',
         }
 
-    def __init__(self, source, non_subunit_name=None):
+    def __init__(self, source, non_subunit_name=None, metrics=None,
+                 packet_bytes=False):
         """Create a ByteStreamToStreamResult.
 
         :param source: A file like object to read bytes from. Must support
@@ -267,9 +693,23 @@ class ByteStreamToStreamResult(object):
         :param non_subunit_name: If set to non-None, non subunit content
             encountered in the stream will be converted into file packets
             labelled with this name.
+        :param metrics: An optional StreamMetrics to account packets read
+            and time spent reading, decoding and dispatching them.
+        :param packet_bytes: If True, every status() call is also passed
+            packet_bytes: the bytes of the packet the event was parsed from,
+            or None for the events made up for non-subunit content and
+            parse errors. The result must accept that argument.
         """
         self.non_subunit_name = non_subunit_name
+        if packet_bytes:
+            self._made_up = {'packet_bytes': None}
+        else:
+            self._made_up = {}
+        self.packet_bytes = packet_bytes
         self.source = pysubunit.make_stream_binary(source)
+        self.metrics = metrics
+        if metrics is not None:
+            self.source = _MeteredSource(self.source, metrics)
         self.codec = codecs.lookup('utf8').incrementaldecoder()
 
     def run(self, result):
@@ -277,6 +717,8 @@ class ByteStreamToStreamResult(object):
 
         This is a blocking call: it will run until EOF is detected on source.
         """
+        if self.metrics is not None:
+            result = _MeteredResult(result, self.metrics)
         self.codec.reset()
         mid_character = False
         while True:
@@ -349,27 +791,42 @@ class ByteStreamToStreamResult(object):
                 if not readable or len(buffered) >= 1048576:
                     # timeout or too much data, emit what we have.
                     break
+            file_bytes = b''.join(buffered)
+            if self.metrics is not None:
+                self.metrics.non_subunit_bytes += len(file_bytes)
             result.status(
-                file_name=self.non_subunit_name,
-                file_bytes=b''.join(buffered))
+                file_name=self.non_subunit_name, file_bytes=file_bytes,
+                **self._made_up)
             if mid_character or not len(content) or content[0] != SIGNATURE[0]:
                 continue
             # Otherwise, parse a data packet.
             self._parse_packet(result)
 
     def _parse_packet(self, result):
+        metrics = self.metrics
+        if metrics is not None:
+            start = metrics.timer()
+            excluded = metrics.read_time + metrics.dispatch_time
         try:
             packet = [SIGNATURE]
             self._parse(packet, result)
         except ParseError as error:
+            if metrics is not None:
+                metrics.parse_errors += 1
             result.status(test_id="subunit.parser", eof=True,
                           file_name="Packet data",
                           file_bytes=b''.join(packet),
-                          mime_type="application/octet-stream")
+                          mime_type="application/octet-stream",
+                          **self._made_up)
             result.status(test_id="subunit.parser", test_status='fail',
                           eof=True, file_name="Parser Error",
                           file_bytes=(error.args[0]).encode('utf8'),
-                          mime_type="text/plain;charset=utf8")
+                          mime_type="text/plain;charset=utf8",
+                          **self._made_up)
+        if metrics is not None:
+            metrics.decode_time += (
+                metrics.timer() - start -
+                (metrics.read_time + metrics.dispatch_time - excluded))
 
     def _to_bytes(self, data, pos, length):
         """Return a slice of data from pos for length as bytes."""
@@ -437,6 +894,8 @@ class ByteStreamToStreamResult(object):
             packet_crc = struct.unpack(FMT_32, packet[-1][-4:])[0]
             if crc != packet_crc:
                 # Bad CRC, report it and stop parsing the packet.
+                if self.metrics is not None:
+                    self.metrics.crc_failures += 1
                 raise ParseError(
                     'Bad checksum - calculated (0x%x), stored (0x%x)' % (
                         crc, packet_crc))
@@ -495,12 +954,21 @@ class ByteStreamToStreamResult(object):
             runnable = bool(flags & FLAG_RUNNABLE)
             eof = bool(flags & FLAG_EOF)
             test_status = self.status_lookup[flags & 0x0007]
+            if self.metrics is not None:
+                self.metrics.packets_read += 1
+                if file_name is not None:
+                    self.metrics.attachments_read += 1
+            if self.packet_bytes:
+                extra = {'packet_bytes': b''.join(packet)}
+            else:
+                extra = self._made_up
             result.status(test_id=test_id, test_status=test_status,
                           test_tags=test_tags, runnable=runnable,
                           mime_type=mime_type,
                           eof=eof, file_name=file_name,
                           file_bytes=file_bytes,
-                          route_code=route_code, timestamp=timestamp)
+                          route_code=route_code, timestamp=timestamp,
+                          **extra)
     __call__ = run
 
     def _read_utf8(self, buf, pos):
@@ -0,0 +1,546 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro benchmarks for the hot paths in pysubunit.
+
+Run all scenarios, or just the named ones::
+
+  $ python tools/benchmark.py
+  $ python tools/benchmark.py v1-stdout-noise
+
+Each scenario builds its input once and then reports the best of several
+timed runs.
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import tempfile
+import timeit
+import unittest
+
+import testtools
+from testtools.compat import _b
+
+import pysubunit
+from pysubunit import chunked
+from pysubunit import pool
+from pysubunit import run as run_module
+from pysubunit import test_results
+from pysubunit import v2
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a scenario; the function returns a callable to time."""
+    def register(function):
+        SCENARIOS[name] = function
+        return function
+    return register
+
+
+@scenario('v1-stdout-noise')
+def v1_stdout_noise(tests=2000, noise=20):
+    """Parse a v1 stream where most lines are test stdout."""
+    lines = []
+    for i in range(tests):
+        lines.append(b'time: 2013-02-01 12:00:00.000000Z\n')
+        lines.append(('test: test_%d\n' % i).encode('ascii'))
+        for n in range(noise):
+            lines.append(('some output %d from the test\n' % n).encode(
+                'ascii'))
+        lines.append(b'DEBUG: this looks a bit like a directive\n')
+        lines.append(b'time: 2013-02-01 12:00:01.000000Z\n')
+        lines.append(('success: test_%d\n' % i).encode('ascii'))
+    source = b''.join(lines)
+
+    def run():
+        server = pysubunit.TestProtocolServer(
+            testtools.TestResult(), stream=io.BytesIO())
+        server.readFrom(io.BytesIO(source))
+    return run
+
+
+@scenario('v1-time')
+def v1_time(events=20000):
+    """Parse a v1 stream made up of time: lines."""
+    lines = []
+    for i in range(events):
+        # Every other line repeats the previous stamp.
+        lines.append(('time: 2013-02-01 12:%02d:%02d.%06dZ\n' % (
+            i // 3600 % 60, i // 60 % 60, i // 2)).encode('ascii'))
+    source = b''.join(lines)
+
+    def run():
+        server = pysubunit.TestProtocolServer(
+            testtools.TestResult(), stream=io.BytesIO())
+        server.readFrom(io.BytesIO(source))
+    return run
+
+
+empty = _b('')
+
+
+class LegacyDecoder(object):
+    """chunked.Decoder as of 1.2.0, for comparison."""
+
+    def __init__(self, output, strict=True):
+        self.output = output
+        self.buffered_bytes = []
+        self.state = self._read_length
+        self.body_length = 0
+        self.strict = strict
+        self._match_chars = _b("0123456789abcdefABCDEF\r\n")
+        self._slash_n = _b('\n')
+        self._slash_r = _b('\r')
+        self._slash_rn = _b('\r\n')
+        self._slash_nr = _b('\n\r')
+
+    def close(self):
+        """Close the decoder.
+
+        :raises ValueError: If the stream is incomplete ValueError is raised.
+        """
+        if self.state != self._finished:
+            raise ValueError("incomplete stream")
+
+    def _finished(self):
+        """Finished reading, return any remaining bytes."""
+        if self.buffered_bytes:
+            buffered_bytes = self.buffered_bytes
+            self.buffered_bytes = []
+            return empty.join(buffered_bytes)
+        else:
+            raise ValueError("stream is finished")
+
+    def _read_body(self):
+        """Pass body bytes to the output."""
+        while self.body_length and self.buffered_bytes:
+            if self.body_length >= len(self.buffered_bytes[0]):
+                self.output.write(self.buffered_bytes[0])
+                self.body_length -= len(self.buffered_bytes[0])
+                del self.buffered_bytes[0]
+                # No more data available.
+                if not self.body_length:
+                    self.state = self._read_length
+            else:
+                self.output.write(self.buffered_bytes[0][:self.body_length])
+                self.buffered_bytes[0] = \
+                    self.buffered_bytes[0][self.body_length:]
+                self.body_length = 0
+                self.state = self._read_length
+                return self.state()
+
+    def _read_length(self):
+        """Try to decode a length from the bytes."""
+        count_chars = []
+        for bytes in self.buffered_bytes:
+            for pos in range(len(bytes)):
+                byte = bytes[pos:pos + 1]
+                if byte not in self._match_chars:
+                    break
+                count_chars.append(byte)
+                if byte == self._slash_n:
+                    break
+        if not count_chars:
+            return
+        if count_chars[-1] != self._slash_n:
+            return
+        count_str = empty.join(count_chars)
+        if self.strict:
+            if count_str[-2:] != self._slash_rn:
+                raise ValueError("chunk header invalid: %r" % count_str)
+            if self._slash_r in count_str[:-2]:
+                raise ValueError("too many CRs in chunk header %r" % count_str)
+        self.body_length = int(count_str.rstrip(self._slash_nr), 16)
+        excess_bytes = len(count_str)
+        while excess_bytes:
+            if excess_bytes >= len(self.buffered_bytes[0]):
+                excess_bytes -= len(self.buffered_bytes[0])
+                del self.buffered_bytes[0]
+            else:
+                self.buffered_bytes[0] = self.buffered_bytes[0][excess_bytes:]
+                excess_bytes = 0
+        if not self.body_length:
+            self.state = self._finished
+            if not self.buffered_bytes:
+                # May not call into self._finished with no buffered data.
+                return empty
+        else:
+            self.state = self._read_body
+        return self.state()
+
+    def write(self, bytes):
+        """Decode bytes to the output stream.
+
+        :raises ValueError: If the stream has already seen the end of file
+            marker.
+        :returns: None, or the excess bytes beyond the end of file marker.
+        """
+        if bytes:
+            self.buffered_bytes.append(bytes)
+        return self.state()
+
+
+def _chunked(size=8 * 1024 * 1024, chunk_size=65536):
+    """Chunk encode size bytes of log output in chunk_size chunks."""
+    body = _b('DEBUG some.module: a line of log output\n') * (size // 40)
+    encoded = []
+    for start in range(0, len(body), chunk_size):
+        chunk = body[start:start + chunk_size]
+        encoded.append(_b('%X\r\n' % len(chunk)) + chunk)
+    encoded.append(_b('0\r\n'))
+    return empty.join(encoded)
+
+
+def _decode(decoder_class, writes):
+    def run():
+        decoder = decoder_class(io.BytesIO())
+        for data in writes:
+            decoder.write(data)
+        decoder.close()
+    return run
+
+
+def _blocks(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+@scenario('chunked-decode-lines')
+def chunked_decode_lines():
+    """Decode a large attachment fed a line at a time, as v1 does."""
+    return _decode(chunked.Decoder, _chunked().splitlines(True))
+
+
+@scenario('chunked-decode-lines-legacy')
+def chunked_decode_lines_legacy():
+    """chunked-decode-lines with the 1.2.0 decoder."""
+    return _decode(LegacyDecoder, _chunked().splitlines(True))
+
+
+@scenario('chunked-decode-blocks')
+def chunked_decode_blocks():
+    """Decode small chunks fed in 64KiB blocks."""
+    return _decode(
+        chunked.Decoder, _blocks(_chunked(chunk_size=1000), 65536))
+
+
+@scenario('chunked-decode-blocks-legacy')
+def chunked_decode_blocks_legacy():
+    """chunked-decode-blocks with the 1.2.0 decoder."""
+    return _decode(LegacyDecoder, _blocks(_chunked(chunk_size=1000), 65536))
+
+
+class _Trivial(unittest.TestCase):
+
+    def test_nothing(self):
+        pass
+
+
+def _isolated(protocol_version, tests=10000):
+    suite = pysubunit.IsolatedTestSuite(
+        [_Trivial('test_nothing') for i in range(tests)])
+    suite.protocol_version = protocol_version
+
+    def run():
+        suite.run(unittest.TestResult())
+    return run
+
+
+@scenario('isolated-v1')
+def isolated_v1():
+    """Report 10k trivial tests from an IsolatedTestSuite child over v1."""
+    return _isolated(1)
+
+
+@scenario('isolated-v2')
+def isolated_v2():
+    """isolated-v1 with the child reporting over v2."""
+    return _isolated(2)
+
+
+class _IsolatedTrivial(pysubunit.IsolatedTestCase):
+
+    def test_nothing(self):
+        pass
+
+
+@scenario('isolated-cases')
+def isolated_cases(tests=1000):
+    """Run 1000 IsolatedTestCases, forking once per case."""
+    def run():
+        # Suites drop their tests as they run them.
+        suite = unittest.TestSuite(
+            [_IsolatedTrivial('test_nothing') for i in range(tests)])
+        suite.run(unittest.TestResult())
+    return run
+
+
+@scenario('isolated-cases-pool')
+def isolated_cases_pool(tests=1000):
+    """isolated-cases in an IsolatedWorkerPool of two workers."""
+    def run():
+        suite = pool.PooledTestSuite(
+            [_IsolatedTrivial('test_nothing') for i in range(tests)])
+        suite.pool_size = 2
+        suite.run(unittest.TestResult())
+    return run
+
+
+def _tag_source(tests=20000):
+    source = io.BytesIO()
+    stream = v2.StreamResultToBytes(source)
+    for i in range(tests):
+        test_id = 'pkg.tests.test_mod.TestThing.test_%d' % i
+        stream.status(
+            test_id=test_id, test_status='inprogress', test_tags=set(['a']))
+        stream.status(
+            test_id=test_id, test_status='success', test_tags=set(['a']),
+            file_name='log', file_bytes=b'x' * 1000, eof=True)
+    return source.getvalue()
+
+
+def _tag(tag_stream, tags):
+    source = _tag_source()
+
+    def run():
+        tag_stream(io.BytesIO(source), io.BytesIO(), tags)
+    return run
+
+
+def _legacy_tag_stream(original, filtered, tags):
+    # tag_stream as of 1.2.0, which decodes and encodes every packet.
+    new_tags, gone_tags = pysubunit.tags_to_new_gone(tags)
+    output = v2.StreamResultToBytes(filtered)
+    v2.ByteStreamToStreamResult(
+        original, non_subunit_name='stdout').run(
+        pysubunit._Tagger(output, new_tags, gone_tags))
+
+
+@scenario('tags-noop')
+def tags_noop():
+    """Retag 20k tests with a tag they already have."""
+    return _tag(pysubunit.tag_stream, ['a'])
+
+
+@scenario('tags-noop-legacy')
+def tags_noop_legacy():
+    """tags-noop with the 1.2.0 tag_stream."""
+    return _tag(_legacy_tag_stream, ['a'])
+
+
+@scenario('tags-add')
+def tags_add():
+    """Add a tag to 20k tests."""
+    return _tag(pysubunit.tag_stream, ['b'])
+
+
+@scenario('tags-add-legacy')
+def tags_add_legacy():
+    """tags-add with the 1.2.0 tag_stream."""
+    return _tag(_legacy_tag_stream, ['b'])
+
+
+def _filter(make_result, packet_bytes=True, args=('-s',)):
+    from pysubunit.commands import subunit_filter
+    source = _tag_source()
+    options = subunit_filter.make_options(None).parse_args(list(args))[0]
+    predicate = subunit_filter._make_predicate(options)
+
+    def run():
+        result = make_result(
+            subunit_filter, io.BytesIO(), options, predicate)
+        result.startTestRun()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(source), non_subunit_name='stdout',
+            packet_bytes=packet_bytes).run(result)
+        result.stopTestRun()
+    return run
+
+
+def _legacy_filter(subunit_filter, output, options, predicate):
+    # subunit-filter's result chain as of 1.2.0, which turns each test into
+    # a test object and encodes the kept ones again.
+    return testtools.StreamToExtendedDecorator(
+        test_results.TestResultFilter(
+            testtools.ExtendedToStreamDecorator(
+                v2.StreamResultToBytes(output)),
+            filter_error=options.error, filter_failure=options.failure,
+            filter_success=options.success, filter_skip=options.skip,
+            filter_xfail=options.xfail, filter_predicate=predicate))
+
+
+@scenario('filter-keep')
+def filter_keep():
+    """Pass 20k tests through subunit-filter's result chain."""
+    return _filter(lambda subunit_filter, *args: subunit_filter._make_result(
+        *args))
+
+
+@scenario('filter-keep-legacy')
+def filter_keep_legacy():
+    """filter-keep with the 1.2.0 result chain."""
+    return _filter(_legacy_filter, packet_bytes=False)
+
+
+@scenario('filter-with')
+def filter_with():
+    """Select a tenth of 20k tests with --with."""
+    return _filter(lambda subunit_filter, *args: subunit_filter._make_result(
+        *args), args=['-s', '--with', r'test_\d*7(?!\d)'])
+
+
+@scenario('filter-with-id')
+def filter_with_id():
+    """filter-with, using --with-id."""
+    return _filter(lambda subunit_filter, *args: subunit_filter._make_result(
+        *args), args=['-s', '--with-id', r'test_\d*7(?!\d)'])
+
+
+def _include_list(tests=50000):
+    # A quarter of _tag_source's tests, among 45k ids that are not in it.
+    ids = ['pkg.tests.test_mod.TestThing.test_%d' % i
+           for i in range(0, tests * 2, 4)]
+    ids.extend('pkg.tests.test_other.TestThing.test_%d' % i
+               for i in range(tests // 2))
+    return ids
+
+
+@scenario('filter-include-list')
+def filter_include_list():
+    """Select tests from 20k with a 50k entry --include-list."""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'include')
+    with open(path, 'w') as include_file:
+        include_file.write('\n'.join(_include_list()) + '\n')
+    return _filter(lambda subunit_filter, *args: subunit_filter._make_result(
+        *args), args=['-s', '--include-list', path])
+
+
+@scenario('filter-include-list-legacy')
+def filter_include_list_legacy():
+    """filter-include-list, as one --with-id regexp per id."""
+    args = ['-s']
+    for test_id in _include_list():
+        args.extend(['--with-id', '^%s$' % re.escape(test_id)])
+    return _filter(lambda subunit_filter, *args: subunit_filter._make_result(
+        *args), args=args)
+
+
+def _stats(make_result):
+    source = _tag_source()
+
+    def run():
+        result = make_result(io.StringIO())
+        result.startTestRun()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(source), non_subunit_name='stdout').run(result)
+        result.stopTestRun()
+    return run
+
+
+@scenario('stats')
+def stats():
+    """Gather the statistics of 20k tests, as subunit-stats does."""
+    from pysubunit import stats as stats_module
+    return _stats(stats_module.StreamResultStats)
+
+
+@scenario('stats-legacy')
+def stats_legacy():
+    """stats, with TestResultStats as subunit-stats 1.2.0 used."""
+    return _stats(lambda stream: testtools.StreamToExtendedDecorator(
+        pysubunit.TestResultStats(stream)))
+
+
+def _ls_source(tests=20000):
+    source = io.BytesIO()
+    stream = v2.StreamResultToBytes(source)
+    for i in range(tests):
+        test_id = 'pkg.tests.test_mod.TestThing.test_%d' % i
+        stream.status(test_id=test_id, test_status='inprogress')
+        stream.status(
+            test_id=test_id, test_status='fail' if i % 2 else 'success',
+            file_name='traceback', file_bytes=b'x' * 1000, eof=True)
+    return source.getvalue()
+
+
+def _ls(make_result):
+    source = _ls_source()
+
+    def run():
+        result = make_result(io.BytesIO())
+        result.startTestRun()
+        v2.ByteStreamToStreamResult(
+            io.BytesIO(source), non_subunit_name='stdout').run(result)
+        result.stopTestRun()
+    return run
+
+
+@scenario('ls')
+def ls():
+    """List 20k tests, half of them failing, as subunit-ls does."""
+    return _ls(lambda output: test_results.StreamIdPrintingResult(
+        output, passthrough=True))
+
+
+@scenario('ls-legacy')
+def ls_legacy():
+    """ls, with the TestIdPrintingResult and StreamSummary of 1.2.0."""
+    def make_result(output):
+        printer = testtools.StreamResultRouter(
+            test_results.TestIdPrintingResult(
+                io.TextIOWrapper(output, write_through=True)))
+        printer.add_rule(
+            test_results.CatFiles(output), 'test_id', test_id=None)
+        return testtools.CopyStreamResult(
+            [printer, testtools.StreamSummary()])
+    return _ls(make_result)
+
+
+@scenario('run-list')
+def run_list(tests=200000):
+    """List 200k tests with pysubunit.run, as --list does."""
+    suite = unittest.TestSuite(
+        [testtools.PlaceHolder('pkg.tests.test_mod%d.TestThing.test_%d' % (
+            i // 100, i)) for i in range(tests)])
+
+    def run():
+        run_module.SubunitTestRunner(stream=io.BytesIO()).list(suite)
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'scenarios', nargs='*', metavar='SCENARIO',
+        help='Scenarios to run (default: all of %s).' % ', '.join(
+            sorted(SCENARIOS)))
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='Timed runs per scenario; the best is reported.')
+    args = parser.parse_args(argv)
+    for name in args.scenarios or sorted(SCENARIOS):
+        if name not in SCENARIOS:
+            parser.error('unknown scenario %r' % name)
+        run = SCENARIOS[name]()
+        best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+        sys.stdout.write('%-30s %10.4fs\n' % (name, best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Report the import time of each subunit command.
+
+Each console script in setup.cfg has its module imported in a fresh
+interpreter under ``python -X importtime``, and the best total of several
+runs is reported along with the heaviest imports it pulled in::
+
+  $ python tools/importtime.py
+  $ python tools/importtime.py subunit-tags subunit-filter
+"""
+
+import argparse
+import configparser
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def entry_points():
+    """Return a dict of console script name to module name."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(ROOT, 'setup.cfg'))
+    scripts = {}
+    for line in config['entry_points']['console_scripts'].splitlines():
+        if '=' not in line:
+            continue
+        name, target = [part.strip() for part in line.split('=', 1)]
+        scripts[name] = target.split(':')[0]
+    return scripts
+
+
+def import_times(module):
+    """Import module in a new interpreter.
+
+    :param module: The module to import, or None to just start up.
+    :return: A dict of module name to cumulative import time in
+        microseconds, for every module that was imported, or None if the
+        import failed.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [ROOT, env.get('PYTHONPATH')]))
+    code = 'pass' if module is None else 'import ' + module
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode:
+        return None
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(argv=None):
+    scripts = entry_points()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'scripts', nargs='*', metavar='SCRIPT',
+        help='Commands to measure (default: all of %s).' % ', '.join(
+            sorted(scripts)))
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='Runs per command; the best is reported.')
+    parser.add_argument(
+        '-t', '--top', type=int, default=3,
+        help='Number of the heaviest third party imports to show.')
+    args = parser.parse_args(argv)
+    # Modules the interpreter imports before running anything.
+    startup = set(import_times(None))
+    for name in args.scripts or sorted(scripts):
+        if name not in scripts:
+            parser.error('unknown command %r' % name)
+        module = scripts[name]
+        best = None
+        for _ in range(args.repeat):
+            times = import_times(module)
+            if times is None:
+                break
+            if best is None or times[module] < best[module]:
+                best = times
+        if best is None:
+            sys.stdout.write('%-20s import failed\n' % name)
+            continue
+        heaviest = sorted(
+            (time, imported) for imported, time in best.items()
+            if '.' not in imported and imported not in startup and
+            imported != 'pysubunit')[::-1][:args.top]
+        sys.stdout.write('%-20s %8.1fms  %s\n' % (
+            name, best[module] / 1000.0, ', '.join(
+                '%s %.1fms' % (imported, time / 1000.0)
+                for time, imported in heaviest)))
+
+
+if __name__ == '__main__':
+    main()